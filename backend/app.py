@@ -1,5 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 import pandas as pd
 import geopandas as gpd
@@ -14,7 +15,7 @@ import os
 import glob
 import shutil
 import traceback
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
 import sys
 
@@ -34,27 +35,51 @@ DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
 SATELLITE_ZOOM_LEVEL = int(os.getenv('SATELLITE_ZOOM_LEVEL', 19))
 SATELLITE_TILE_FORMAT = os.getenv('SATELLITE_TILE_FORMAT', 'png')
 SATELLITE_TILE_SIZE = int(os.getenv('SATELLITE_TILE_SIZE', 256))
+TILE_SOURCE = os.getenv('TILE_SOURCE', 'here')
+TILE_SOURCE_PATH = os.getenv('TILE_SOURCE_PATH', '')
+
+# Configuración de procesamiento en paralelo y por lotes
+PROCESS_WORKERS = int(os.getenv('PROCESS_WORKERS', 1))
+PROCESS_BATCH_SIZE = int(os.getenv('PROCESS_BATCH_SIZE', 1000))
+INCREMENTAL_VALIDATION = os.getenv('INCREMENTAL_VALIDATION', 'True').lower() == 'true'
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', 1))
 
 # Configuración de rutas para adaptarse a la estructura del proyecto
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.getenv('DATA_DIR', os.path.join(BASE_DIR, 'data'))  # Data dir en la raíz del proyecto
 TEMP_DIR = os.getenv('TEMP_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp'))
 MODEL_PATH = os.getenv('MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models/modelo_camellones.pth'))
+MODEL_SIDES_PATH = os.getenv('MODEL_SIDES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models/modelo_sides.pth'))
+MODEL_PRELOAD = os.getenv('MODEL_PRELOAD', 'True').lower() == 'true'
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
 
 # Exportar las variables para que sean accesibles desde los módulos
 os.environ['API_KEY'] = API_KEY
 os.environ['DATA_DIR'] = DATA_DIR
 os.environ['TEMP_DIR'] = TEMP_DIR
 os.environ['MODEL_PATH'] = MODEL_PATH
+os.environ['MODEL_SIDES_PATH'] = MODEL_SIDES_PATH
+os.environ['CACHE_DIR'] = CACHE_DIR
 os.environ['SATELLITE_ZOOM_LEVEL'] = str(SATELLITE_ZOOM_LEVEL)
 os.environ['SATELLITE_TILE_FORMAT'] = SATELLITE_TILE_FORMAT
 os.environ['SATELLITE_TILE_SIZE'] = str(SATELLITE_TILE_SIZE)
+os.environ['TILE_SOURCE'] = TILE_SOURCE
+os.environ['TILE_SOURCE_PATH'] = TILE_SOURCE_PATH
+os.environ['PROCESS_WORKERS'] = str(PROCESS_WORKERS)
+os.environ['PROCESS_BATCH_SIZE'] = str(PROCESS_BATCH_SIZE)
+os.environ['INCREMENTAL_VALIDATION'] = str(INCREMENTAL_VALIDATION)
+os.environ['JOB_CONCURRENCY'] = str(JOB_CONCURRENCY)
 
 try:
     # Importar funciones desde módulos personalizados
-    from functions.cnn_functions import predecir
+    from functions.cnn_functions import predecir, predecir_por_lotes, cargar_modelos, info_modelos, PREDICTION_CACHE
     from functions.data_processing_functions import process_data
-    from functions.satellite_functions import punto_y_perpendicular, get_satellite_tile
+    from functions.satellite_functions import punto_y_perpendicular, get_satellite_tile, TILE_CACHE
+    from functions.cache_functions import hash_archivo
+    from functions.pipeline_functions import estado_pipeline
+    from functions.inference_pool_functions import estadisticas_pool
+    from functions.job_functions import JOBS, TrabajoCancelado, CANCELANDO
+    from functions.incremental_functions import predecir_incremental
 except ImportError as e:
     print(f"Error importando módulos: {e}")
     # Crear un mensaje de error más detallado
@@ -79,13 +104,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-POI-Count", "X-POIs-Per-Second", "X-POIs-Reused"],
 )
 
 # Asegurar que existan los directorios necesarios
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(TEMP_DIR, exist_ok=True)
+os.makedirs(CACHE_DIR, exist_ok=True)
 os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
 
+@app.on_event("startup")
+def precargar_modelos():
+    """Carga ambos modelos una sola vez al iniciar (o en su primer uso si MODEL_PRELOAD es False)."""
+    if MODEL_PRELOAD:
+        print(f"Modelos cargados: {cargar_modelos()}")
+
 def limpiar_archivos_temporales():
     """Limpia los archivos temporales generados durante el procesamiento."""
     for filename in os.listdir(TEMP_DIR):
@@ -101,45 +134,103 @@ async def root():
     """Endpoint raíz para verificar que la API está funcionando."""
     return {"message": "Camellones API está funcionando"}
 
+def validar(limit=None, batch_size=None, incremental=INCREMENTAL_VALIDATION, trabajo=None):
+    """
+    Ejecuta una validación completa (process_data + predicción). Es bloqueante: los endpoints la ejecutan en un hilo
+    para no detener el event loop.
+    
+    Args:
+        limit, batch_size, incremental: como en /process
+        trabajo: Trabajo que recibe la etapa y el avance, y que puede cancelar la ejecución (opcional)
+    
+    Returns:
+        tuple: (resultados de predecir, reporte de la ejecución)
+    """
+    # Verificar que existan los archivos necesarios
+    poi_path = os.path.join(DATA_DIR, 'POI.csv')
+    nav_path = os.path.join(DATA_DIR, 'NAV.geojson')
+    
+    if not os.path.exists(poi_path):
+        raise HTTPException(status_code=400, detail=f"Archivo POI.csv no encontrado en {poi_path}")
+    
+    if not os.path.exists(nav_path):
+        raise HTTPException(status_code=400, detail=f"Archivo NAV.geojson no encontrado en {nav_path}")
+    
+    # Procesar datos
+    try:
+        avance = None
+        if trabajo is not None:
+            trabajo.cambiar_etapa('process_data')
+            avance = trabajo.avance
+        print(f"Iniciando process_data()")
+        final_df, store = process_data(limit=limit, avance=avance)
+        print(f"Procesamiento exitoso, dataframe con {len(final_df)} filas")
+    except TrabajoCancelado:
+        raise
+    except Exception as e:
+        print(f"Error en process_data(): {str(e)}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error procesando datos: {str(e)}")
+    
+    # Realizar predicciones
+    try:
+        avance = None
+        if trabajo is not None:
+            trabajo.cambiar_etapa('predicción')
+            avance = trabajo.avance
+            trabajo.avance(0, len(final_df))
+        print(f"Iniciando predecir()")
+        reporte = {}
+        if incremental:
+            resultados = predecir_incremental(final_df, store, batch_size=batch_size, reporte=reporte, avance=avance)
+        else:
+            resultados = predecir_por_lotes(final_df, batch_size=batch_size, reporte=reporte, store=store, avance=avance)
+        print(f"Predicción exitosa, {len(resultados)} resultados en {reporte['segundos']:.1f}s ({reporte['pois_por_segundo']:.2f} POIs/s)")
+        print(f"Tiles: {reporte.get('tiles_referencias', 0)} referencias, {reporte.get('tiles_unicos', 0)} únicos (dedup {reporte.get('dedup_tiles', 0.0):.0%})")
+        print(f"Caché de tiles: {TILE_CACHE.estadisticas()}")
+        print(f"Predicciones: {reporte.get('predicciones_cache', 0)} desde caché, {reporte.get('predicciones_calculadas', 0)} calculadas")
+        for etapa, stats in reporte.get('etapas', {}).items():
+            print(f"Etapa {etapa}: {stats['workers']} workers, ocupación {stats['ocupacion']:.0%}, {stats['pois_por_segundo']:.2f} POIs/s, cola máx. {stats['cola_max']}")
+    except TrabajoCancelado:
+        raise
+    except Exception as e:
+        print(f"Error en predecir(): {str(e)}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error al realizar predicciones: {str(e)}")
+    
+    return resultados, reporte
+
 @app.get("/process")
-async def process_and_predict(background_tasks: BackgroundTasks):
+async def process_and_predict(
+    background_tasks: BackgroundTasks,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, description="Máximo de POIs a validar (vista previa); todos si se omite"),
+    batch_size: Optional[int] = Query(None, ge=1, description="POIs por lote; PROCESS_BATCH_SIZE si se omite"),
+    incremental: bool = Query(INCREMENTAL_VALIDATION, description="Reutilizar los resultados de POIs y links sin cambios")
+):
     """
     Endpoint para procesar datos y realizar predicciones.
+    Valida todos los POIs candidatos en lotes de tamaño acotado, salvo que se indique `limit`. `limit` solo acorta la
+    descarga de tiles y la inferencia: la lectura del NAV y el emparejamiento se hacen sobre todos los POIs, porque la
+    pareja de un link depende de los links a su alrededor.
+    El número de POIs procesados y el throughput se reportan en los headers X-POI-Count y X-POIs-Per-Second.
+    Con `incremental`, solo se recalculan los POIs nuevos o cuyos datos o links cambiaron desde la ejecución anterior
+    (la lectura del NAV y el emparejamiento se hacen siempre completos); X-POI-Count cuenta todos los POIs y el número
+    de resultados reutilizados se reporta en el header X-POIs-Reused.
+    La validación se ejecuta en un hilo, así que el servidor sigue atendiendo otras peticiones; para ejecuciones
+    largas con progreso y cancelación, usar /jobs.
     
     Returns:
         dict: Resultados de las predicciones en formato 
               {'POI_ID': {'x_cord': x, 'y_cord': y, 'POI_NAME': name, 'label': label}}
     """
     try:
-        # Verificar que existan los archivos necesarios
-        poi_path = os.path.join(DATA_DIR, 'POI.csv')
-        nav_path = os.path.join(DATA_DIR, 'NAV.geojson')
-        
-        if not os.path.exists(poi_path):
-            raise HTTPException(status_code=400, detail=f"Archivo POI.csv no encontrado en {poi_path}")
-        
-        if not os.path.exists(nav_path):
-            raise HTTPException(status_code=400, detail=f"Archivo NAV.geojson no encontrado en {nav_path}")
-        
-        # Procesar datos
-        try:
-            print(f"Iniciando process_data()")
-            final_df = process_data(slice=500)
-            print(f"Procesamiento exitoso, dataframe con {len(final_df)} filas")
-        except Exception as e:
-            print(f"Error en process_data(): {str(e)}")
-            print(traceback.format_exc())
-            raise HTTPException(status_code=500, detail=f"Error procesando datos: {str(e)}")
+        resultados, reporte = await run_in_threadpool(validar, limit, batch_size, incremental)
         
-        # Realizar predicciones
-        try:
-            print(f"Iniciando predecir()")
-            resultados = predecir(final_df)
-            print(f"Predicción exitosa, {len(resultados)} resultados")
-        except Exception as e:
-            print(f"Error en predecir(): {str(e)}")
-            print(traceback.format_exc())
-            raise HTTPException(status_code=500, detail=f"Error al realizar predicciones: {str(e)}")
+        if 'reutilizados' in reporte:
+            response.headers["X-POIs-Reused"] = str(reporte['reutilizados'])
+        response.headers["X-POI-Count"] = str(reporte['pois'])
+        response.headers["X-POIs-Per-Second"] = f"{reporte['pois_por_segundo']:.2f}"
         
         # Programar limpieza de archivos temporales
         background_tasks.add_task(limpiar_archivos_temporales)
@@ -156,6 +247,67 @@ async def process_and_predict(background_tasks: BackgroundTasks):
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=error_detail)
 
+def validar_trabajo(trabajo, **parametros):
+    """Función de los trabajos de /jobs: valida y limpia los archivos temporales al terminar."""
+    try:
+        return validar(trabajo=trabajo, **parametros)
+    finally:
+        limpiar_archivos_temporales()
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    limit: Optional[int] = Query(None, ge=1, description="Máximo de POIs a validar (vista previa); todos si se omite"),
+    batch_size: Optional[int] = Query(None, ge=1, description="POIs por lote; PROCESS_BATCH_SIZE si se omite"),
+    incremental: bool = Query(INCREMENTAL_VALIDATION, description="Reutilizar los resultados de POIs y links sin cambios")
+):
+    """
+    Inicia una validación (como /process) en segundo plano y devuelve su estado con el `job_id`.
+    Se ejecutan a la vez como máximo JOB_CONCURRENCY trabajos; el resto espera en cola.
+    """
+    trabajo = JOBS.crear(validar_trabajo, limit=limit, batch_size=batch_size, incremental=incremental)
+    return trabajo.resumen()
+
+@app.get("/jobs")
+async def list_jobs():
+    """Estado de los trabajos en cola, en curso y de los últimos terminados."""
+    return JOBS.listar()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Estado de un trabajo: status (queued, running, cancelling, completed, failed, cancelled), etapa, avance y total de
+    la etapa (pasos en process_data, POIs en la predicción), tiempo estimado restante (eta_seconds) y, al terminar, el
+    reporte de la ejecución o el error.
+    """
+    trabajo = JOBS.obtener(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return trabajo.resumen()
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    """Resultados de un trabajo completado, en el mismo formato que /process."""
+    trabajo = JOBS.obtener(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    if trabajo.estado != 'completed':
+        raise HTTPException(status_code=409, detail=f"El trabajo {job_id} no está completado (estado: {trabajo.estado})")
+    return trabajo.resultados
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancela un trabajo: si está en cola no llega a ejecutarse y si está en curso se detiene tras el paso o lote actual.
+    Mientras tanto responde 202 con status "cancelling".
+    """
+    trabajo = JOBS.cancelar(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    resumen = trabajo.resumen()
+    if resumen['status'] == CANCELANDO:
+        return JSONResponse(status_code=202, content=resumen)
+    return resumen
+
 @app.post("/api/upload-files", status_code=200)
 async def upload_files(
     poiFile: UploadFile = File(...),
@@ -201,6 +353,12 @@ async def upload_files(
             content = await streetsFile.read()
             f.write(content)
         
+        # Calcular el hash del archivo de calles para la caché de la red preprocesada
+        try:
+            print(f"Streets file hash: {await run_in_threadpool(hash_archivo, streets_path)}")
+        except Exception as e:
+            print(f"Warning: Could not hash streets file: {str(e)}")
+        
         print(f"Files saved to: {DATA_DIR}")
         print(f"POI file: {poi_path}")
         print(f"Streets file: {streets_path}")
@@ -234,6 +392,7 @@ async def health_check():
     data_exists = os.path.exists(DATA_DIR)
     temp_exists = os.path.exists(TEMP_DIR)
     model_exists = os.path.exists(MODEL_PATH)
+    sides_model_exists = os.path.exists(MODEL_SIDES_PATH)
     
     # Verificar que existen los archivos de datos
     poi_exists = os.path.exists(os.path.join(DATA_DIR, 'POI.csv'))
@@ -248,6 +407,7 @@ async def health_check():
             "data_directory": data_exists,
             "temp_directory": temp_exists,
             "model_file": model_exists,
+            "sides_model_file": sides_model_exists,
             "poi_file": poi_exists,
             "nav_file": nav_exists,
             "api_key": api_key_exists
@@ -256,9 +416,12 @@ async def health_check():
             "data_dir": DATA_DIR,
             "temp_dir": TEMP_DIR,
             "model_path": MODEL_PATH,
+            "model_sides_path": MODEL_SIDES_PATH,
             "base_dir": BASE_DIR,
             "current_dir": os.path.dirname(os.path.abspath(__file__))
-        }
+        },
+        # Tiempo de carga y hash de los pesos de cada modelo del registro
+        "models": info_modelos()
     }
     
     return status
@@ -274,6 +437,13 @@ async def env_info():
         "data_dir": DATA_DIR,
         "temp_dir": TEMP_DIR,
         "model_path": MODEL_PATH,
+        "cache_dir": CACHE_DIR,
+        "tile_source": TILE_SOURCE,
+        "tile_source_path": TILE_SOURCE_PATH,
+        "tile_cache": TILE_CACHE.estadisticas(),
+        "prediction_cache": PREDICTION_CACHE.estadisticas(),
+        "pipeline": estado_pipeline(),
+        "inference_pool": estadisticas_pool(),
         "port": PORT,
         "host": HOST,
         "debug": DEBUG,
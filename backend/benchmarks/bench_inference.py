@@ -0,0 +1,75 @@
+"""
+Benchmark de los backends de inferencia de las CNN (eager, torchscript, compile, onnx, int8) en CPU.
+
+Para cada backend verifica la paridad con el modelo fp32 sobre el conjunto fijo de imágenes de paridad y mide la
+latencia por lote (mediana) y el throughput en imágenes/s para varios tamaños de lote. Si el archivo del modelo no
+existe se usan pesos aleatorios con semilla fija (los tiempos no dependen de los pesos).
+
+Uso (desde backend/):
+    python benchmarks/bench_inference.py --modelo camellones --backends eager,torchscript,onnx,int8 --lotes 1,8,32,64
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.cnn_functions import MODELOS, resolver_ruta_modelo, preparar_lote
+from functions.inference_functions import BACKENDS, preparar_backend, imagenes_paridad, verificar_paridad
+
+def cargar_fp32(nombre):
+    """Loads the fp32 eager model `nombre` on CPU, with random weights if its file does not exist."""
+    clase, ruta, normalizar = MODELOS[nombre]
+    torch.manual_seed(0)
+    model = clase()
+    model_path, _ = resolver_ruta_modelo(ruta)
+    if os.path.exists(model_path):
+        model.load_state_dict(torch.load(model_path, map_location='cpu'))
+    else:
+        print(f"No se encontró {model_path}, se usan pesos aleatorios")
+    return model.eval(), normalizar
+
+def medir(model, lote, repeticiones):
+    """Median seconds per forward pass of `lote`, after two warm-up passes."""
+    tiempos = []
+    with torch.no_grad():
+        for k in range(repeticiones + 2):
+            inicio = time.perf_counter()
+            model(lote)
+            if k >= 2:
+                tiempos.append(time.perf_counter() - inicio)
+    return float(np.median(tiempos))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modelo', default='camellones', choices=list(MODELOS), help='Modelo del registro')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='Backends separados por comas')
+    parser.add_argument('--lotes', default='1,8,32,64', help='Tamaños de lote separados por comas')
+    parser.add_argument('--repeticiones', type=int, default=20, help='Pasadas medidas por tamaño de lote')
+    args = parser.parse_args()
+
+    model, normalizar = cargar_fp32(args.modelo)
+    entradas = preparar_lote(imagenes_paridad(), normalizar)
+    lotes = [int(s) for s in args.lotes.split(',')]
+    print(f"Modelo {args.modelo}, {torch.get_num_threads()} hilos de torch")
+
+    print(f"{'backend':>12} {'lote':>6} {'ms/lote':>10} {'imágenes/s':>12} {'max dif.':>10} {'acuerdo':>8}")
+    for backend in args.backends.split(','):
+        try:
+            optimizado = preparar_backend(model, backend, entradas[:1])
+            paridad = verificar_paridad(model, optimizado, entradas)
+        except Exception as e:
+            print(f"{backend:>12} no disponible: {e}")
+            continue
+        for n in lotes:
+            lote = entradas[np.arange(n) % len(entradas)]
+            segundos = medir(optimizado, lote, args.repeticiones)
+            print(f"{backend:>12} {n:>6} {segundos * 1000:>10.2f} {n / segundos:>12.1f} "
+                  f"{paridad['max_abs_diff']:>10.2e} {paridad['label_agreement']:>8.0%}")
+
+if __name__ == "__main__":
+    main()
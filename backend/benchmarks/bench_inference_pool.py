@@ -0,0 +1,96 @@
+"""
+Benchmark de escalabilidad del pool de procesos de inferencia (PoolInferencia).
+
+Mide el throughput de CamellonCNN en el proceso actual y con 1..N workers (cada uno con --hilos hilos de torch),
+enviando todos los lotes a la vez, y reporta la aceleración y la eficiencia respecto a un worker. En Linux también
+muestra la memoria compartida y privada media de los workers (los pesos se mapean una sola vez).
+Si el archivo del modelo no existe se usan pesos aleatorios con semilla fija.
+
+Uso (desde backend/):
+    python benchmarks/bench_inference_pool.py --workers 1,2,4,8 --lotes 64 --imagenes 32
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.cnn_functions import INPUT_SIZE, MODELOS, resolver_ruta_modelo
+from functions.inference_pool_functions import PoolInferencia
+
+def cargar_fp32(nombre):
+    """Loads the fp32 eager model `nombre` on CPU, with random weights if its file does not exist."""
+    clase, ruta, _ = MODELOS[nombre]
+    torch.manual_seed(0)
+    model = clase()
+    model_path, _ = resolver_ruta_modelo(ruta)
+    if os.path.exists(model_path):
+        model.load_state_dict(torch.load(model_path, map_location='cpu'))
+    else:
+        print(f"No se encontró {model_path}, se usan pesos aleatorios")
+    return model.eval()
+
+def memoria_worker(pid):
+    """Shared and private MB of a process according to /proc/<pid>/smaps_rollup, or None outside Linux."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            campos = {linea.split(':')[0]: int(linea.split()[1]) for linea in f if linea.split()[-1] == 'kB'}
+    except OSError:
+        return None
+    compartida = campos.get('Shared_Clean', 0) + campos.get('Shared_Dirty', 0)
+    privada = campos.get('Private_Clean', 0) + campos.get('Private_Dirty', 0)
+    return compartida / 1024, privada / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default=','.join(str(2 ** k) for k in range(8) if 2 ** k <= (os.cpu_count() or 1)),
+                        help='Número de workers separados por comas (por defecto potencias de 2 hasta los núcleos)')
+    parser.add_argument('--hilos', type=int, default=1, help='Hilos de torch por worker')
+    parser.add_argument('--lotes', type=int, default=64, help='Lotes enviados por medición')
+    parser.add_argument('--imagenes', type=int, default=32, help='Imágenes por lote')
+    args = parser.parse_args()
+
+    model = cargar_fp32('camellones')
+    lote = torch.rand((args.imagenes, 3) + INPUT_SIZE)
+    total = args.lotes * args.imagenes
+    print(f"{os.cpu_count()} núcleos, {args.lotes} lotes de {args.imagenes} imágenes, {args.hilos} hilo(s) por worker")
+
+    # Referencia: el mismo trabajo en este proceso
+    torch.set_num_threads(args.hilos)
+    with torch.no_grad():
+        model(lote)
+        inicio = time.perf_counter()
+        for _ in range(args.lotes):
+            model(lote)
+    local = total / (time.perf_counter() - inicio)
+    print(f"En proceso: {local:.1f} imágenes/s")
+
+    print(f"{'workers':>8} {'imágenes/s':>12} {'aceleración':>12} {'eficiencia':>11} {'MB compartidos':>15} {'MB privados':>12}")
+    base = None
+    for workers in [int(s) for s in args.workers.split(',')]:
+        pool = PoolInferencia(workers, (3,) + INPUT_SIZE, hilos=args.hilos, capacidad=args.imagenes)
+        try:
+            pool.registrar('camellones', model)
+            # Calentamiento: cada worker procesa al menos un lote
+            for resultado in [pool.enviar('camellones', lote) for _ in range(2 * workers)]:
+                resultado.result()
+
+            inicio = time.perf_counter()
+            for resultado in [pool.enviar('camellones', lote) for _ in range(args.lotes)]:
+                resultado.result()
+            throughput = total / (time.perf_counter() - inicio)
+            base = base or throughput / workers
+
+            memorias = [m for m in (memoria_worker(pid) for pid in pool.pids()) if m is not None]
+            compartida = sum(m[0] for m in memorias) / len(memorias) if memorias else float('nan')
+            privada = sum(m[1] for m in memorias) / len(memorias) if memorias else float('nan')
+            print(f"{workers:>8} {throughput:>12.1f} {throughput / base:>12.2f} {throughput / (base * workers):>11.0%} "
+                  f"{compartida:>15.1f} {privada:>12.1f}")
+        finally:
+            pool.cerrar()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark de escalabilidad para la búsqueda de parejas de carriles (encontrar_link_alineados_fulldf).
+
+Genera redes sintéticas de calzadas multi-digitalizadas (pares de links paralelos separados ~11 m)
+y mide el tiempo de emparejamiento desde 1k hasta 1M de links. Con --workers también mide la versión paralela
+(encontrar_link_alineados_paralelo) para cada número de procesos, su aceleración respecto a la serial y si el
+resultado es idéntico.
+
+Uso (desde backend/):
+    python benchmarks/bench_pairing.py --sizes 1000,10000,100000,1000000 --workers 2,4,8
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.data_processing_functions import (
+    GeometryStore, preparar_arreglos_links, encontrar_link_alineados_fulldf, encontrar_link_alineados_paralelo
+)
+
+def generar_links(n_links, seed=0):
+    """Creates a DataFrame with `n_links` links (LINK_ID, geom_idx) arranged as parallel carriageway pairs, and their GeometryStore."""
+    rng = np.random.default_rng(seed)
+    n_pares = n_links // 2
+    # Densidad constante: el área crece con el número de links
+    lado = 0.002 * np.sqrt(n_pares)
+    origen = rng.random((n_pares, 2)) * lado + np.array([-103.4, 20.6])
+    angulo = rng.random(n_pares) * 2 * np.pi
+    direccion = np.stack([np.cos(angulo), np.sin(angulo)], axis=1) * 0.0005
+    normal = np.stack([-direccion[:, 1], direccion[:, 0]], axis=1) / 0.0005 * 0.0001
+
+    # Tres nodos por link: inicio, medio y fin
+    inicios = np.concatenate([origen, origen + normal])
+    pasos = np.concatenate([direccion, direccion])
+    coords = np.stack([inicios, inicios + pasos / 2, inicios + pasos], axis=1).reshape(-1, 2)
+    n = len(inicios)
+
+    store = GeometryStore(np.arange(n), np.arange(0, 3 * n + 1, 3), coords)
+    return pd.DataFrame({'LINK_ID': np.arange(n), 'geom_idx': np.arange(n)}), store
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help='Número de links separados por comas')
+    parser.add_argument('--workers', default='', help='Procesos de la versión paralela separados por comas (ninguno por defecto)')
+    args = parser.parse_args()
+    workers = [int(s) for s in args.workers.split(',') if s]
+
+    print(f"{os.cpu_count()} núcleos")
+    print(f"{'links':>10} {'workers':>8} {'segundos':>10} {'links/s':>12} {'parejas':>10} {'aceleración':>12} {'idéntico':>9}")
+    for n in [int(s) for s in args.sizes.split(',')]:
+        df, store = generar_links(n)
+        inicio = time.perf_counter()
+        links = preparar_arreglos_links(df, store)
+        encontrar_link_alineados_fulldf(links, df)
+        serial = time.perf_counter() - inicio
+        parejas = int((df['pareja'] != 'Error 3: road is not Multiply Digitised').sum() // 2)
+        print(f"{n:>10} {'serial':>8} {serial:>10.2f} {n / serial:>12.0f} {parejas:>10}")
+
+        for w in workers:
+            paralelo = df.drop(columns='pareja')
+            inicio = time.perf_counter()
+            links = preparar_arreglos_links(paralelo, store)
+            encontrar_link_alineados_paralelo(links, paralelo, w)
+            segundos = time.perf_counter() - inicio
+            identico = (paralelo['pareja'].astype(str).to_numpy() == df['pareja'].astype(str).to_numpy()).all()
+            parejas = int((paralelo['pareja'] != 'Error 3: road is not Multiply Digitised').sum() // 2)
+            print(f"{n:>10} {w:>8} {segundos:>10.2f} {n / segundos:>12.0f} {parejas:>10} {serial / segundos:>12.2f} "
+                  f"{'sí' if identico else 'NO':>9}")
+
+if __name__ == "__main__":
+    main()
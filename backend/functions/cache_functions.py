@@ -0,0 +1,379 @@
+import numpy as np
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+
+# Use environment variables
+CACHE_DIR = os.environ.get('CACHE_DIR', 'cache')
+NETWORK_CACHE_DIR = os.path.join(CACHE_DIR, 'network')
+NETWORK_CACHE_MAX_BYTES = int(os.environ.get('NETWORK_CACHE_MAX_BYTES', 1024 ** 3))
+TILE_CACHE_DIR = os.path.join(CACHE_DIR, 'tiles')
+TILE_CACHE_MEMORY_BYTES = int(os.environ.get('TILE_CACHE_MEMORY_BYTES', 256 * 1024 ** 2))
+TILE_CACHE_DISK_BYTES = int(os.environ.get('TILE_CACHE_DISK_BYTES', 2 * 1024 ** 3))
+PREDICTION_CACHE_PATH = os.path.join(CACHE_DIR, 'predicciones.sqlite')
+PREDICTION_CACHE_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', 1_000_000))
+
+# Funciones de hash de archivos
+def hash_archivo(path: str, block_size=1024 * 1024, sidecar=True):
+    """
+    Computes the SHA-256 of a file's content. Unless `sidecar` is False, the result is stored in a `<path>.sha256`
+    sidecar together with the file size and modification time, so it is only recomputed when the file changes.
+
+    Input: File path
+
+    Output: Hexadecimal digest
+    """
+    stat = os.stat(path)
+    sidecar_path = f"{path}.sha256"
+    if sidecar:
+        try:
+            with open(sidecar_path, 'r') as f:
+                info = json.load(f)
+            if info['size'] == stat.st_size and info['mtime_ns'] == stat.st_mtime_ns:
+                return info['sha256']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+
+    if sidecar:
+        try:
+            with open(sidecar_path, 'w') as f:
+                json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}, f)
+        except OSError as e:
+            print(f"No se pudo guardar el hash de {path}: {e}")
+    return sha256
+
+def hash_imagen(imagen):
+    """Digest (16 bytes) of a decoded image: its shape and pixels."""
+    digest = hashlib.blake2b(repr(imagen.shape).encode('utf-8'), digest_size=16)
+    digest.update(np.ascontiguousarray(imagen).data)
+    return digest.digest()
+
+def hash_claves(*partes):
+    """Builds a cache key from strings, numbers and NumPy arrays."""
+    digest = hashlib.sha256()
+    for parte in partes:
+        if isinstance(parte, np.ndarray):
+            digest.update(np.ascontiguousarray(parte).tobytes())
+        else:
+            digest.update(repr(parte).encode('utf-8'))
+        digest.update(b'|')
+    return digest.hexdigest()
+
+# Almacenamiento en disco con expulsión LRU
+def aplicar_limite_cache(directorio: str, max_bytes: int):
+    """
+    Deletes the least recently used files of a cache directory (oldest modification time first, since hits touch
+    the files) until its total size is at most `max_bytes`.
+    """
+    archivos = []
+    for entry in os.scandir(directorio):
+        if entry.is_file() and not entry.name.startswith('.'):
+            stat = entry.stat()
+            archivos.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in archivos)
+    for _, size, path in sorted(archivos):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def guardar_arreglos(directorio: str, clave: str, max_bytes: int, **arreglos):
+    """
+    Stores a set of NumPy arrays as `<clave>.npz`. The file is written to a temporary name and renamed, so
+    concurrent readers never see a partial file. The directory is trimmed to `max_bytes` afterwards.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directorio, prefix='.tmp_', suffix='.npz')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arreglos)
+        os.replace(tmp_path, os.path.join(directorio, f"{clave}.npz"))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    aplicar_limite_cache(directorio, max_bytes)
+
+def cargar_arreglos(directorio: str, clave: str):
+    """
+    Loads the arrays stored under `clave` and marks the entry as recently used.
+
+    Output: Dictionary {name: array}, or None if the entry does not exist or is unreadable
+    """
+    path = os.path.join(directorio, f"{clave}.npz")
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            arreglos = {k: data[k] for k in data.files}
+        os.utime(path)
+        return arreglos
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None
+
+# Caché de tiles satelitales en dos niveles
+class TileCache:
+    """
+    Two-level cache of satellite tiles: an in-process LRU of decoded images (NumPy arrays), limited to `memory_bytes`,
+    backed by a persistent disk store of the encoded tiles, limited to `disk_bytes`. Entries are keyed by
+    (zoom, x, y, format, size, style); a limit of 0 disables that level.
+
+    Disk entries are written atomically and never modified, so several threads or worker processes can share the
+    same directory. Cached images are shared between callers and must not be modified in place.
+    """
+
+    def __init__(self, directorio, memory_bytes, disk_bytes):
+        self.directorio = directorio
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._imagenes = OrderedDict()
+        self._bytes_memoria = 0
+        self._bytes_disco = None
+        self._lock = threading.Lock()
+        self.contadores = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def _path(self, clave):
+        return os.path.join(self.directorio, f"{hash_claves(*clave)}.{clave[3]}")
+
+    def _contar(self, contador):
+        with self._lock:
+            self.contadores[contador] += 1
+
+    def _guardar_en_memoria(self, clave, imagen):
+        tamano = imagen.nbytes
+        if tamano > self.memory_bytes:
+            return
+        with self._lock:
+            anterior = self._imagenes.pop(clave, None)
+            if anterior is not None:
+                self._bytes_memoria -= anterior[1]
+            self._imagenes[clave] = (imagen, tamano)
+            self._bytes_memoria += tamano
+            while self._bytes_memoria > self.memory_bytes:
+                _, (_, liberado) = self._imagenes.popitem(last=False)
+                self._bytes_memoria -= liberado
+                self.contadores['evictions'] += 1
+
+    def obtener_imagen(self, clave, decodificar, disco=True):
+        """
+        Looks a tile up in memory and then, unless `disco` is False, on disk.
+
+        Input: Tile key, function that turns the encoded bytes into an image, whether to use the disk store
+
+        Output: Decoded image, or None on a miss
+        """
+        with self._lock:
+            entrada = self._imagenes.get(clave)
+            if entrada is not None:
+                self._imagenes.move_to_end(clave)
+                self.contadores['memory_hits'] += 1
+                return entrada[0]
+
+        contenido = self.obtener_bytes(clave, contar=False) if disco else None
+        if contenido is None:
+            self._contar('misses')
+            return None
+        imagen = decodificar(contenido)
+        self._contar('disk_hits')
+        if self.memory_bytes > 0:
+            self._guardar_en_memoria(clave, imagen)
+        return imagen
+
+    def obtener_bytes(self, clave, contar=True):
+        """Returns the encoded tile stored on disk (marking it as recently used), or None."""
+        if self.disk_bytes <= 0:
+            contenido = None
+        else:
+            path = self._path(clave)
+            try:
+                with open(path, 'rb') as f:
+                    contenido = f.read()
+                os.utime(path)
+            except OSError:
+                contenido = None
+        if contar:
+            self._contar('disk_hits' if contenido is not None else 'misses')
+        return contenido
+
+    def guardar(self, clave, contenido, imagen=None, disco=True):
+        """
+        Stores an encoded tile on disk (unless `disco` is False, e.g. for tiles that are already read from local
+        storage) and, if given, its decoded image in memory.
+        """
+        self._contar('stores')
+        if imagen is not None and self.memory_bytes > 0:
+            self._guardar_en_memoria(clave, imagen)
+        if self.disk_bytes <= 0 or not disco:
+            return
+
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directorio, prefix='.tmp_')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(contenido)
+            os.replace(tmp_path, self._path(clave))
+        except OSError as e:
+            print(f"No se pudo guardar el tile en caché: {e}")
+            return
+
+        # El tamaño del directorio solo se recalcula al superar el límite (otros procesos también escriben)
+        with self._lock:
+            if self._bytes_disco is None:
+                self._bytes_disco = sum(e.stat().st_size for e in os.scandir(self.directorio) if e.is_file())
+            else:
+                self._bytes_disco += len(contenido)
+            recortar = self._bytes_disco > self.disk_bytes
+            if recortar:
+                self._bytes_disco = None
+        if recortar:
+            # Dejar margen para no recorrer el directorio en cada escritura
+            aplicar_limite_cache(self.directorio, int(self.disk_bytes * 0.9))
+
+    def estadisticas(self):
+        """Returns the hit/miss counters and the current memory usage."""
+        with self._lock:
+            return {**self.contadores, 'memory_entries': len(self._imagenes), 'memory_bytes': self._bytes_memoria}
+
+# Caché persistente de salidas de las CNN
+class PredictionCache:
+    """
+    Persistent cache of CNN outputs in SQLite, keyed by (model name, model version, image digest). The version
+    identifies the weights, the inference backend and the preprocessing, so a new model file never reuses old
+    outputs; invalidar() deletes the entries of the previous versions of a model. At most `max_entries` are kept,
+    evicting the least recently used; a limit of 0 disables the cache.
+
+    The database is in WAL mode, so several threads and worker processes can share it.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._conexion = None
+        self._entradas = None
+        self._lock = threading.Lock()
+        self.contadores = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def _conectar(self):
+        if self._conexion is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conexion = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS predicciones ("
+                "modelo TEXT, version TEXT, imagen BLOB, salida REAL, usado REAL, "
+                "PRIMARY KEY (modelo, version, imagen)) WITHOUT ROWID"
+            )
+            conexion.execute("CREATE INDEX IF NOT EXISTS predicciones_usado ON predicciones (usado)")
+            conexion.commit()
+            self._conexion = conexion
+        return self._conexion
+
+    def obtener(self, modelo, version, imagenes):
+        """
+        Looks up the outputs of a model version for many images and marks the hits as recently used.
+
+        Input: Model name, model version, list of image digests (see hash_imagen)
+
+        Output: Dictionary {image digest: output} with the hits
+        """
+        if self.max_entries <= 0 or not imagenes:
+            return {}
+        encontradas = {}
+        ahora = time.time()
+        try:
+            with self._lock:
+                conexion = self._conectar()
+                unicas = list(set(imagenes))
+                # SQLite limita el número de parámetros por consulta
+                for desde in range(0, len(unicas), 500):
+                    parte = unicas[desde:desde + 500]
+                    filas = conexion.execute(
+                        f"SELECT imagen, salida FROM predicciones WHERE modelo = ? AND version = ? AND imagen IN ({','.join('?' * len(parte))})",
+                        [modelo, version, *parte]
+                    ).fetchall()
+                    encontradas.update(filas)
+                conexion.executemany(
+                    "UPDATE predicciones SET usado = ? WHERE modelo = ? AND version = ? AND imagen = ?",
+                    [(ahora, modelo, version, imagen) for imagen in encontradas]
+                )
+                conexion.commit()
+                aciertos = sum(imagen in encontradas for imagen in imagenes)
+                self.contadores['hits'] += aciertos
+                self.contadores['misses'] += len(imagenes) - aciertos
+        except sqlite3.Error as e:
+            print(f"Error al leer la caché de predicciones: {e}")
+            return {}
+        return encontradas
+
+    def guardar(self, modelo, version, salidas):
+        """Stores the outputs {image digest: output} of a model version and trims the cache to `max_entries`."""
+        if self.max_entries <= 0 or not salidas:
+            return
+        ahora = time.time()
+        try:
+            with self._lock:
+                conexion = self._conectar()
+                conexion.executemany(
+                    "INSERT OR REPLACE INTO predicciones (modelo, version, imagen, salida, usado) VALUES (?, ?, ?, ?, ?)",
+                    [(modelo, version, imagen, float(salida), ahora) for imagen, salida in salidas.items()]
+                )
+                self.contadores['stores'] += len(salidas)
+
+                # El número de entradas solo se recuenta al superar el límite (otros procesos también escriben)
+                if self._entradas is None:
+                    self._entradas = conexion.execute("SELECT COUNT(*) FROM predicciones").fetchone()[0]
+                else:
+                    self._entradas += len(salidas)
+                if self._entradas > self.max_entries:
+                    self._entradas = conexion.execute("SELECT COUNT(*) FROM predicciones").fetchone()[0]
+                    # Dejar margen para no recortar en cada escritura
+                    sobrantes = self._entradas - int(self.max_entries * 0.9)
+                    if sobrantes > 0:
+                        conexion.execute(
+                            "DELETE FROM predicciones WHERE (modelo, version, imagen) IN "
+                            "(SELECT modelo, version, imagen FROM predicciones ORDER BY usado LIMIT ?)",
+                            (sobrantes,)
+                        )
+                        self._entradas -= sobrantes
+                        self.contadores['evictions'] += sobrantes
+                conexion.commit()
+        except sqlite3.Error as e:
+            print(f"No se pudo guardar en la caché de predicciones: {e}")
+
+    def invalidar(self, modelo, version):
+        """Deletes the entries of every version of `modelo` other than `version` (e.g. after loading a new model file)."""
+        if self.max_entries <= 0:
+            return 0
+        try:
+            with self._lock:
+                conexion = self._conectar()
+                borradas = conexion.execute(
+                    "DELETE FROM predicciones WHERE modelo = ? AND version <> ?", (modelo, version)
+                ).rowcount
+                conexion.commit()
+                if borradas and self._entradas is not None:
+                    self._entradas -= borradas
+                return borradas
+        except sqlite3.Error as e:
+            print(f"No se pudo invalidar la caché de predicciones: {e}")
+            return 0
+
+    def estadisticas(self):
+        """Returns the hit/miss counters and the number of stored entries."""
+        with self._lock:
+            return {**self.contadores, 'entries': self._entradas}
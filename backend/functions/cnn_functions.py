@@ -1,15 +1,21 @@
 import torch
-import pandas as pd
-import ast
+import torch.nn.functional as F
 from PIL import Image
-from torchvision import transforms
 import numpy as np
-import requests
 import math
 import os
+import threading
+import time
 
 # Import functions 
-from functions.satellite_functions import punto_y_perpendicular, get_satellite_tile
+from functions.cache_functions import hash_archivo, hash_imagen, PredictionCache, PREDICTION_CACHE_PATH, PREDICTION_CACHE_MAX_ENTRIES
+from functions.pipeline_functions import ejecutar_pipeline, combinar_estadisticas
+from functions.inference_functions import INFERENCE_BACKEND, preparar_backend, imagenes_paridad, verificar_paridad
+from functions.inference_pool_functions import INFERENCE_WORKERS, ModeloRemoto, obtener_pool
+from functions.satellite_functions import (
+    punto_y_perpendicular, punto_y_perpendicular_lote, aplanar_geometrias, subconjunto_geometrias, obtener_tiles,
+    recortes_centrados, TILE_MOSAIC
+)
 
 # Utilizar variables de entorno
 API_KEY = os.environ.get('API_KEY', os.environ.get('REACT_APP_HERE_API_KEY'))
@@ -17,12 +23,32 @@ DATA_DIR = os.environ.get('DATA_DIR', '../data')
 TEMP_DIR = os.environ.get('TEMP_DIR', 'temp')
 MODEL_PATH = os.environ.get('MODEL_PATH', '../models/modelo_camellones.pth')
 MODEL_SIDES_PATH = os.environ.get('MODEL_SIDES_PATH', '../models/modelo_sides.pth')
+MODEL_DEVICE = os.environ.get('MODEL_DEVICE', '')
 
 # Set satellite images parameters
 ZOOM_LEVEL = int(os.environ.get('SATELLITE_ZOOM_LEVEL', 19))
 TILE_FORMAT = os.environ.get('SATELLITE_TILE_FORMAT', 'png')
 TILE_SIZE = int(os.environ.get('SATELLITE_TILE_SIZE', 256))
 
+# Número de POIs por lote en las ejecuciones completas
+PROCESS_BATCH_SIZE = int(os.environ.get('PROCESS_BATCH_SIZE', 1000))
+
+# Pipeline de predicción: lotes pequeños que pasan por etapas concurrentes
+INFERENCE_PIPELINE = os.environ.get('INFERENCE_PIPELINE', 'True').lower() == 'true'
+PIPELINE_CHUNK_SIZE = int(os.environ.get('PIPELINE_CHUNK_SIZE', 64))
+PIPELINE_FETCH_WORKERS = int(os.environ.get('PIPELINE_FETCH_WORKERS', 2))
+PIPELINE_PREPROCESS_WORKERS = int(os.environ.get('PIPELINE_PREPROCESS_WORKERS', 2))
+
+# Entrada de las CNN e imágenes por pasada de inferencia
+INPUT_SIZE = (128, 128)
+INFERENCE_BATCH_SIZE = int(os.environ.get('INFERENCE_BATCH_SIZE', 64))
+_inferencia_lock = threading.Lock()
+
+# Versión del preprocesamiento (decodificación de tiles y preparar_lote): incrementarla con cada cambio que altere las
+# entradas de las CNN, ya que invalida las salidas de la caché de predicciones y los resultados de la validación incremental
+PREPROCESS_VERSION = 1
+PREDICTION_CACHE = PredictionCache(PREDICTION_CACHE_PATH, PREDICTION_CACHE_MAX_ENTRIES)
+
 # Class definition convolutional neural network
 class CamellonCNN(torch.nn.Module):
     def __init__(self):
@@ -58,70 +84,344 @@ class SidesCNN(torch.nn.Module):
     def forward(self, x):
         return self.net(x)
 
+def resolver_ruta_modelo(model_path):
+    """
+    Resolves the path of a model file. Relative paths are searched in functions/, backend/ and the project root.
+
+    Input: Model path (absolute or relative)
+
+    Output: Tuple (resolved path, or the given one if no candidate exists; list of tried paths)
+    """
+    potential_paths = [model_path]
+    if not os.path.isabs(model_path):
+        # Si la ruta es relativa, buscar en el directorio actual y luego ir hacia arriba
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        potential_paths = [
+            os.path.join(script_dir, model_path),                     # backend/functions/models/...
+            os.path.join(os.path.dirname(script_dir), model_path),    # backend/models/...
+            os.path.join(os.path.dirname(os.path.dirname(script_dir)), model_path)  # root/models/...
+        ]
+        
+        for path in potential_paths:
+            if os.path.exists(path):
+                return path, potential_paths
+    
+    return model_path, potential_paths
+
+# Registro de modelos compartido por todo el proceso: clase, ruta y si la entrada se normaliza
+MODELOS = {
+    'camellones': (CamellonCNN, MODEL_PATH, False),
+    'sides': (SidesCNN, MODEL_SIDES_PATH, True),
+}
+_registro = {}
+_registro_lock = threading.Lock()
+
+def _aplicar_backend(nombre, model, device, normalizar):
+    """
+    Moves a loaded model to INFERENCE_BACKEND if it passes the parity check against the fp32 model on a fixed image
+    set; otherwise, or if the backend is not available, the eager model is kept.
+
+    Output: Tuple (model to use, backend information for info_modelos)
+    """
+    if INFERENCE_BACKEND == 'eager':
+        return model, {'backend': 'eager'}
+    try:
+        entradas = preparar_lote(imagenes_paridad(), normalizar).to(device)
+        optimizado = preparar_backend(model, INFERENCE_BACKEND, entradas[:1])
+        paridad = verificar_paridad(model, optimizado, entradas)
+    except Exception as e:
+        print(f"No se pudo usar el backend {INFERENCE_BACKEND} para el modelo {nombre}, se usa eager: {e}")
+        return model, {'backend': 'eager', 'backend_error': str(e)}
+    if not paridad['ok']:
+        print(f"El backend {INFERENCE_BACKEND} no pasó la verificación de paridad para el modelo {nombre}, se usa eager: {paridad}")
+        return model, {'backend': 'eager', 'parity': {INFERENCE_BACKEND: paridad}}
+    return optimizado, {'backend': INFERENCE_BACKEND, 'parity': {INFERENCE_BACKEND: paridad}}
+
+def _cargar_modelo(nombre):
+    """
+    Loads model `nombre` of MODELOS in eval mode on INFERENCE_BACKEND, runs a warm-up forward pass and records its
+    load information. With INFERENCE_WORKERS on CPU, the model runs in the worker pool (see PoolInferencia).
+    """
+    clase, ruta, normalizar = MODELOS[nombre]
+    model_path, potential_paths = resolver_ruta_modelo(ruta)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"No se encontró el modelo en la ruta: {model_path}. Rutas probadas: {potential_paths}")
+    
+    print(f"Usando modelo {nombre} en: {model_path}")
+    inicio = time.perf_counter()
+    device = torch.device(MODEL_DEVICE) if MODEL_DEVICE else torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = clase()
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.to(device)
+    model.eval()
+    optimizado, info_backend = _aplicar_backend(nombre, model, device, normalizar)
+    if INFERENCE_WORKERS > 0 and device.type == 'cpu':
+        # Los workers comparten los pesos fp32 y aplican el backend elegido por su cuenta
+        pool = obtener_pool((3,) + INPUT_SIZE, INFERENCE_BATCH_SIZE)
+        pool.registrar(nombre, model, info_backend['backend'])
+        info_backend['workers'] = pool.workers
+        local, model = model, ModeloRemoto(pool, nombre)
+    else:
+        local = model = optimizado
+    carga = time.perf_counter() - inicio
+    
+    # Las salidas guardadas de otros pesos, backends o preprocesamientos ya no son válidas
+    sha256 = hash_archivo(model_path, sidecar=False)
+    version = f"{sha256}|{info_backend['backend']}|{PREPROCESS_VERSION}"
+    PREDICTION_CACHE.invalidar(nombre, version)
+    
+    # Pasada de calentamiento para no pagar la inicialización en la primera predicción
+    inicio = time.perf_counter()
+    with torch.no_grad():
+        model(torch.zeros((1, 3) + INPUT_SIZE, device=device))
+    calentamiento = time.perf_counter() - inicio
+    
+    return {
+        'model': model,
+        # Modelo en este proceso; con el pool mantiene vivos los pesos compartidos con los workers
+        'local': local,
+        'device': device,
+        'info': {
+            'path': model_path,
+            'device': str(device),
+            'load_seconds': round(carga, 4),
+            'warmup_seconds': round(calentamiento, 4),
+            'sha256': sha256,
+            'version': version,
+            **info_backend
+        }
+    }
+
+def obtener_modelo(nombre):
+    """
+    Returns a model of the registry ('camellones' or 'sides'), loading it on first use. Every caller in the process
+    shares the same instance, so weights are read from disk only once.
+
+    Output: Tuple (model in eval mode, device)
+    """
+    entrada = _registro.get(nombre)
+    if entrada is None:
+        with _registro_lock:
+            entrada = _registro.get(nombre)
+            if entrada is None:
+                entrada = _registro[nombre] = _cargar_modelo(nombre)
+    return entrada['model'], entrada['device']
+
+def cargar_modelos():
+    """Loads every model of the registry (at startup); missing model files are reported and left for lazy loading."""
+    for nombre in MODELOS:
+        try:
+            obtener_modelo(nombre)
+        except FileNotFoundError as e:
+            print(f"No se pudo cargar el modelo {nombre}: {e}")
+    return info_modelos()
+
+def info_modelos():
+    """
+    Returns the path, device, load and warm-up time, weight hash and inference backend (with its parity check) of
+    every model, or loaded=False if it is not loaded yet.
+    """
+    return {
+        nombre: {'loaded': True, **_registro[nombre]['info']} if nombre in _registro else {'loaded': False}
+        for nombre in MODELOS
+    }
+
+def preparar_lote(imagenes, normalizar=False):
+    """
+    Preprocesses a batch of images for the CNNs on tensors: resizes to INPUT_SIZE with `F.interpolate` (bilinear,
+    antialiased, directly on uint8 so only the small images are converted to float), scales to [0, 1] and, for the
+    sides model, normalizes to [-1, 1].
+
+    Input: List of RGB uint8 arrays (height, width, 3), e.g. decoded tiles or mosaic crops; whether to normalize
+
+    Output: Float tensor (N, 3, 128, 128)
+    """
+    lote = torch.empty((len(imagenes), 3) + INPUT_SIZE)
+    # Las imágenes del mismo tamaño se redimensionan juntas
+    por_forma = {}
+    for i, imagen in enumerate(imagenes):
+        por_forma.setdefault(imagen.shape, []).append(i)
+    for indices in por_forma.values():
+        x = torch.stack([torch.from_numpy(np.asarray(imagenes[i])) for i in indices]).permute(0, 3, 1, 2)
+        lote[indices] = F.interpolate(x, size=INPUT_SIZE, mode='bilinear', align_corners=False, antialias=True).float().div_(255)
+    if normalizar:
+        lote.sub_(0.5).div_(0.5)
+    return lote
+
+def preparar_lotes(imagenes, normalizar=False, batch_size=None):
+    """
+    Splits many images into batches of `batch_size` (INFERENCE_BATCH_SIZE by default) and preprocesses each one with
+    preparar_lote.
+
+    Input: List of RGB uint8 arrays, whether to normalize (sides model), images per batch
+
+    Output: List of (first index, end index, tensor), with the exception instead of the tensor for a failed batch
+    """
+    batch_size = batch_size or INFERENCE_BATCH_SIZE
+    lotes = []
+    for desde in range(0, len(imagenes), batch_size):
+        hasta = min(desde + batch_size, len(imagenes))
+        try:
+            lotes.append((desde, hasta, preparar_lote(imagenes[desde:hasta], normalizar)))
+        except Exception as e:
+            lotes.append((desde, hasta, e))
+    return lotes
+
+def inferir_lotes(model, device, lotes, total):
+    """
+    Runs a CNN over batches prepared by preparar_lotes. Local forward passes are serialized across threads, since each
+    one already uses all of torch's intra-op threads; models in the worker pool get every batch at once, so the
+    workers run them in parallel.
+
+    Input: Model and device, list of batches from preparar_lotes, number of images
+
+    Output: Tuple (array with the sigmoid output of each image, NaN where its batch failed; dictionary
+            {image index: exception} for the images of failed batches)
+    """
+    salidas = np.full(total, np.nan)
+    errores = {}
+    enviados = []
+    for desde, hasta, lote in lotes:
+        try:
+            if isinstance(lote, Exception):
+                raise lote
+            if isinstance(model, ModeloRemoto):
+                enviados.append((desde, hasta, model.enviar(lote)))
+                continue
+            with _inferencia_lock, torch.no_grad():
+                output = model(lote.to(device))
+            salidas[desde:hasta] = output.reshape(-1).float().cpu().numpy()
+        except Exception as e:
+            errores.update(dict.fromkeys(range(desde, hasta), e))
+    for desde, hasta, resultado in enviados:
+        try:
+            salidas[desde:hasta] = resultado.result()
+        except Exception as e:
+            errores.update(dict.fromkeys(range(desde, hasta), e))
+    return salidas, errores
+
+def inferir(model, device, imagenes, normalizar=False, batch_size=None):
+    """
+    Runs a CNN over many images in batches of `batch_size` (INFERENCE_BATCH_SIZE by default), preprocessing each batch
+    with preparar_lote.
+
+    Input: Model and device, list of RGB uint8 arrays, whether to normalize (sides model), images per batch
+
+    Output: As inferir_lotes
+    """
+    return inferir_lotes(model, device, preparar_lotes(imagenes, normalizar, batch_size), len(imagenes))
+
+def version_cache(nombre, model=None):
+    """
+    Version of a registry model for the prediction cache (weights, backend and preprocessing), or None if the cache
+    is disabled, the model cannot be loaded or `model` is not the registry's model.
+    """
+    if PREDICTION_CACHE.max_entries <= 0:
+        return None
+    try:
+        registrado, _ = obtener_modelo(nombre)
+    except FileNotFoundError:
+        return None
+    if model is not None and model is not registrado:
+        return None
+    return _registro[nombre]['info']['version']
+
+def preparar_entradas(nombre, imagenes, normalizar=False, version=None):
+    """
+    Looks the images up in the prediction cache under model `nombre` and `version` and preprocesses only the misses
+    (see preparar_lotes).
+
+    Input: Registry model name, list of RGB uint8 arrays, whether to normalize, version from version_cache (None
+           skips the cache)
+
+    Output: Dictionary for inferir_entradas
+    """
+    salidas = np.full(len(imagenes), np.nan)
+    claves = None
+    if version is not None:
+        claves = [hash_imagen(imagen) for imagen in imagenes]
+        guardadas = PREDICTION_CACHE.obtener(nombre, version, claves)
+        for j, clave in enumerate(claves):
+            if clave in guardadas:
+                salidas[j] = guardadas[clave]
+    faltantes = [j for j in range(len(imagenes)) if np.isnan(salidas[j])]
+    return {
+        'nombre': nombre, 'version': version, 'claves': claves, 'salidas': salidas, 'faltantes': faltantes,
+        'lotes': preparar_lotes([imagenes[j] for j in faltantes], normalizar)
+    }
+
+def inferir_entradas(model, device, entradas, reporte=None):
+    """
+    Runs a CNN over the cache misses of preparar_entradas and stores their outputs in the prediction cache.
+
+    Input: Model and device, dictionary from preparar_entradas, optional dictionary where the outputs taken from the
+           cache (predicciones_cache) and computed (predicciones_calculadas) are accumulated
+
+    Output: As inferir_lotes, for every image given to preparar_entradas
+    """
+    salidas, faltantes = entradas['salidas'], entradas['faltantes']
+    calculadas, errores_faltantes = inferir_lotes(model, device, entradas['lotes'], len(faltantes))
+    salidas[faltantes] = calculadas
+    errores = {faltantes[j]: e for j, e in errores_faltantes.items()}
+    
+    if entradas['version'] is not None:
+        PREDICTION_CACHE.guardar(entradas['nombre'], entradas['version'], {
+            entradas['claves'][faltantes[j]]: calculadas[j] for j in range(len(faltantes)) if j not in errores_faltantes
+        })
+    if reporte is not None:
+        reporte['predicciones_cache'] = reporte.get('predicciones_cache', 0) + len(salidas) - len(faltantes)
+        reporte['predicciones_calculadas'] = reporte.get('predicciones_calculadas', 0) + len(faltantes)
+    return salidas, errores
+
 def classify_sides(image):
     """
     Clasifica si una imagen satelital pertenece al lado correcto usando una CNN.
 
     Parámetros:
-    - image: imagen satelital como PIL.Image
+    - image: imagen satelital como PIL.Image, arreglo (alto, ancho, 3) uint8, o tensor (3, 128, 128) ya preprocesado
+      con preparar_lote(normalizar=True)
 
     Retorna:
     - True si pertenece al lado correcto, False si no
     """
     try:
-        # Ajustar ruta del modelo - si es relativa, hacerla absoluta
-        model_sides_path = MODEL_SIDES_PATH
-        if not os.path.isabs(model_sides_path):
-            # Si la ruta es relativa, buscar en el directorio actual y luego ir hacia arriba
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            potential_paths = [
-                os.path.join(script_dir, model_sides_path),                     # functions/models/...
-                os.path.join(os.path.dirname(script_dir), model_sides_path),    # backend/models/...
-                os.path.join(os.path.dirname(os.path.dirname(script_dir)), model_sides_path)  # root/models/...
-            ]
-            
-            for path in potential_paths:
-                if os.path.exists(path):
-                    model_sides_path = path
-                    break
-
-        # Verificar que el modelo existe
-        if not os.path.exists(model_sides_path):
-            print(f"No se encontró el modelo sides en ninguna ruta probada: {potential_paths}")
+        # Modelo compartido del registro (se carga una sola vez)
+        try:
+            model_s, device = obtener_modelo('sides')
+        except FileNotFoundError as e:
+            print(f"No se encontró el modelo sides: {e}")
             return False
 
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model_s = SidesCNN()
-        model_s.load_state_dict(torch.load(model_sides_path, map_location=device))
-        model_s.to(device)
-        model_s.eval()
-
-        # Transformaciones necesarias
-        transform = transforms.Compose([
-            transforms.Resize((128, 128)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-        ])
-
-        input_tensor = transform(image).unsqueeze(0)  # Añade batch dim
-
-        # Predicción
-        with torch.no_grad():
-            output = model_s(input_tensor)
-            prediction = output.item() > 0.5  # Asumiendo salida sigmoid y binaria
-
-        return prediction
+        # Preprocesamiento (resize + normalización a [-1, 1]) si la imagen no viene ya preprocesada
+        if isinstance(image, torch.Tensor):
+            input_tensor = image.unsqueeze(0).to(device)  # Añade batch dim
+
+            # Predicción
+            with torch.no_grad():
+                output = model_s(input_tensor)
+                prediction = output.item() > 0.5  # Asumiendo salida sigmoid y binaria
+            return prediction
+
+        # Imágenes sin preprocesar: la salida puede venir de la caché de predicciones
+        if isinstance(image, Image.Image):
+            image = np.asarray(image.convert('RGB'))
+        entradas = preparar_entradas('sides', [image], normalizar=True, version=version_cache('sides'))
+        salidas, errores = inferir_entradas(model_s, device, entradas)
+        if 0 in errores:
+            raise errores[0]
+        return bool(salidas[0] > 0.5)
 
     except Exception as e:
         print(f"Error en classify_sides: {str(e)}")
         return False
 
-def obtener_imagenes_adyacentes(coords, percent_poi, orientation, distancia_metros=15):
+def planificar_adyacentes(coords, percent_poi, orientation, distancia_metros=15):
     """
-    Obtiene imágenes adyacentes al POI y verifica si alguna está en el lado correcto usando una CNN.
+    Calcula los puntos adyacentes al POI (a `distancia_metros` a cada lado de la vía) sin descargar imágenes.
 
     Retorna:
-    - Diccionario con 'status' y la coordenada si alguna imagen es válida.
+    - Diccionario con 'punto_poi', 'derecha' e 'izquierda' como (lat, lon), o la respuesta de error de
+      obtener_imagenes_adyacentes si las entradas no son válidas.
     """
     try:
         # Validación básica
@@ -134,13 +434,14 @@ def obtener_imagenes_adyacentes(coords, percent_poi, orientation, distancia_metr
 
         # Necesitamos ajustar el formato de coordenadas - si vienen como (lon, lat) convertir a (lat, lon)
         # para las funciones de procesamiento geometrico
+        coords = np.asarray(coords, dtype=np.float64)
         flipped_coords = coords
-        if isinstance(coords[0], (list, tuple)) and len(coords[0]) == 2:
+        if coords.ndim == 2 and coords.shape[1] == 2:
             # Verificar si las coordenadas parecen estar en formato (lon, lat)
             # Esto es una aproximación basada en el rango típico de coordenadas
-            if all(-180 <= coord[0] <= 180 and -90 <= coord[1] <= 90 for coord in coords):
+            if np.all((np.abs(coords[:, 0]) <= 180) & (np.abs(coords[:, 1]) <= 90)):
                 # Si parece (lon, lat), invertir a (lat, lon) para el punto_y_perpendicular
-                flipped_coords = [(coord[1], coord[0]) for coord in coords]
+                flipped_coords = coords[:, ::-1]
 
         # 1. Calcular punto del POI y vector perpendicular
         resultado = punto_y_perpendicular(flipped_coords, percent_poi, orientation)
@@ -166,158 +467,427 @@ def obtener_imagenes_adyacentes(coords, percent_poi, orientation, distancia_metr
             punto_poi[1] - vector_perpendicular[1] * distancia_grados_lon
         )
 
-        # 4. Obtener imágenes y clasificar
-        try:
-            # get_satellite_tile espera (lat, lon)
-            image_derecha = get_satellite_tile(punto_derecha[0], punto_derecha[1], 
-                                          ZOOM_LEVEL, TILE_FORMAT, TILE_SIZE, API_KEY, None)
-            right_valid = classify_sides(image_derecha) if image_derecha else False
-        except Exception as e:
-            print(f"Error obteniendo o clasificando lado derecho: {e}")
-            right_valid = False
-
-        try:
-            image_izquierda = get_satellite_tile(punto_izquierda[0], punto_izquierda[1], 
-                                            ZOOM_LEVEL, TILE_FORMAT, TILE_SIZE, API_KEY, None)
-            left_valid = classify_sides(image_izquierda) if image_izquierda else False
-        except Exception as e:
-            print(f"Error obteniendo o clasificando lado izquierdo: {e}")
-            left_valid = False
-
-        # 5. Evaluar resultado
-        if right_valid:
-            return {"status": "2. Wrong Location", "data": (punto_derecha[0], punto_derecha[1])}
-        elif left_valid:
-            return {"status": "2. Wrong Location", "data": (punto_izquierda[0], punto_izquierda[1])}
-        else:
-            return {"status": "1. POI non-existent", "data": (punto_poi[0], punto_poi[1])}
+        return {"punto_poi": punto_poi, "derecha": punto_derecha, "izquierda": punto_izquierda}
 
     except Exception as e:
         print(f"Error en obtener_imagenes_adyacentes: {str(e)}")
         return {"status": "Error", "error": str(e)}
 
-def predecir(df):
+def planificar_adyacentes_lote(coords, offsets, geom_idx, percent_poi, orientation, distancia_metros=15):
     """
-    Predict if found ridge is empty or contains building, based on a pretrained CNN, for every row in a dataframe containing the POI´s LineString, 
-    percentage of route, side of POI to LineString
+    Versión por lotes de planificar_adyacentes: calcula los puntos adyacentes de muchos POIs a la vez con
+    punto_y_perpendicular_lote.
 
-    Input: DataFrame with columns POI_ID, PERCFREF, geometry, 
+    Parámetros:
+    - coords, offsets: geometrías de los links aplanadas (ver GeometryStore)
+    - geom_idx, percent_poi, orientation: link, porcentaje y lado de cada POI
 
-    Output: DataFrame with predicted labels, 0 for empty ridge, 1 for ridge containing POI
+    Retorna:
+    - Lista con el resultado de planificar_adyacentes para cada POI
+    """
+    coords, offsets, geom_idx = subconjunto_geometrias(coords, offsets, geom_idx)
+    percent_poi = np.asarray(percent_poi, dtype=np.float64)
+    orientation = np.asarray(orientation, dtype=object)
+
+    # Invertir (lon, lat) -> (lat, lon) los links cuyas coordenadas están todas en el rango típico
+    fuera = np.concatenate([[0], np.cumsum(~((np.abs(coords[:, 0]) <= 180) & (np.abs(coords[:, 1]) <= 90)))])
+    invertir = np.repeat(fuera[offsets[1:]] == fuera[offsets[:-1]], np.diff(offsets))
+    flipped_coords = np.where(invertir[:, None], coords[:, ::-1], coords)
+
+    # 1. Calcular punto del POI y vector perpendicular
+    resultado = punto_y_perpendicular_lote(flipped_coords, offsets, geom_idx, percent_poi, orientation)
+    punto_poi = resultado['punto']
+    vector_perpendicular = resultado['perpendicular']
+
+    # 2. Convertir metros a grados
+    m_per_deg_lat = 111320
+    m_per_deg_lon = m_per_deg_lat * np.cos(np.radians(punto_poi[:, 0]))
+    distancia_grados = np.stack([np.full(len(punto_poi), distancia_metros / m_per_deg_lat), distancia_metros / m_per_deg_lon], axis=1)
+
+    # 3. Calcular puntos adyacentes
+    punto_derecha = punto_poi + vector_perpendicular * distancia_grados
+    punto_izquierda = punto_poi - vector_perpendicular * distancia_grados
+
+    largos = np.diff(offsets)[geom_idx]
+    planes = []
+    for i in range(len(geom_idx)):
+        if largos[i] < 2:
+            planes.append({"error": "Se necesitan al menos 2 coordenadas"})
+        elif not (0 <= percent_poi[i] <= 100):
+            planes.append({"error": "percent_poi debe estar entre 0 y 100"})
+        elif orientation[i] not in ['R', 'L']:
+            planes.append({"error": "orientation debe ser 'R' o 'L'"})
+        elif resultado['error'][i] is not None:
+            print(f"Error en obtener_imagenes_adyacentes: {resultado['error'][i]}")
+            planes.append({"status": "Error", "error": resultado['error'][i]})
+        else:
+            planes.append({
+                "punto_poi": tuple(punto_poi[i]),
+                "derecha": tuple(punto_derecha[i]),
+                "izquierda": tuple(punto_izquierda[i])
+            })
+    return planes
+
+def evaluar_adyacentes(plan, image_derecha, image_izquierda):
+    """
+    Clasifica las imágenes de los puntos adyacentes calculados por planificar_adyacentes.
 
+    Retorna:
+    - Diccionario con 'status' y la coordenada si alguna imagen es válida.
     """
-    # Ajustar ruta del modelo - si es relativa, hacerla absoluta
-    model_path = MODEL_PATH
-    if not os.path.isabs(model_path):
-        # Si la ruta es relativa, buscar en el directorio actual y luego ir hacia arriba
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        potential_paths = [
-            os.path.join(script_dir, model_path),                     # backend/functions/models/...
-            os.path.join(os.path.dirname(script_dir), model_path),    # backend/models/...
-            os.path.join(os.path.dirname(os.path.dirname(script_dir)), model_path)  # root/models/...
-        ]
-        
-        for path in potential_paths:
-            if os.path.exists(path):
-                model_path = path
-                break
-    
-    # Verificar que el modelo existe
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"No se encontró el modelo en la ruta: {model_path}. Rutas probadas: {potential_paths}")
+    try:
+        right_valid = classify_sides(image_derecha) if image_derecha is not False else False
+    except Exception as e:
+        print(f"Error obteniendo o clasificando lado derecho: {e}")
+        right_valid = False
+
+    try:
+        left_valid = classify_sides(image_izquierda) if image_izquierda is not False else False
+    except Exception as e:
+        print(f"Error obteniendo o clasificando lado izquierdo: {e}")
+        left_valid = False
+
+    return resolver_adyacentes(plan, right_valid, left_valid)
+
+def resolver_adyacentes(plan, right_valid, left_valid):
+    """
+    Determina el resultado de los lados adyacentes a partir de la clasificación de cada lado.
+
+    Retorna:
+    - Diccionario con 'status' y la coordenada si alguna imagen es válida.
+    """
+    punto_derecha, punto_izquierda, punto_poi = plan['derecha'], plan['izquierda'], plan['punto_poi']
+    if right_valid:
+        return {"status": "2. Wrong Location", "data": (punto_derecha[0], punto_derecha[1])}
+    elif left_valid:
+        return {"status": "2. Wrong Location", "data": (punto_izquierda[0], punto_izquierda[1])}
+    else:
+        return {"status": "1. POI non-existent", "data": (punto_poi[0], punto_poi[1])}
+
+def obtener_imagenes_adyacentes(coords, percent_poi, orientation, distancia_metros=15, fuente=None):
+    """
+    Obtiene imágenes adyacentes al POI y verifica si alguna está en el lado correcto usando una CNN.
+    Los tiles se leen de `fuente` (el origen configurado en TILE_SOURCE si se omite).
+
+    Retorna:
+    - Diccionario con 'status' y la coordenada si alguna imagen es válida.
+    """
+    plan = planificar_adyacentes(coords, percent_poi, orientation, distancia_metros)
+    if 'derecha' not in plan:
+        return plan
+
+    # Obtener ambas imágenes en paralelo (get_satellite_tile espera (lat, lon)) y clasificar
+    obtener_imagenes = recortes_centrados if TILE_MOSAIC else obtener_tiles
+    image_derecha, image_izquierda = obtener_imagenes([plan['derecha'], plan['izquierda']], ZOOM_LEVEL, TILE_FORMAT, TILE_SIZE, API_KEY, fuente=fuente)
+    return evaluar_adyacentes(plan, image_derecha, image_izquierda)
+
+def cargar_modelo_camellones():
+    """
+    Returns the pretrained CamellonCNN from the model registry (loaded from MODEL_PATH on first use, resolving relative
+    paths against functions/, backend/ and the project root).
+
+    Output: Tuple (model in eval mode, device)
+    """
+    return obtener_modelo('camellones')
+
+def _estado_inicial(df, model, device, store, reporte, fuente):
+    """Work item of the prediction stages: a chunk of POI rows and what is needed to predict them."""
+    return {'df': df, 'model': model, 'device': device, 'store': store, 'reporte': reporte, 'fuente': fuente}
+
+def _obtener_imagenes(puntos, estado):
+    # Recortes centrados en cada punto (TILE_MOSAIC) o el tile completo que contiene el punto
+    obtener_imagenes = recortes_centrados if TILE_MOSAIC else obtener_tiles
+    return obtener_imagenes(puntos, ZOOM_LEVEL, TILE_FORMAT, TILE_SIZE, API_KEY, reporte=estado['reporte'], fuente=estado['fuente'])
+
+def _etapa_tiles(estado):
+    """Stage 1: points of all POIs of the chunk and their main satellite images."""
+    df, store = estado['df'], estado['store']
     
-    print(f"Usando modelo en: {model_path}")
+    # Geometrías de los links del lote en formato aplanado
+    if store is not None:
+        coords_lote, offsets_lote, idx_lote = subconjunto_geometrias(store.coords, store.offsets, df['geom_idx'].to_numpy())
+    else:
+        coords_lote, offsets_lote = aplanar_geometrias(list(df['geometry']))
+        idx_lote = np.arange(len(df))
+    percents = df['PERCFRREF'].to_numpy(dtype=np.float64)
+    sides = df['POI_ST_SD'].to_numpy(dtype=object)
     
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = CamellonCNN()
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model.to(device)
-    model.eval()
+    # Calcular el punto de todos los POIs a la vez y descargar todos los tiles principales en paralelo
+    lote = punto_y_perpendicular_lote(coords_lote, offsets_lote, idx_lote, percents, sides)
+    puntos = [ValueError(e) if e is not None else {'punto': tuple(p)} for e, p in zip(lote['error'], lote['punto'])]
+    validos = [i for i, p in enumerate(puntos) if not isinstance(p, Exception)]
+    tiles = _obtener_imagenes([puntos[i]['punto'][::-1] for i in validos], estado)
     
-    # Configuración de transformación para las imágenes
-    transform = transforms.Compose([
-        transforms.Resize((128, 128)),
-        transforms.ToTensor(),
-    ])
+    estado.update({
+        'coords': coords_lote, 'offsets': offsets_lote, 'geom_idx': idx_lote, 'percents': percents, 'sides': sides,
+        'puntos': puntos, 'imagenes': dict(zip(validos, tiles))
+    })
+    return estado
+
+def _etapa_preproceso(estado):
+    """Stage 2: input tensors of the main model for every row with an image."""
+    imagenes = estado.pop('imagenes')
+    estado['con_imagen'] = [i for i, imagen in imagenes.items() if imagen is not False]
+    version = version_cache('camellones', estado['model'])
+    estado['entradas'] = preparar_entradas('camellones', [imagenes[i] for i in estado['con_imagen']], version=version)
+    return estado
+
+def _etapa_inferencia(estado):
+    """Stage 3: main model over the chunk; rows where no ridge is found are left pending for the adjacent sides."""
+    df, puntos, con_imagen = estado['df'], estado['puntos'], estado['con_imagen']
+    salidas, errores = inferir_entradas(estado['model'], estado['device'], estado.pop('entradas'), estado['reporte'])
+    posicion = {i: j for j, i in enumerate(con_imagen)}
     
-    resultados = {}
+    # Resultado de cada fila; las que necesitan los lados adyacentes se completan después
+    por_fila = []
+    pendientes = {}
     #Iterate DataFrame to predict for each row
-    for _, row in df.iterrows():
+    for i, (_, row) in enumerate(df.iterrows()):
         try:
             
             pid = row['POI_ID']
-            coords = ast.literal_eval(row['geometry']) if isinstance(row['geometry'], str) else row['geometry']
-            percent = float(row['PERCFRREF'])
-            side = row['POI_ST_SD']
             nombre = row['POI_NAME']
             
-            # Obtener punto y vector perpendicular
-            punto_info = punto_y_perpendicular(coords, percent, side=side)
+            # Punto calculado en la etapa de tiles
+            punto_info = puntos[i]
+            if isinstance(punto_info, Exception):
+                raise punto_info
             lon, lat = punto_info['punto']
             
-            # Obtener imagen de satélite
-            tile_path = os.path.join(TEMP_DIR, f"satellite_tile_{pid}.png")
-            imagen = get_satellite_tile(lat, lon, ZOOM_LEVEL, TILE_FORMAT, TILE_SIZE, API_KEY, tile_path)
-            
-            if imagen:
-                # Procesar imagen y realizar predicción
-                if os.path.exists(tile_path):
-                    img = Image.open(tile_path).convert('RGB')
-                    img_tensor = transform(img).unsqueeze(0).to(device)
-                else:
-                    # Si no se guardó el archivo, usar la imagen directamente
-                    img_tensor = transform(imagen).unsqueeze(0).to(device)
-                
-                with torch.no_grad():
-                    output = model(img_tensor)
-                    pred_label = int((output > 0.5).float().item())
+            if i in posicion:
+                # Predicción calculada en el lote
+                j = posicion[i]
+                if j in errores:
+                    raise errores[j]
+                pred_label = int(salidas[j] > 0.5)
                 
                 # Si el modelo principal detecta un camellón
                 if pred_label == 1:
                     # Guardar resultados con la etiqueta de excepción de regla
-                    resultados[pid] = {
+                    por_fila.append((pid, {
                         'x_cord': lon,
                         'y_cord': lat,
                         'POI_NAME': nombre,
                         'label': '4. Rule exception'
-                    }
+                    }))
                 else:
-                    # Si no detecta camellón, probar con los lados adyacentes
-                    sides_response = obtener_imagenes_adyacentes(coords, percent, side)
-                    
-                    if sides_response.get("status") == "2. Wrong Location":
-                        # Si encuentra una ubicación alternativa
-                        resultados[pid] = {
-                            'x_cord': sides_response['data'][0],
-                            'y_cord': sides_response['data'][1],
-                            'POI_NAME': nombre,
-                            'label': sides_response['status']
-                        }
-                    else:
-                        # Si no encuentra ninguna ubicación válida
-                        resultados[pid] = {
-                            'x_cord': lon,
-                            'y_cord': lat,
-                            'POI_NAME': nombre,
-                            'label': sides_response.get('status', '1. POI non-existent')
-                        }
+                    # Si no detecta camellón, probar con los lados adyacentes (ver abajo)
+                    pendientes[i] = (lon, lat, nombre)
+                    por_fila.append((pid, None))
             else:
                 # En caso de error al obtener la imagen
-                resultados[pid] = {
+                por_fila.append((pid, {
                     'x_cord': lon,
                     'y_cord': lat,
                     'POI_NAME': nombre,
                     'label': '3. Invalid location',
                     'error': 'No se pudo obtener la imagen de satélite'
-                }
+                }))
         except Exception as e:
             # En caso de error en el procesamiento
-            resultados[row.get('POI_ID', 'unknown')] = {
+            por_fila.append((row.get('POI_ID', 'unknown'), {
                 'x_cord': lon if 'lon' in locals() else None,
                 'y_cord': lat if 'lat' in locals() else None,
                 'POI_NAME': nombre if 'nombre' in locals() else None,
                 'error': str(e),
                 'label': 'Error'
+            }))
+    
+    estado.update({'por_fila': por_fila, 'pendientes': pendientes})
+    return estado
+
+def _etapa_tiles_lados(estado):
+    """Stage 4: adjacent points of all pending rows and their satellite images."""
+    pendientes = estado['pendientes']
+    filas = np.fromiter(pendientes, dtype=np.int64, count=len(pendientes))
+    planes = dict(zip(pendientes, planificar_adyacentes_lote(
+        estado['coords'], estado['offsets'], estado['geom_idx'][filas], estado['percents'][filas], estado['sides'][filas]
+    )))
+    con_puntos = [i for i in pendientes if 'derecha' in planes[i]]
+    puntos_lados = [p for i in con_puntos for p in (planes[i]['derecha'], planes[i]['izquierda'])]
+    
+    estado.update({'planes': planes, 'con_puntos': con_puntos, 'imagenes_lados': _obtener_imagenes(puntos_lados, estado)})
+    return estado
+
+def _etapa_preproceso_lados(estado):
+    """Stage 5: normalized input tensors of the sides model for every adjacent image."""
+    tiles_lados = estado.pop('imagenes_lados')
+    estado['n_lados'] = len(tiles_lados)
+    estado['con_imagen_lados'] = [k for k, imagen in enumerate(tiles_lados) if imagen is not False]
+    version = version_cache('sides') if estado['con_imagen_lados'] else None
+    estado['entradas_lados'] = preparar_entradas('sides', [tiles_lados[k] for k in estado['con_imagen_lados']], normalizar=True, version=version)
+    return estado
+
+def _etapa_inferencia_lados(estado):
+    """
+    Stage 6: sides model over all adjacent images and final result of every row of the chunk. Rows where an adjacent
+    image, the sides model or its inference failed get an 'error', so the result is not reused as if it were real.
+    """
+    planes, con_puntos, pendientes, por_fila = estado['planes'], estado['con_puntos'], estado['pendientes'], estado['por_fila']
+    
+    # Segunda pasada por lotes: modelo de lados sobre todas las imágenes adyacentes obtenidas
+    lados_validos = np.zeros(estado['n_lados'], dtype=bool)
+    # Lados sin clasificar: sin imagen, sin modelo o con error de inferencia
+    lados_fallidos = np.ones(estado['n_lados'], dtype=bool)
+    con_imagen = estado['con_imagen_lados']
+    entradas = estado.pop('entradas_lados')
+    if con_imagen:
+        try:
+            model_s, device_s = obtener_modelo('sides')
+            salidas_lados, errores_lados = inferir_entradas(model_s, device_s, entradas, estado['reporte'])
+            for j, e in errores_lados.items():
+                print(f"Error en classify_sides: {str(e)}")
+            lados_validos[con_imagen] = salidas_lados > 0.5
+            lados_fallidos[[k for j, k in enumerate(con_imagen) if j not in errores_lados]] = False
+            lados_validos[lados_fallidos] = False
+        except FileNotFoundError as e:
+            print(f"No se encontró el modelo sides: {e}")
+    lados = {i: lados_validos[2 * k:2 * k + 2] for k, i in enumerate(con_puntos)}
+    fallidos = {i for k, i in enumerate(con_puntos) if lados_fallidos[2 * k:2 * k + 2].any()}
+    
+    for i, (lon, lat, nombre) in pendientes.items():
+        sides_response = resolver_adyacentes(planes[i], *lados[i]) if i in lados else planes[i]
+        
+        if sides_response.get("status") == "2. Wrong Location":
+            # Si encuentra una ubicación alternativa
+            resultado = {
+                'x_cord': sides_response['data'][0],
+                'y_cord': sides_response['data'][1],
+                'POI_NAME': nombre,
+                'label': sides_response['status']
+            }
+        else:
+            # Si no encuentra ninguna ubicación válida
+            resultado = {
+                'x_cord': lon,
+                'y_cord': lat,
+                'POI_NAME': nombre,
+                'label': sides_response.get('status', '1. POI non-existent')
             }
+        if i in fallidos:
+            resultado['error'] = 'No se pudo clasificar algún lado adyacente'
+        por_fila[i] = (por_fila[i][0], resultado)
+    
+    resultados = {}
+    for pid, resultado in por_fila:
+        resultados[pid] = resultado
+    return {'df': estado['df'], 'reporte': estado['reporte'], 'resultados': resultados}
+
+# Etapas de predicción en orden, con el número de workers de cada una en el pipeline
+ETAPAS_PREDICCION = [
+    ('tiles', _etapa_tiles, PIPELINE_FETCH_WORKERS),
+    ('preproceso', _etapa_preproceso, PIPELINE_PREPROCESS_WORKERS),
+    ('inferencia', _etapa_inferencia, 1),
+    ('tiles_lados', _etapa_tiles_lados, PIPELINE_FETCH_WORKERS),
+    ('preproceso_lados', _etapa_preproceso_lados, PIPELINE_PREPROCESS_WORKERS),
+    ('inferencia_lados', _etapa_inferencia_lados, 1),
+]
+
+def predecir(df, model=None, device=None, store=None, reporte=None, fuente=None):
+    """
+    Predict if found ridge is empty or contains building, based on a pretrained CNN, for every row in a dataframe containing the POI´s LineString, 
+    percentage of route, side of POI to LineString.
+    Tiles are planned per call: the main tiles of all rows are deduplicated and fetched together before inference, and
+    the side tiles of every row where no ridge was found are deduplicated and fetched together afterwards. With
+    TILE_MOSAIC, each point is classified on a crop centred on it (see recortes_centrados) instead of on its tile.
+    The stages (ETAPAS_PREDICCION) run one after the other; predecir_por_lotes can overlap them between chunks.
+
+    Input: DataFrame with columns POI_ID, PERCFREF, geom_idx (index of the link in `store`), optional preloaded model and device 
+    (see cargar_modelo_camellones), GeometryStore with the link geometries (if not given, a 'geometry' column with the list of coordinates is used),
+    optional dictionary where the tile references and unique tiles are accumulated, tile source (TILE_SOURCE if not given)
+
+    Output: DataFrame with predicted labels, 0 for empty ridge, 1 for ridge containing POI
+
+    """
+    if model is None:
+        model, device = cargar_modelo_camellones()
+    
+    estado = _estado_inicial(df, model, device, store, reporte, fuente)
+    for _, etapa, _ in ETAPAS_PREDICCION:
+        estado = etapa(estado)
+    return estado['resultados']
+
+def predecir_por_lotes(df, batch_size=None, reporte=None, store=None, fuente=None, avance=None):
+    """
+    Runs `predecir` over the whole DataFrame in batches of `batch_size` rows (PROCESS_BATCH_SIZE by default), loading
+    the model once, so memory use stays bounded for any number of POIs. Satellite tiles are kept in the tile cache,
+    which has its own size limits.
+    With INFERENCE_PIPELINE, each batch goes through the prediction stages as a pipeline (see ejecutar_pipeline) in
+    chunks of PIPELINE_CHUNK_SIZE rows (at most `batch_size`): tile fetching, preprocessing and inference of
+    different chunks of the batch overlap. Tiles are planned and deduplicated per chunk; a tile shared with an earlier
+    chunk is usually served by TILE_CACHE, but two chunks fetching at the same time may both request it. The tile
+    figures of the report (references, unique tiles, dedup_tiles) cover the whole run.
+
+    Input: DataFrame (as for predecir), rows per batch, optional dictionary that receives the run report
+           (pois, lotes, segundos, pois_por_segundo, tiles_referencias, tiles_unicos, dedup_tiles and, with the
+           pipeline, etapas: statistics per stage over all batches), GeometryStore with the link geometries, tile
+           source (TILE_SOURCE if not given), optional function called with (processed POIs, total) after every
+           batch (every chunk with the pipeline); an exception raised by it stops the run
+
+    Output: Dictionary with the results of every POI, as returned by predecir
+    """
+    batch_size = batch_size or PROCESS_BATCH_SIZE
+    chunk_size = min(PIPELINE_CHUNK_SIZE, batch_size)
+    model, device = cargar_modelo_camellones()
+    
+    resultados = {}
+    # Los tiles vistos en toda la ejecución, para contar los únicos entre lotes y bloques
+    tiles = {'tiles_referencias': 0, 'tiles_unicos': 0, 'tiles_vistos': set()}
+    total = len(df)
+    n_lotes = math.ceil(total / batch_size) if total else 0
+    inicio = time.perf_counter()
+    procesados = [0]
+    if INFERENCE_PIPELINE:
+        print(f"Predicción en lotes de {batch_size} POIs, en bloques de {chunk_size} por el pipeline")
+    
+    def progreso(n_lote, filas):
+        procesados[0] += filas
+        segundos = time.perf_counter() - inicio
+        print(f"Lote {n_lote}/{n_lotes}: {procesados[0]}/{total} POIs, {procesados[0] / segundos:.2f} POIs/s")
+        if avance is not None:
+            avance(procesados[0], total)
+    
+    etapas = None
+    for n_lote, desde in enumerate(range(0, total, batch_size), start=1):
+        lote = df.iloc[desde:desde + batch_size]
+        if not INFERENCE_PIPELINE:
+            resultados.update(predecir(lote, model, device, store, reporte=tiles, fuente=fuente))
+            progreso(n_lote, len(lote))
+            continue
+        
+        # Cada bloque lleva su propio reporte de tiles, porque varias etapas escriben a la vez
+        items = (
+            _estado_inicial(lote.iloc[i:i + chunk_size], model, device, store, {'tiles_vistos': set()}, fuente)
+            for i in range(0, len(lote), chunk_size)
+        )
+        
+        def completar(estado):
+            estado = _etapa_inferencia_lados(estado)
+            progreso(n_lote, len(estado['df']))
+            return estado
+        
+        salidas, estadisticas = ejecutar_pipeline(
+            items, ETAPAS_PREDICCION[:-1] + [(ETAPAS_PREDICCION[-1][0], completar, 1)], tamano=lambda estado: len(estado['df'])
+        )
+        etapas = combinar_estadisticas(etapas, estadisticas)
+        for estado in salidas:
+            resultados.update(estado['resultados'])
+            tiles['tiles_vistos'].update(estado['reporte'].pop('tiles_vistos'))
+            for clave, valor in estado['reporte'].items():
+                tiles[clave] = tiles.get(clave, 0) + valor
+    tiles['tiles_unicos'] = len(tiles.pop('tiles_vistos'))
     
+    segundos = time.perf_counter() - inicio
+    if reporte is not None:
+        reporte.update({
+            'pois': total,
+            'lotes': n_lotes,
+            'segundos': segundos,
+            'pois_por_segundo': total / segundos if segundos > 0 else 0.0,
+            **tiles,
+            # Fracción de referencias a tiles resueltas por otro POI de la ejecución
+            'dedup_tiles': 1 - tiles['tiles_unicos'] / tiles['tiles_referencias'] if tiles['tiles_referencias'] else 0.0
+        })
+        if etapas is not None:
+            reporte['etapas'] = etapas
     return resultados
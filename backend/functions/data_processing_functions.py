@@ -1,23 +1,193 @@
 import pandas as pd 
-import geopandas as gpd
+import fiona
 import numpy as np
 import os
+import math
+import multiprocessing
 import traceback
+from array import array
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from functions.cache_functions import (
+    NETWORK_CACHE_DIR, NETWORK_CACHE_MAX_BYTES, hash_archivo, hash_claves, guardar_arreglos, cargar_arreglos
+)
+from functions.job_functions import TrabajoCancelado
 
 # Use environment variables
 DATA_DIR = os.environ.get('DATA_DIR', '../data')
 TEMP_DIR = os.environ.get('TEMP_DIR', 'temp')
+POI_CHUNK_SIZE = int(os.environ.get('POI_CHUNK_SIZE', 500000))
+PROCESS_WORKERS = int(os.environ.get('PROCESS_WORKERS', 1))
+
+# Los workers del emparejamiento salen de un forkserver que ya importó este módulo: arrancan rápido y no heredan los
+# hilos del proceso de la API (torch, descarga de tiles, pipeline), con los que un fork puede bloquearse
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    _CONTEXTO_WORKERS = multiprocessing.get_context('forkserver')
+    _CONTEXTO_WORKERS.set_forkserver_preload([__name__])
+else:
+    _CONTEXTO_WORKERS = multiprocessing.get_context('spawn')
+
+# Columns of POI.csv used by the pipeline and their compact dtypes
+POI_DTYPES = {
+    'POI_ID': 'int64',
+    'LINK_ID': 'int64',
+    'POI_NAME': 'object',
+    'POI_ST_SD': pd.CategoricalDtype(['L', 'R']),
+    'PERCFRREF': 'float32'
+}
 
 # Funciones de procesamiento de datos
-def get_points_df(path_gdf: str, path_points: str, slice=-1):
+def iterar_links_multidigit(path_gdf: str):
+    """
+    Streams the features of the street network GeoJSON and yields only the links that can be paired: LineStrings
+    with MULTIDIGIT == "Y". The MULTIDIGIT filter is pushed down to the reader, but every property of each feature is
+    still parsed: the GeoJSON driver cannot skip fields (fiona's include_fields fails with "Driver does not support
+    ignore_fields"). Only link_id and the coordinates are yielded.
+
+    Input: GeoJSON file path
+
+    Output: Iterator of (link_id, coordinates) tuples
+    """
+    with fiona.open(path_gdf) as src:
+        for feature in src.filter(where="MULTIDIGIT = 'Y'"):
+            geom = feature.geometry
+            if geom is None or geom.type != 'LineString':
+                continue
+            yield feature.properties['link_id'], geom.coordinates
+
+def cargar_red_multidigit(path_gdf: str, link_ids=None):
+    """
+    Loads the multidigitalised links of the street network GeoJSON as flat arrays, keeping only those whose link_id
+    is in `link_ids` (the links that carry POIs) if it is given, so memory grows with the relevant links instead of
+    with the whole file.
+
+    Input: GeoJSON file path, optional set of link_ids to keep
+
+    Output: Dictionary with
+        - 'link_ids': array (n,) with the link_ids
+        - 'offsets': array (n + 1,) so that the nodes of link i are coords[offsets[i]:offsets[i + 1]]
+        - 'coords': array (m, 2) with the (x, y) nodes of all the links
+    """
+    ids = []
+    offsets = array('q', [0])
+    coords = array('d')
+    for link_id, coordenadas in iterar_links_multidigit(path_gdf):
+        if link_ids is not None and link_id not in link_ids:
+            continue
+        ids.append(link_id)
+        for c in coordenadas:
+            coords.extend(c[:2])
+        offsets.append(len(coords) // 2)
+    
+    return {
+        'link_ids': np.array(ids),
+        'offsets': np.frombuffer(offsets, dtype=np.int64).copy(),
+        'coords': np.frombuffer(coords, dtype=np.float64).reshape(-1, 2).copy()
+    }
+
+def obtener_red_multidigit(path_gdf: str, link_ids, nav_hash=None):
+    """
+    Returns the arrays of cargar_red_multidigit for the links in `link_ids` from the on-disk network cache, keyed by
+    the content hash of the GeoJSON and the set of link_ids. On a miss (or if the file or the links changed) the
+    network is streamed with the link filter and stored, so neither the cache nor memory hold the links without POIs.
+
+    Input: GeoJSON file path, set of link_ids to keep (the links that carry POIs), content hash (computed if not given)
+
+    Output: Dictionary with link_ids, offsets and coords
+    """
+    nav_hash = nav_hash or hash_archivo(path_gdf)
+    clave = hash_claves('red', nav_hash, np.sort(np.fromiter(link_ids, dtype=np.int64, count=len(link_ids))))
+    
+    red = cargar_arreglos(NETWORK_CACHE_DIR, clave) if NETWORK_CACHE_MAX_BYTES > 0 else None
+    if red is not None:
+        print(f"Red cargada desde caché: {clave[:12]}")
+        return red
+    
+    red = cargar_red_multidigit(path_gdf, link_ids)
+    if NETWORK_CACHE_MAX_BYTES > 0:
+        guardar_arreglos(NETWORK_CACHE_DIR, clave, NETWORK_CACHE_MAX_BYTES, **red)
+    return red
+
+class GeometryStore:
+    """Shared geometry store of the links: one flat float64 coordinate buffer plus an offsets array.
+    Every stage refers to a link geometry by its index in the store (the 'geom_idx' column), so POI rows on the
+    same link share a single copy of the coordinates.
+    Input: Arrays link_ids (n,), offsets (n + 1,) and coords (m, 2), as returned by cargar_red_multidigit
+    """
+    def __init__(self, link_ids, offsets, coords):
+        self.link_ids = np.asarray(link_ids)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.row = {lid: i for i, lid in enumerate(self.link_ids.tolist())}
+
+    @classmethod
+    def from_red(cls, red):
+        """Builds the store with the links of the network arrays returned by obtener_red_multidigit."""
+        return cls(red['link_ids'], red['offsets'], red['coords'])
+
+    def __len__(self):
+        return len(self.link_ids)
+
+    def geometry(self, idx):
+        """Returns the nodes of link `idx` as an array (k, 2) view of the shared buffer."""
+        return self.coords[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def nodes(self, idx, k):
+        """Returns the k-th node of each of the links `idx` as an array (len(idx), 2) (NaN for links with fewer nodes)."""
+        idx = np.asarray(idx, dtype=np.int64)
+        posicion = self.offsets[idx] + k
+        valido = posicion < self.offsets[idx + 1]
+        nodos = np.full((len(idx), 2), np.nan)
+        nodos[valido] = self.coords[posicion[valido]]
+        return nodos
+
+def leer_poi_por_bloques(path_points: str, columns=None, chunksize=None):
+    """
+    Reads POI.csv in chunks, projecting only the given columns with the compact dtypes of POI_DTYPES.
+    Values of POI_ST_SD other than L/R are read as NaN.
+
+    Input: POI.csv path, list of columns (all the columns of POI_DTYPES by default), rows per chunk
+
+    Output: Iterator of DataFrames
+    """
+    columns = list(POI_DTYPES) if columns is None else columns
+    return pd.read_csv(
+        path_points,
+        encoding="utf-8",
+        usecols=columns,
+        dtype={c: POI_DTYPES[c] for c in columns},
+        chunksize=chunksize or POI_CHUNK_SIZE
+    )
+
+def cargar_poi(path_points: str, link_ids, chunksize=None):
+    """
+    Loads the POIs whose LINK_ID is in `link_ids`, filtering every chunk before it is accumulated so memory stays
+    bounded by the selected rows. Duplicated (LINK_ID, POI_ID) rows keep the first occurrence.
+
+    Input: POI.csv path, set of link_ids to keep, rows per chunk
+
+    Output: DataFrame with the columns of POI_DTYPES
+    """
+    link_ids = np.fromiter(link_ids, dtype=np.int64, count=len(link_ids))
+    bloques = [chunk.loc[chunk['LINK_ID'].isin(link_ids)] for chunk in leer_poi_por_bloques(path_points, chunksize=chunksize)]
+    if not bloques:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in POI_DTYPES.items()})
+    
+    poi_df = pd.concat(bloques, ignore_index=True)
+    poi_df.drop_duplicates(subset=["LINK_ID", "POI_ID"], keep="first", inplace=True)
+    return poi_df
+
+def get_points_df(path_gdf: str, path_points: str, slice=None, nav_hash=None):
     """
     The function merges the point table and the GeoJSON to find the points of interest that have a link_id whose route shows 
-    multi-digitization. It returns the dataframe of points with these cases and the linestring (geometry) associated with their link_id. 
+    multi-digitization. It returns the dataframe of points with these cases and the store with the linestring (geometry) of
+    their link_ids, referenced from each point by the 'geom_idx' column.
     It adds a label indicating whether the link_id for the point has multi-digitization or not.
 
-    Input: GeoJSON file path, POI.csv  
+    Input: GeoJSON file path, POI.csv, optional maximum number of rows (all by default), optional content hash of the GeoJSON
 
-    Output: CSV with the database of points, the linestring of their link_id, and a classification indicating whether their route has multi-digitization or not
+    Output: Tuple (DataFrame with the database of points and a classification indicating whether their route has multi-digitization or not, GeometryStore)
     """
     # Verify if the files exist
     if not os.path.exists(path_gdf):
@@ -28,271 +198,475 @@ def get_points_df(path_gdf: str, path_points: str, slice=-1):
     # Debugging print
     print(f"Cargando archivos: {path_gdf}, {path_points}")
     
-    # Load GeoDataFrame
-    gdf = gpd.read_file(path_gdf)
-    gdf["geometry"] = gdf.geometry.apply(lambda geom: list(geom.coords) if geom.geom_type == 'LineString' else None)
-    links_id = list(gdf.loc[gdf["MULTIDIGIT"] == "Y"]["link_id"].unique())
+    # Links that carry POIs (only the LINK_ID column is read)
+    poi_links = set()
+    for chunk in leer_poi_por_bloques(path_points, columns=['LINK_ID']):
+        poi_links.update(chunk['LINK_ID'].unique().tolist())
     
-    # Load Points
-    poi_df = pd.read_csv(path_points, encoding="utf-8")
-    poi_df.drop_duplicates(subset=["LINK_ID", "POI_ID"], keep="first", inplace=True)
+    # Only the multidigitalised links that carry POIs (from the cache if the file and the links did not change)
+    store = GeometryStore.from_red(obtener_red_multidigit(path_gdf, poi_links, nav_hash))
     
-    # Merge on link_id
-    poi_df = poi_df.merge(
-        gdf[['link_id', 'geometry']],
-        left_on='LINK_ID',
-        right_on='link_id',
-        how='left'
-    )
+    # Load Points on those links
+    poi_df = cargar_poi(path_points, set(store.row))
     
-    # Find points with corresponding to a multidigitalised link_id
-    poi_rm = list(poi_df.loc[poi_df["LINK_ID"].isin(links_id)]["POI_ID"].unique())
+    # Reference the geometry of the link_id, keeping only points with a multidigitalised link_id
+    poi_df['geom_idx'] = poi_df['LINK_ID'].map(store.row)
+    poi_df = poi_df.loc[poi_df['geom_idx'].notna()]
+    poi_df['geom_idx'] = poi_df['geom_idx'].astype(np.int64)
     
     # Asign label
-    poi_df.loc[:, "label_rm"] = np.where(poi_df["POI_ID"].isin(poi_rm), 1, 0)
+    poi_df.loc[:, "label_rm"] = 1
     
     # Filtrar y devolver
-    return poi_df.loc[(poi_df["label_rm"] == 1) & (poi_df["POI_ST_SD"].isin(["L", "R"]))].reset_index(drop=True)[:slice]
+    return poi_df.loc[poi_df["POI_ST_SD"].isin(["L", "R"])].reset_index(drop=True)[:slice], store
 
-def create_dicts_for_sorting(df):
+def preparar_arreglos_links(df, store):
     """
-    This function receives a DataFrame and extract a list of coordinates and link_ids 
-    to create a dictionary: {'link_id': coordinates for reference node}
-    Input: DataFrame 
-    Output: Dictionary
+    Precomputes, once per run, the contiguous arrays used to pair the links of a DataFrame.
+    Input: DataFrame with columns LINK_ID and geom_idx, GeometryStore
+    Output: Dictionary with
+        - 'link_ids': array (n,) with the unique link_ids in order of appearance
+        - 'row': dictionary {'link_id': row index in the arrays}
+        - 'geom_idx': array (n,) with the index of every link in the store
+        - 'start': array (n, 2) with the reference node (first node) of every link
+        - 'next': array (n, 2) with the second node of every link
+        - 'direction': array (n, 2) with the unit direction vector of the first segment (NaN if the segment has length 0)
     """
-    coords_list = [df.loc[i, 'geometry'][0] for i in range(len(df))]
-    link_ids_list = [df.loc[i, 'LINK_ID'] for i in range(len(df))]
-    coords = dict(zip(link_ids_list, coords_list))
-    return coords
+    links = df.drop_duplicates(subset='LINK_ID', keep='first')
+    link_ids = links['LINK_ID'].to_numpy()
+    geom_idx = links['geom_idx'].to_numpy(dtype=np.int64)
+    
+    start = store.nodes(geom_idx, 0)
+    next_node = store.nodes(geom_idx, 1)
+    
+    vectores = next_node - start
+    with np.errstate(invalid='ignore', divide='ignore'):
+        direction = vectores / np.linalg.norm(vectores, axis=1)[:, None]
+    
+    return {
+        'link_ids': link_ids,
+        'row': {lid: i for i, lid in enumerate(link_ids)},
+        'geom_idx': geom_idx,
+        'start': start,
+        'next': next_node,
+        'direction': direction
+    }
 
-def get_sorted_x_y(df):
-    """This function sorts the link_id-coordinates dictionary based on x or y coordinate.
-    Input: DataFrame
-    Output: Two sorted dictionaries with the form {'link_id': coordinate} (sorted_x, sorted_y) sorted based on x or y coordinate
+class GridIndex:
+    """Uniform grid hash over the reference nodes of the links.
+    Each row is stored in the cell that contains its reference node, so a radius query only
+    visits the cells that intersect the search window and a removal is a constant-time set discard.
+    Input: Array (n, 2) of reference nodes, cell size (same units as the coordinates)
     """
-    coords = create_dicts_for_sorting(df)
-    # Ordenado por coordenada x
-    sorted_x = dict(sorted(coords.items(), key=lambda item: item[1][0]))
-    # Ordenado por coordenada y
-    sorted_y = dict(sorted(coords.items(), key=lambda item: item[1][1]))
-    return sorted_x, sorted_y
+    def __init__(self, points, cell_size):
+        if cell_size <= 0:
+            raise ValueError("El tamaño de celda debe ser mayor a 0.")
+        self.cell_size = cell_size
+        self.points = points
+        self.cells = defaultdict(set)
+        self.available = np.ones(len(points), dtype=bool)
+        celdas = np.floor(points / cell_size).astype(np.int64)
+        for row, (cx, cy) in enumerate(celdas.tolist()):
+            self.cells[(cx, cy)].add(row)
 
-def encontrar_link_alineado(link_id, x_sorted, y_sorted, coord_dict, df, dot_threshold=0.90, max_dist=0.00035, n_vecinos=10):
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def __contains__(self, row):
+        return bool(self.available[row])
+
+    def __len__(self):
+        return int(self.available.sum())
+
+    def remove(self, row):
+        """Removes a row from the index. Does nothing if it was already removed."""
+        if not self.available[row]:
+            return
+        self.available[row] = False
+        cell = self._cell(*self.points[row])
+        self.cells[cell].discard(row)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def query_radius(self, x, y, radius):
+        """Returns an array with the rows whose reference node is at a distance <= radius from (x, y)."""
+        cx, cy = self._cell(x, y)
+        reach = max(1, math.ceil(radius / self.cell_size))
+        rows = []
+        for i in range(cx - reach, cx + reach + 1):
+            for j in range(cy - reach, cy + reach + 1):
+                rows.extend(self.cells.get((i, j), ()))
+        rows = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        dist = np.hypot(self.points[rows, 0] - x, self.points[rows, 1] - y)
+        return rows[dist <= radius]
+
+def build_spatial_index(links, max_dist=0.00035):
+    """Builds the spatial index used to search the carriageway pairs.
+    Input: Arrays from preparar_arreglos_links, maximum pairing distance (used as grid cell size)
+    Output: GridIndex
+    """
+    return GridIndex(links['start'], max_dist)
+
+def elegir_pareja(vecinos, dots, dists):
+    """Chooses the best candidate: highest dot product, the closest one in case of (near) ties, and the lowest row
+    if they are still tied (duplicated geometries), so the choice does not depend on the order of the candidates.
+    Input: Arrays with the candidate rows, their dot products and distances (at least one candidate)
+    Output: Row of the chosen candidate
+    """
+    mejores = np.isclose(dots, dots.max(), atol=1e-3)
+    vecinos, dots, dists = vecinos[mejores], dots[mejores], dists[mejores]
+    return vecinos[np.lexsort((vecinos, -dots, dists))[0]]
+
+def encontrar_link_alineado(link_id, index, links, dot_threshold=0.90, max_dist=0.00035):
     """
     Finds the best-aligned neighboring segment (link) to a given `link_id` based on geometric direction and spatial proximity.
     
-    This function takes a segment identifier (`link_id`) and searches among its spatial neighbors—sorted by X and Y coordinates
-    for another segment whose direction vector is sufficiently aligned (via dot product threshold) and lies within a maximum distance. 
-    Direction is computed using the vector between the first two nodes of the geometry.
+    This function takes a segment identifier (`link_id`) and searches, among the links still available in the spatial index
+    whose reference node lies within `max_dist`, for another segment whose direction vector is sufficiently aligned
+    (via dot product threshold). Direction is the unit vector between the first two nodes of the geometry, and the
+    filtering runs vectorized over all the candidates at once.
     
     Parameters:
     -----------
     - link_id : str or int  
         The identifier of the base segment for which an aligned pair is to be found.
     
-    - coord_dict : dict  
-        Dictionary mapping each `link_id` to its starting node as a (x, y) coordinate.
-    
-    - x_sorted : dict  
-        Dictionary with `link_id`s sorted by their X coordinate.
+    - index : GridIndex  
+        Spatial index with the rows of every link that has not been paired yet.
     
-    - y_sorted : dict  
-        Dictionary with `link_id`s sorted by their Y coordinate.
-    
-    - df : pandas.DataFrame  
-        DataFrame containing at least the columns `LINK_ID` and `geometry`, 
-        where `geometry` is a list of coordinates representing the route.
-    
-    - n_neighbors : int, optional (default=5)  
-        Number of neighboring links to consider in both directions of the sorted lists.
+    - links : dict  
+        Precomputed arrays returned by `preparar_arreglos_links`.
     
     - dot_threshold : float, optional (default=0.90)  
         Minimum dot product threshold between direction vectors to be considered "aligned" 
         (closer to 1.0 means more aligned).
     
-    - max_dist : float, optional (default=0.0003)  
+    - max_dist : float, optional (default=0.00035)  
         Maximum allowed distance between starting coordinates for a pair to be valid.
     
     Returns:
     --------
     - pair : str or int  
-        The `link_id` of the best-aligned and closest segment.
-    
-    - coord_dict : dict  
-        Updated version of `coord_dict` without `link_id` and its matched pair.
-    
-    - x_sorted : dict  
-        Updated `x_sorted` dictionary without the pair.
-    
-    - y_sorted : dict  
-        Updated `y_sorted` dictionary without the pair.
+        The `link_id` of the best-aligned and closest segment. Both `link_id` and its pair are removed from `index`.
     
     Raises:
     -------
     - `ValueError` if `link_id` is not found or no sufficiently aligned and close neighbor is found.
     """
-    # Copy original dictionaries to avoid overwriting.
-    coord_dict = coord_dict.copy()
-    x_sorted = x_sorted.copy()
-    y_sorted = y_sorted.copy()
+    row = links['row'].get(link_id)
+    if row is None or row not in index:
+        raise ValueError(f"{link_id} no se encontró en el índice espacial")
     
-    # List of sorted link_ids
-    x_keys = list(x_sorted.keys())
-    y_keys = list(y_sorted.keys())
+    start = links['start']
+    nodo_ini = start[row]
     
-    try:
-        idx_x = x_keys.index(link_id)
-        idx_y = y_keys.index(link_id)
-    except ValueError:
-        raise ValueError(f"{link_id} no se encontró en x_sorted o y_sorted")
-    
-    # Neighbours in x,y
-    vecinos = set()
-    for offset in range(1, n_vecinos + 1):
-        if idx_x - offset >= 0:
-            vecinos.add(x_keys[idx_x - offset])
-        if idx_x + offset < len(x_keys):
-            vecinos.add(x_keys[idx_x + offset])
-        if idx_y - offset >= 0:
-            vecinos.add(y_keys[idx_y - offset])
-        if idx_y + offset < len(y_keys):
-            vecinos.add(y_keys[idx_y + offset])
-    
-    vecinos.add(link_id)  # Add the same link_id to create the vector
-    vecinos = list(vecinos)
-    
-    # Create direction vectors
-    vectores = {}
-    for lid in vecinos:
-        nodo_ini = np.array(coord_dict[lid])
-        row = df[df['LINK_ID'] == lid].reset_index()
-        nodo_sig = np.array([row.loc[0, 'geometry'][1][0], row.loc[0, 'geometry'][1][1]])
-        vectores[lid] = nodo_sig - nodo_ini
-    
-    # Base vector
-    v0 = vectores[link_id] / np.linalg.norm(vectores[link_id])
-    
-    # Compare with other candidates vectors
-    candidatos = []
-    for lid, vec in vectores.items():
-        if lid == link_id:
-            continue
-        v = vec / np.linalg.norm(vec)
-        dot = np.dot(v0, v)
-        if dot >= dot_threshold:
-            dist = np.linalg.norm(np.array(coord_dict[link_id]) - np.array(coord_dict[lid]))
-            if dist <= max_dist:
-                candidatos.append((lid, dot, dist))
-    
-    if not candidatos:
-        raise ValueError(f"Ningún vector suficientemente alineado y cercano")
+    # Neighbours inside max_dist, without the link itself
+    vecinos = index.query_radius(nodo_ini[0], nodo_ini[1], max_dist)
+    vecinos = vecinos[vecinos != row]
     
-    # Choose the best
-    candidatos = sorted(candidatos, key=lambda x: -x[1])
-    max_dot = candidatos[0][1]
-    mejores = [c for c in candidatos if np.isclose(c[1], max_dot, atol=1e-3)]
+    # Compare the base vector with all the candidate vectors at once
+    dots = links['direction'][vecinos] @ links['direction'][row]
+    dists = np.hypot(start[vecinos, 0] - nodo_ini[0], start[vecinos, 1] - nodo_ini[1])
+    alineados = dots >= dot_threshold
+    vecinos, dots, dists = vecinos[alineados], dots[alineados], dists[alineados]
     
-    if len(mejores) == 1:
-        pareja = mejores[0][0]
-    else:
-        mejores.sort(key=lambda x: x[2])
-        pareja = mejores[0][0]
+    if len(vecinos) == 0:
+        raise ValueError(f"Ningún vector suficientemente alineado y cercano")
     
-    # Delete the pair from the dictionary
-    for d in [coord_dict, x_sorted, y_sorted]:
-        d.pop(link_id, None)
-        d.pop(pareja, None)
+    pareja_row = elegir_pareja(vecinos, dots, dists)
     
-    return pareja, coord_dict, x_sorted, y_sorted
+    # Delete the pair from the index
+    index.remove(row)
+    index.remove(pareja_row)
+    
+    return links['link_ids'][pareja_row]
 
-def encontrar_link_alineados_fulldf(x_sorted, y_sorted, coord_dict, df, dot_threshold=0.90, max_dist=0.00035, n_vecinos=10):
+def encontrar_link_alineados_fulldf(links, df, dot_threshold=0.90, max_dist=0.00035):
     """Encuentra los links alineados para todo el DataFrame."""
-    # Create empty column
-    df['pareja'] = None
-    
-    # Copy of the dictionaries to update
-    coord_dict_actual = coord_dict.copy()
-    x_sorted_actual = x_sorted.copy()
-    y_sorted_actual = y_sorted.copy()
+    index = build_spatial_index(links, max_dist)
+    parejas = {}
     
     # Iterate over unique link_id values
-    for link_id in df['LINK_ID'].unique():
+    for link_id in links['link_ids']:
         # Skip if it was already processed
-        if link_id not in coord_dict_actual:
+        if links['row'][link_id] not in index:
             continue
         
         try:
-            pareja, coord_dict_actual, x_sorted_actual, y_sorted_actual = encontrar_link_alineado(
-                link_id, x_sorted_actual, y_sorted_actual, coord_dict_actual, df, dot_threshold, max_dist, n_vecinos
-            )
+            pareja = encontrar_link_alineado(link_id, index, links, dot_threshold, max_dist)
             
-            # Asign the pair to all rows with the same LINK_ID
-            df.loc[df['LINK_ID'] == link_id, 'pareja'] = pareja
-            df.loc[df['LINK_ID'] == pareja, 'pareja'] = link_id
+            # Asign the pair to both links
+            parejas[link_id] = pareja
+            parejas[pareja] = link_id
             
         except Exception:
             # Asign mistake (case 3) if pair not found.
-            df.loc[df['LINK_ID'] == link_id, 'pareja'] = 'Error 3: road is not Multiply Digitised'
+            parejas[link_id] = 'Error 3: road is not Multiply Digitised'
+    
+    df['pareja'] = df['LINK_ID'].map(parejas)
+
+def candidatos_por_link(start, direction, filas, dot_threshold=0.90, max_dist=0.00035):
+    """
+    Computes, for each of the given rows, every aligned link within `max_dist` regardless of whether it is already
+    paired. Used by the parallel pairing: the candidate search does not depend on the order in which links are
+    paired, so it runs vectorized over all the rows at once. The links are sorted by grid cell (of size `max_dist`)
+    and the 3x3 neighbouring cells of every row are found with a binary search.
+    Input: Arrays (n, 2) of reference nodes and unit directions, rows to search, pairing parameters
+    Output: Tuple (counts, candidates, dots, dists) with the number of candidates of each row and the concatenated
+            candidate rows, dot products and distances
+    """
+    filas = np.asarray(filas, dtype=np.int64)
+    validos = np.flatnonzero(np.isfinite(start).all(axis=1))
+    celdas = np.floor(start[validos] / max_dist).astype(np.int64)
+    
+    # Cell key of every valid link, with room for the neighbouring cells
+    minimo = celdas.min(axis=0) - 1 if len(validos) else np.zeros(2, dtype=np.int64)
+    ancho = (celdas[:, 1].max() - minimo[1] + 2) if len(validos) else 1
+    clave = lambda c: (c[:, 0] - minimo[0]) * ancho + (c[:, 1] - minimo[1])
+    orden = np.argsort(clave(celdas), kind='stable')
+    claves, ordenados = clave(celdas)[orden], validos[orden]
+    
+    posicion = np.full(len(start), -1, dtype=np.int64)
+    posicion[validos] = np.arange(len(validos))
+    buscadas = np.flatnonzero(posicion[filas] >= 0)
+    celdas_filas = celdas[posicion[filas[buscadas]]]
+    
+    # Pairs (position in `filas`, candidate row) of every row with the links of its 3x3 neighbouring cells
+    pos, candidatos = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            c = clave(celdas_filas + np.array([dx, dy]))
+            desde = np.searchsorted(claves, c, 'left')
+            cuantos = np.searchsorted(claves, c, 'right') - desde
+            pos.append(np.repeat(buscadas, cuantos))
+            candidatos.append(ordenados[np.repeat(desde - np.cumsum(cuantos) + cuantos, cuantos) + np.arange(cuantos.sum())])
+    pos, candidatos = np.concatenate(pos), np.concatenate(candidatos)
+    
+    # Keep the aligned candidates inside max_dist, without the link itself
+    row = filas[pos]
+    dists = np.hypot(start[candidatos, 0] - start[row, 0], start[candidatos, 1] - start[row, 1])
+    dots = (direction[candidatos] * direction[row]).sum(axis=1)
+    validos = (candidatos != row) & (dists <= max_dist) & (dots >= dot_threshold)
+    pos, candidatos, dots, dists = pos[validos], candidatos[validos], dots[validos], dists[validos]
+    
+    # Group by row, in the order of `filas`
+    orden = np.argsort(pos, kind='stable')
+    counts = np.bincount(pos, minlength=len(filas)).astype(np.int64)
+    return counts, candidatos[orden], dots[orden], dists[orden]
+
+def emparejar_voraz(filas, listas, disponible, pareja_row):
+    """
+    Greedy matching of the parallel pairing: in the given order, every row that is still available takes its best
+    available candidate (see elegir_pareja), exactly like encontrar_link_alineados_fulldf does with the spatial index.
+    Input: Rows in DataFrame order, list with the (candidates, dots, dists) arrays of each row, availability mask and
+           array with the pair row of every row (-1 if none), both updated in place
+    Output: None
+    """
+    for row, (vecinos, dots, dists) in zip(filas, listas):
+        if not disponible[row]:
+            continue
+        libres = disponible[vecinos]
+        if not libres.any():
+            continue
+        pareja = elegir_pareja(vecinos[libres], dots[libres], dists[libres])
+        disponible[row] = disponible[pareja] = False
+        pareja_row[row], pareja_row[pareja] = pareja, row
+
+def _emparejar_celda(args):
+    """
+    Worker of the parallel pairing for the core rows of one grid cell (rows are local to the cell + halo).
+    Candidate links are mutual (same distance and dot product), so the links connected through candidates form
+    components that can be matched independently. Components that stay inside the core are matched here; those that
+    reach the halo are marked as boundary and returned with their candidates to be matched in the parent.
+    Output: Tuple (pair row of every core row, -1 if none or boundary; boundary mask; candidates of the boundary rows)
+    """
+    start, direction, filas, dot_threshold, max_dist = args
+    counts, candidatos, dots, dists = candidatos_por_link(start, direction, filas, dot_threshold, max_dist)
+    limites = np.concatenate([[0], np.cumsum(counts)])
+    listas = [(candidatos[a:b], dots[a:b], dists[a:b]) for a, b in zip(limites[:-1], limites[1:])]
+    
+    en_core = np.zeros(len(start), dtype=bool)
+    en_core[filas] = True
+    posicion = np.full(len(start), -1, dtype=np.int64)
+    posicion[filas] = np.arange(len(filas))
+    
+    # Propagate the boundary mark from the rows with a candidate in the halo to their whole component
+    frontera = np.zeros(len(filas), dtype=bool)
+    pila = [k for k, (vecinos, _, _) in enumerate(listas) if not en_core[vecinos].all()]
+    while pila:
+        k = pila.pop()
+        if frontera[k]:
+            continue
+        frontera[k] = True
+        vecinos = listas[k][0]
+        pila.extend(posicion[vecinos[en_core[vecinos]]].tolist())
+    
+    disponible = en_core.copy()
+    disponible[filas[frontera]] = False
+    pareja_row = np.full(len(start), -1, dtype=np.int64)
+    interior = np.flatnonzero(~frontera)
+    emparejar_voraz(filas[interior], [listas[k] for k in interior], disponible, pareja_row)
+    
+    return pareja_row[filas], frontera, [listas[k] for k in np.flatnonzero(frontera)]
+
+def particionar_links(start, n_celdas, halo):
+    """
+    Splits the links into a grid of spatial cells over their reference nodes.
+    Input: Array (n, 2) of reference nodes, number of cells per axis, halo margin (at least max_dist)
+    Output: List of (core rows, core + halo rows) for every non-empty cell, both sorted
+    """
+    validos = np.isfinite(start).all(axis=1)
+    minimo = start[validos].min(axis=0)
+    tamano = (start[validos].max(axis=0) - minimo) / n_celdas
+    tamano[tamano <= 0] = 1.0
+    celda = np.clip(np.floor((start - minimo) / tamano), 0, n_celdas - 1).astype(np.int64)
+    
+    celdas = []
+    for i in range(n_celdas):
+        for j in range(n_celdas):
+            core = np.flatnonzero((celda[:, 0] == i) & (celda[:, 1] == j) & validos)
+            if len(core) == 0:
+                continue
+            bajo = minimo + np.array([i, j]) * tamano - halo
+            alto = minimo + np.array([i + 1, j + 1]) * tamano + halo
+            vecindad = np.union1d(np.flatnonzero(((start >= bajo) & (start <= alto)).all(axis=1)), core)
+            celdas.append((core, vecindad))
+    return celdas
+
+def encontrar_link_alineados_paralelo(links, df, workers, dot_threshold=0.90, max_dist=0.00035):
+    """
+    Parallel version of encontrar_link_alineados_fulldf with identical output.
+    The links are split into spatial grid cells with a halo of `max_dist`, and each cell runs in a ProcessPoolExecutor:
+    the candidate search and the greedy matching (each link takes its best available candidate, in DataFrame order)
+    of the components of candidate links that stay inside the cell. Only the components that cross a cell boundary
+    are matched in the parent, so the serial part grows with the cell perimeters instead of with the number of links.
+    The workers start from a forkserver instead of forking the API process, which already runs threads.
+    Input: Arrays from preparar_arreglos_links, DataFrame, number of worker processes, pairing parameters
+    Output: None
+    """
+    start, direction = links['start'], links['direction']
+    n = len(start)
+    n_celdas = max(1, math.ceil(math.sqrt(workers * 4)))
+    
+    tareas = []
+    celdas = particionar_links(start, n_celdas, max_dist) if n else []
+    for core, vecindad in celdas:
+        filas_locales = np.searchsorted(vecindad, core)
+        tareas.append((start[vecindad], direction[vecindad], filas_locales, dot_threshold, max_dist))
+    
+    # Pairs of the interior components, and candidates of the boundary rows in global rows
+    pareja_row = np.full(n, -1, dtype=np.int64)
+    frontera = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_CONTEXTO_WORKERS) as executor:
+        for (core, vecindad), resultado in zip(celdas, executor.map(_emparejar_celda, tareas)):
+            parejas_locales, en_frontera, listas = resultado
+            interior = ~en_frontera
+            pareja_row[core[interior]] = np.where(parejas_locales[interior] >= 0, vecindad[parejas_locales[interior]], -1)
+            for row, (vecinos, dots, dists) in zip(core[en_frontera].tolist(), listas):
+                frontera[row] = (vecindad[vecinos], dots, dists)
+    
+    # Greedy matching of the boundary components in DataFrame order
+    filas = sorted(frontera)
+    disponible = np.zeros(n, dtype=bool)
+    disponible[filas] = True
+    emparejar_voraz(filas, [frontera[row] for row in filas], disponible, pareja_row)
+    
+    asignar_parejas(df, links, pareja_row)
+
+def construir_tabla_links(df, links):
+    """
+    Builds the link-level table used by the pair stages: one row per link, in the same order as `links`.
+    Input: DataFrame with columns LINK_ID and pareja, arrays from preparar_arreglos_links
+    Output: DataFrame with columns LINK_ID, pareja and pareja_row (row of the pair in `links`, -1 if it has no pair)
+    """
+    tabla = df.drop_duplicates(subset='LINK_ID', keep='first')[['LINK_ID', 'pareja']].reset_index(drop=True)
+    tabla['pareja_row'] = tabla['pareja'].map(links['row']).fillna(-1).astype(np.int64)
+    return tabla
 
-def agregar_coordenadas_pareja(df):
-    """Add the coordinates of its pair to each link_id.
-    Input: DataFrame 
+def agregar_coordenadas_pareja(df, links):
+    """Add to each link_id the reference to the coordinates of its pair: column 'pareja_idx' with the index of the
+    pair geometry in the GeometryStore (-1 if it has no pair).
+    Input: DataFrame, arrays from preparar_arreglos_links
     Output: None"""
-    df['pareja_coord'] = None
+    tabla = construir_tabla_links(df, links)
+    
+    pareja_row = tabla['pareja_row'].to_numpy()
+    pareja_idx = np.where(pareja_row >= 0, links['geom_idx'][pareja_row], -1)
     
-    for lid in df['LINK_ID'].unique():
-        pareja = df[df['LINK_ID'] == lid].reset_index().loc[0, 'pareja']
-        if pareja != 'Error 3: road is not Multiply Digitised':
-            row = df[df['LINK_ID'] == pareja].reset_index()
-            coordenadas = row.loc[0, 'geometry']
-            df.loc[df['LINK_ID'] == lid, 'pareja_coord'] = str(coordenadas)
+    df['pareja_idx'] = df['LINK_ID'].map(pd.Series(pareja_idx, index=tabla['LINK_ID'])).astype(np.int64)
 
-def add_camellon_column_for_pair(link_id1, ref_node_1, next_node_1, link_id2, ref_node_2, next_node_2, df):
-    """Add the column of the side in which side of the link_id is the ridge located. 
+def calcular_lado_camellon(v1, v2):
+    """Computes in which side of the first link of each pair the ridge is located.
     Input: 
-    -link_id1: link_id of the first pair
-    -ref_node_1, next_node_1: Two first nodes of link_id1 geometry. 
-    -link_id2: link_id of the second pair
-    -ref_node_2, next_node_2: Two first nodes of link_id2 geometry.
-    -df: DataFrame
-    Output: None
+    -v1: array (n, 2) with the vectors between the two first nodes of the first link of each pair.
+    -v2: array (n, 2) with the vectors between the two first nodes of the second link of each pair.
+    Output: Array (n,) with 'L' or 'R' for the first link (the second link gets the opposite side)
     """
-    v1 = (next_node_1[0] - ref_node_1[0], next_node_1[1] - ref_node_1[1])
-    v2 = (next_node_2[0] - ref_node_2[0], next_node_2[1] - ref_node_2[1])
-    
-    if v1[1] == v2[1]:
-        if v1[0] < v2[0]:
-            df.loc[df['LINK_ID'] == link_id1, 'camellon'] = 'R'
-            df.loc[df['LINK_ID'] == link_id2, 'camellon'] = 'L'
-        else:
-            df.loc[df['LINK_ID'] == link_id1, 'camellon'] = 'L'
-            df.loc[df['LINK_ID'] == link_id2, 'camellon'] = 'R'
-    elif v1[1] < v2[1]:
-        df.loc[df['LINK_ID'] == link_id1, 'camellon'] = 'L'
-        df.loc[df['LINK_ID'] == link_id2, 'camellon'] = 'R'
-    else:
-        df.loc[df['LINK_ID'] == link_id1, 'camellon'] = 'R'
-        df.loc[df['LINK_ID'] == link_id2, 'camellon'] = 'L'
+    return np.where(
+        v1[:, 1] == v2[:, 1],
+        np.where(v1[:, 0] < v2[:, 0], 'R', 'L'),
+        np.where(v1[:, 1] < v2[:, 1], 'L', 'R')
+    )
 
-def add_camellon_column_for_df(df):
+def add_camellon_column_for_df(df, links):
     """Adds the 'ridge' column to all df.
-    Input: DataFrame
+    The side is computed for every pair at once; when the two orders of a pair disagree (identical vectors) the side
+    computed from the link that appears last in the DataFrame is kept.
+    Input: DataFrame, arrays from preparar_arreglos_links
     Ouput: None 
     """
+    tabla = construir_tabla_links(df, links)
     
-    df['camellon'] = None
+    filas = np.flatnonzero(tabla['pareja_row'].to_numpy() >= 0)
+    parejas = tabla['pareja_row'].to_numpy()[filas]
+    vectores = links['next'] - links['start']
     
-    for lid in df['LINK_ID'].unique():
-        pareja = df[df['LINK_ID'] == lid].reset_index().loc[0, 'pareja']
-        
-        if pareja != 'Error 3: road is not Multiply Digitised':
-            ref_node_1 = df[df['LINK_ID'] == lid].reset_index().loc[0, 'geometry'][0]
-            next_node_1 = df[df['LINK_ID'] == lid].reset_index().loc[0, 'geometry'][1]
-            ref_node_2 = df[df['LINK_ID'] == pareja].reset_index().loc[0, 'geometry'][0]
-            next_node_2 = df[df['LINK_ID'] == pareja].reset_index().loc[0, 'geometry'][1]
-            
-            add_camellon_column_for_pair(lid, ref_node_1, next_node_1, pareja, ref_node_2, next_node_2, df)
+    # Side as first link of the pair, and side given by the pair when it is the first link
+    lado_propio = calcular_lado_camellon(vectores[filas], vectores[parejas])
+    lado_pareja = calcular_lado_camellon(vectores[parejas], vectores[filas])
+    opuesto = np.where(lado_pareja == 'R', 'L', 'R')
+    
+    camellon = np.full(len(tabla), None, dtype=object)
+    camellon[filas] = np.where(filas > parejas, lado_propio, opuesto)
+    
+    df['camellon'] = df['LINK_ID'].map(pd.Series(camellon, index=tabla['LINK_ID']))
+
+def asignar_parejas(df, links, pareja_row):
+    """Sets the 'pareja' column from the row of the pair of every link (-1 if it has no pair).
+    Input: DataFrame, arrays from preparar_arreglos_links, array (n,) with the pair rows
+    Output: None
+    """
+    link_ids = links['link_ids']
+    parejas = {
+        lid: link_ids[p] if p >= 0 else 'Error 3: road is not Multiply Digitised'
+        for lid, p in zip(link_ids, pareja_row.tolist())
+    }
+    df['pareja'] = df['LINK_ID'].map(parejas)
+
+def obtener_parejas(links, df, nav_hash, dot_threshold=0.90, max_dist=0.00035, workers=None):
+    """
+    Finds the aligned links for the whole DataFrame, reusing the pair table stored in the network cache when the
+    same network (content hash), links (in the same order) and parameters were already paired.
+    With more than one worker (PROCESS_WORKERS by default) the pairing runs in parallel by spatial cells.
+    Input: Arrays from preparar_arreglos_links, DataFrame, content hash of the GeoJSON, pairing parameters, number of workers
+    Output: None
+    """
+    workers = PROCESS_WORKERS if workers is None else workers
+    clave = hash_claves('parejas', nav_hash, links['link_ids'], dot_threshold, max_dist)
+    
+    cache = cargar_arreglos(NETWORK_CACHE_DIR, clave) if NETWORK_CACHE_MAX_BYTES > 0 else None
+    if cache is not None:
+        print(f"Parejas cargadas desde caché: {clave[:12]}")
+        asignar_parejas(df, links, cache['pareja_row'])
+        return
+    
+    if workers > 1:
+        encontrar_link_alineados_paralelo(links, df, workers, dot_threshold, max_dist)
+    else:
+        encontrar_link_alineados_fulldf(links, df, dot_threshold, max_dist)
+    if NETWORK_CACHE_MAX_BYTES > 0:
+        pareja_row = construir_tabla_links(df, links)['pareja_row'].to_numpy()
+        guardar_arreglos(NETWORK_CACHE_DIR, clave, NETWORK_CACHE_MAX_BYTES, link_ids=links['link_ids'], pareja_row=pareja_row)
 
 def get_final_df(df):
     """
@@ -302,8 +676,11 @@ def get_final_df(df):
     """
     return df[df['POI_ST_SD'] == df['camellon']]
 
-def process_data(slice=-1):
-    """Procesa los datos y obtiene el DataFrame final."""
+def process_data(limit=None, avance=None):
+    """Procesa los datos y obtiene el DataFrame final junto con el GeometryStore de sus links.
+    Todos los POIs participan en la búsqueda de parejas; `limit` (opcional) solo recorta el DataFrame final
+    para vistas previas rápidas, así que la lectura del NAV y el emparejamiento cuestan lo mismo que sin él. `avance` (opcional) se llama con (pasos terminados, total de pasos) antes del
+    primer paso y tras cada uno; una excepción lanzada por él detiene el proceso."""
     # Intentar encontrar los archivos en múltiples posibles ubicaciones
     possible_data_dirs = [
         DATA_DIR,                                                  # Usar la variable de entorno
@@ -332,27 +709,40 @@ def process_data(slice=-1):
     
     print(f"Usando archivos: {path_gdf}, {path_poi}")
     
+    pasos = 6
+    avance = avance or (lambda terminados, total: None)
     try:
-        # Obtener DataFrame de puntos
-        df_poi = get_points_df(path_gdf, path_poi, slice)
+        avance(0, pasos)
+        # Obtener DataFrame de puntos y la red de sus links (desde caché si los archivos no cambiaron)
+        nav_hash = hash_archivo(path_gdf)
+        df_poi, store = get_points_df(path_gdf, path_poi, nav_hash=nav_hash)
+        avance(1, pasos)
         
-        # Crear diccionarios y ordenamientos
-        coord = create_dicts_for_sorting(df_poi)
-        x_sorted, y_sorted = get_sorted_x_y(df_poi)
+        # Precalcular nodos de referencia y direcciones de cada link
+        links = preparar_arreglos_links(df_poi, store)
+        avance(2, pasos)
         
-        # Encontrar parejas
-        encontrar_link_alineados_fulldf(x_sorted, y_sorted, coord, df_poi)
+        # Encontrar parejas (desde caché si ya se calcularon)
+        obtener_parejas(links, df_poi, nav_hash)
+        avance(3, pasos)
         
         # Agregar coordenadas de la pareja
-        agregar_coordenadas_pareja(df_poi)
+        agregar_coordenadas_pareja(df_poi, links)
+        avance(4, pasos)
         
         # Agregar columna camellon
-        add_camellon_column_for_df(df_poi)
+        add_camellon_column_for_df(df_poi, links)
+        avance(5, pasos)
         
         # Obtener DataFrame final
         final_df = get_final_df(df_poi)
+        if limit is not None:
+            final_df = final_df.head(limit)
+        avance(pasos, pasos)
         
-        return final_df
+        return final_df, store
+    except TrabajoCancelado:
+        raise
     except Exception as e:
         print(f"Error en process_data: {str(e)}")
         print(traceback.format_exc())
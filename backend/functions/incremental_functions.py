@@ -0,0 +1,148 @@
+import numpy as np
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from functions.cache_functions import CACHE_DIR, hash_archivo, hash_claves
+from functions.satellite_functions import TILE_SOURCE, TILE_SOURCE_PATH, TILE_MOSAIC
+from functions.inference_functions import INFERENCE_BACKEND
+from functions.cnn_functions import (
+    MODEL_PATH, MODEL_SIDES_PATH, ZOOM_LEVEL, TILE_FORMAT, TILE_SIZE, PREPROCESS_VERSION, resolver_ruta_modelo,
+    predecir_por_lotes
+)
+
+# Use environment variables
+RESULTS_CACHE_DIR = os.path.join(CACHE_DIR, 'resultados')
+RESULTS_FILE = os.path.join(RESULTS_CACHE_DIR, 'resultados.json')
+INCREMENTAL_VALIDATION = os.environ.get('INCREMENTAL_VALIDATION', 'True').lower() == 'true'
+RESULTS_CACHE_MAX_ENTRIES = int(os.environ.get('RESULTS_CACHE_MAX_ENTRIES', 500_000))
+
+# Etiquetas que no se reutilizan porque dependen de fallos transitorios (tiles no disponibles, errores); tampoco se
+# reutiliza ningún resultado con 'error' (p. ej. un lado adyacente que no se pudo clasificar)
+LABELS_NO_REUTILIZABLES = {'Error', '3. Invalid location'}
+
+# Serializa la lectura, mezcla y escritura del archivo de resultados entre trabajos concurrentes
+_resultados_lock = threading.Lock()
+
+def version_validacion():
+    """
+    Identifies everything besides the data that determines a prediction: the weights of both models and their
+    inference backend, the image preprocessing version, the satellite tile settings and the tile source (including
+    the content of an MBTiles file).
+    Stored results are only reused under the same version.
+
+    Output: Hexadecimal digest
+    """
+    partes = [ZOOM_LEVEL, TILE_FORMAT, TILE_SIZE, TILE_SOURCE, TILE_SOURCE_PATH, TILE_MOSAIC, INFERENCE_BACKEND, PREPROCESS_VERSION]
+    if TILE_SOURCE == 'mbtiles':
+        partes.append(hash_archivo(TILE_SOURCE_PATH))
+    for model_path in (MODEL_PATH, MODEL_SIDES_PATH):
+        path, _ = resolver_ruta_modelo(model_path)
+        partes.append(hash_archivo(path, sidecar=False) if os.path.exists(path) else None)
+    return hash_claves(*partes)
+
+def huellas_poi(df, store, version):
+    """
+    Computes a fingerprint per POI row from its POI_ID and relevant fields (LINK_ID, POI_NAME, POI_ST_SD, PERCFRREF),
+    the geometry of its link and of the paired link, the ridge side and the validation version. A POI keeps its
+    fingerprint between uploads only if neither the POI nor the links that determine its prediction changed.
+
+    Input: Final DataFrame from process_data, GeometryStore, version from version_validacion
+
+    Output: List of hexadecimal fingerprints, in the order of `df`
+    """
+    # Hash de la geometría de cada link usado (propio o pareja)
+    indices = np.unique(np.concatenate([df['geom_idx'].to_numpy(), df['pareja_idx'].to_numpy()]))
+    geometrias = {
+        int(i): hashlib.blake2b(store.geometry(i).tobytes(), digest_size=16).hexdigest() if i >= 0 else ''
+        for i in indices
+    }
+
+    huellas = []
+    columnas = zip(df['POI_ID'], df['LINK_ID'], df['POI_NAME'], df['POI_ST_SD'], df['PERCFRREF'],
+                   df['geom_idx'], df['pareja_idx'], df['camellon'])
+    for pid, lid, nombre, lado, percent, geom_idx, pareja_idx, camellon in columnas:
+        texto = f"{pid}|{lid}|{nombre}|{lado}|{float(percent)!r}|{geometrias[int(geom_idx)]}|{geometrias[int(pareja_idx)]}|{camellon}|{version}"
+        huellas.append(hashlib.blake2b(texto.encode('utf-8'), digest_size=16).hexdigest())
+    return huellas
+
+def cargar_resultados_previos():
+    """Loads the stored results as {fingerprint: result}, least recently used first, empty if there are none."""
+    try:
+        with open(RESULTS_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def guardar_resultados(resultados_por_huella):
+    """
+    Merges the results of the current run {fingerprint: result} into the stored ones, so previews (limit) and
+    concurrent jobs keep the results of other runs. The given fingerprints become the most recently used and at most
+    RESULTS_CACHE_MAX_ENTRIES are kept, evicting the least recently used; a limit of 0 disables storing.
+    The file is replaced atomically.
+    """
+    if RESULTS_CACHE_MAX_ENTRIES <= 0:
+        return
+    with _resultados_lock:
+        resultados = cargar_resultados_previos()
+        for huella, resultado in resultados_por_huella.items():
+            # Reinsertar al final para llevar el orden de uso (LRU)
+            resultados.pop(huella, None)
+            resultados[huella] = resultado
+        for huella in list(resultados)[:max(0, len(resultados) - RESULTS_CACHE_MAX_ENTRIES)]:
+            del resultados[huella]
+
+        os.makedirs(RESULTS_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=RESULTS_CACHE_DIR, prefix='.tmp_', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(resultados, f, default=lambda o: o.item() if hasattr(o, 'item') else str(o))
+            os.replace(tmp_path, RESULTS_FILE)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+def predecir_incremental(df, store, batch_size=None, reporte=None, avance=None):
+    """
+    Incremental version of predecir_por_lotes: compares every POI against the stored results by fingerprint
+    (see huellas_poi) and only runs the satellite fetch and CNN inference for new POIs or POIs whose fields,
+    link or paired link changed. The results of the unchanged POIs are reused.
+    Only the prediction is incremental: process_data (NAV read and pairing) still runs over the whole upload, since
+    the pairs of a link depend on the links around it.
+
+    Input: Final DataFrame from process_data, GeometryStore, rows per batch, optional dictionary that receives the
+           run report (as predecir_por_lotes, with pois counting every POI, plus reutilizados and recalculados;
+           the timings and pois_por_segundo refer to the recalculated ones), optional progress function (as
+           predecir_por_lotes, over the POIs to recalculate)
+
+    Output: Dictionary with the results of every POI, as returned by predecir
+    """
+    previos = cargar_resultados_previos()
+    huellas = huellas_poi(df, store, version_validacion())
+
+    reutilizar = np.array([h in previos for h in huellas], dtype=bool)
+    pendientes = df.loc[~reutilizar]
+    print(f"Validación incremental: {int(reutilizar.sum())} POIs sin cambios, {len(pendientes)} por recalcular")
+
+    resultados = {}
+    for pid, huella, reutilizado in zip(df['POI_ID'], huellas, reutilizar):
+        if reutilizado:
+            resultados[pid] = previos[huella]
+    if len(pendientes):
+        resultados.update(predecir_por_lotes(pendientes, batch_size=batch_size, reporte=reporte, store=store, avance=avance))
+    elif reporte is not None:
+        reporte.update({'pois': 0, 'lotes': 0, 'segundos': 0.0, 'pois_por_segundo': 0.0})
+
+    # Agregar los resultados reutilizables de esta ejecución a los guardados
+    guardar_resultados({
+        huella: resultados[pid]
+        for pid, huella in zip(df['POI_ID'], huellas)
+        if pid in resultados and resultados[pid].get('label') not in LABELS_NO_REUTILIZABLES and 'error' not in resultados[pid]
+    })
+
+    if reporte is not None:
+        reporte.update({'pois': len(df), 'reutilizados': int(reutilizar.sum()), 'recalculados': len(pendientes)})
+    return resultados
@@ -0,0 +1,117 @@
+import numpy as np
+import copy
+import inspect
+import io
+import os
+import torch
+
+# Use environment variables
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'eager').lower()
+INFERENCE_PARITY_TOLERANCE = float(os.environ.get('INFERENCE_PARITY_TOLERANCE', 0.05))
+
+# Backends disponibles: PyTorch eager, TorchScript o torch.compile con channels_last, ONNX Runtime (dependencia
+# opcional) y cuantización dinámica int8 de las capas lineales
+BACKENDS = ('eager', 'torchscript', 'compile', 'onnx', 'int8')
+
+class ChannelsLast(torch.nn.Module):
+    """Wraps a model so its input is converted to the channels_last memory format before the forward pass."""
+
+    def __init__(self, model):
+        super(ChannelsLast, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+class ModeloONNX:
+    """Runs a model exported to ONNX with ONNX Runtime, taking and returning torch tensors like the original."""
+
+    def __init__(self, contenido):
+        import onnxruntime
+
+        opciones = onnxruntime.SessionOptions()
+        opciones.intra_op_num_threads = torch.get_num_threads()
+        self.sesion = onnxruntime.InferenceSession(contenido, opciones, providers=['CPUExecutionProvider'])
+
+    def __call__(self, x):
+        return torch.from_numpy(self.sesion.run(None, {'entrada': x.cpu().numpy()})[0])
+
+def exportar_onnx(model, ejemplo):
+    """Exports a model to ONNX in memory with a dynamic batch dimension and returns the serialized graph."""
+    argumentos = {}
+    # Las versiones recientes de torch exportan con dynamo por defecto; se usa el exportador de TorchScript
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        argumentos['dynamo'] = False
+    contenido = io.BytesIO()
+    torch.onnx.export(
+        model, ejemplo.cpu(), contenido, input_names=['entrada'], output_names=['salida'],
+        dynamic_axes={'entrada': {0: 'lote'}, 'salida': {0: 'lote'}}, **argumentos
+    )
+    return contenido.getvalue()
+
+def preparar_backend(model, backend, ejemplo):
+    """
+    Builds the version of a model that runs on the given inference backend. The original model is not modified.
+
+    Input: Model in eval mode, backend name (see BACKENDS), example input batch on the model's device
+
+    Output: Callable that takes an input batch and returns the model output
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de inferencia desconocido: {backend}. Opciones: {', '.join(BACKENDS)}")
+    if backend == 'eager':
+        return model
+    if backend in ('onnx', 'int8') and ejemplo.device.type != 'cpu':
+        raise ValueError(f"El backend {backend} solo está disponible en CPU")
+
+    copia = copy.deepcopy(model).eval()
+    with torch.no_grad():
+        if backend == 'torchscript':
+            optimizado = ChannelsLast(copia.to(memory_format=torch.channels_last)).eval()
+            return torch.jit.freeze(torch.jit.trace(optimizado, ejemplo))
+        if backend == 'compile':
+            return torch.compile(ChannelsLast(copia.to(memory_format=torch.channels_last)).eval())
+        if backend == 'onnx':
+            return ModeloONNX(exportar_onnx(copia, ejemplo))
+        return torch.ao.quantization.quantize_dynamic(copia, {torch.nn.Linear}, dtype=torch.qint8)
+
+def imagenes_paridad(n=32, size=256, seed=0):
+    """
+    Fixed set of synthetic RGB tiles for parity checks: flat ground colours with noise, some crossed by road-like
+    bands and some with building-like blocks.
+
+    Output: List of `n` uint8 arrays (size, size, 3)
+    """
+    rng = np.random.default_rng(seed)
+    imagenes = []
+    for k in range(n):
+        imagen = rng.integers(0, 256, 3) + rng.normal(0, 30, (size, size, 3))
+        if k % 2:
+            # Banda gris a lo largo de la imagen
+            inicio = rng.integers(0, size // 2)
+            imagen[:, inicio:inicio + size // 4] = rng.integers(60, 140) + rng.normal(0, 10, (size, size // 4, 1))
+        if k % 3 == 0:
+            # Bloques de color uniforme
+            for _ in range(rng.integers(1, 5)):
+                y, x = rng.integers(0, size - 40, 2)
+                imagen[y:y + 40, x:x + 40] = rng.integers(0, 256, 3)
+        imagenes.append(np.clip(imagen, 0, 255).astype(np.uint8))
+    return imagenes
+
+def verificar_paridad(referencia, candidato, entradas, tolerancia=None):
+    """
+    Compares a backend against the fp32 eager model on the same inputs.
+
+    Input: Reference model, model on the backend, input batch, maximum allowed absolute difference of the outputs
+           (INFERENCE_PARITY_TOLERANCE by default)
+
+    Output: Dictionary with max_abs_diff, label_agreement (fraction of equal labels at 0.5) and ok (difference within
+            the tolerance and every label equal)
+    """
+    tolerancia = INFERENCE_PARITY_TOLERANCE if tolerancia is None else tolerancia
+    with torch.no_grad():
+        esperado = referencia(entradas).reshape(-1).float().cpu().numpy()
+        obtenido = candidato(entradas).reshape(-1).float().cpu().numpy()
+    diferencia = float(np.abs(esperado - obtenido).max())
+    acuerdo = float(np.mean((esperado > 0.5) == (obtenido > 0.5)))
+    return {'max_abs_diff': diferencia, 'label_agreement': acuerdo, 'ok': diferencia <= tolerancia and acuerdo == 1.0}
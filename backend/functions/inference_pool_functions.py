@@ -0,0 +1,236 @@
+import atexit
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from functions.inference_functions import preparar_backend
+
+# Use environment variables
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+INFERENCE_WORKER_THREADS = int(os.environ.get('INFERENCE_WORKER_THREADS', 1))
+INFERENCE_RING_SLOTS = int(os.environ.get('INFERENCE_RING_SLOTS', 0))
+
+def _trabajador(k, tareas, resultados, entradas, salidas, hilos):
+    """
+    Loop of an inference worker process. Models arrive once with their weights in shared memory; each task names a
+    slot of the ring buffer, whose input batch is read and whose output is written in place. The generation of the
+    slot is sent back with the result.
+    """
+    torch.set_num_threads(hilos)
+    modelos = {}
+    while True:
+        tarea = tareas.get()
+        if tarea is None:
+            break
+        if tarea[0] == 'modelo':
+            _, nombre, model, backend = tarea
+            if backend != 'eager':
+                # Los backends compilados o cuantizados crean su propia copia de los pesos en cada worker
+                try:
+                    model = preparar_backend(model, backend, torch.zeros((1,) + tuple(entradas.shape[2:])))
+                except Exception as e:
+                    print(f"Worker {k}: no se pudo usar el backend {backend} para el modelo {nombre}, se usa eager: {e}")
+            modelos[nombre] = model
+            continue
+
+        _, slot, generacion, n, nombre = tarea
+        try:
+            with torch.no_grad():
+                salidas[slot, :n] = modelos[nombre](entradas[slot, :n]).reshape(-1).float()
+            resultados.put((k, slot, generacion, None))
+        except Exception as e:
+            resultados.put((k, slot, generacion, f"{type(e).__name__}: {e}"))
+
+class _Resultado:
+    """Output of a batch split over several ring buffer slots."""
+
+    def __init__(self, futuros):
+        self.futuros = futuros
+
+    def result(self, timeout=None):
+        return np.concatenate([futuro.result(timeout) for futuro in self.futuros])
+
+class PoolInferencia:
+    """
+    Pool of inference worker processes. Each worker runs with `hilos` intra-op threads, so throughput grows with
+    the number of workers instead of depending on torch's parallelism inside one small batch.
+
+    Model weights are moved to shared memory once and every worker maps the same pages instead of holding a copy.
+    Input batches go through a ring buffer of `slots` shared tensors of `capacidad` images: the caller copies the
+    batch into a free slot and only the slot number is sent to the worker, which writes the outputs back in place.
+    When every slot is busy, new batches wait (backpressure).
+    """
+
+    def __init__(self, workers, forma, hilos=1, slots=None, capacidad=64):
+        self.workers = workers
+        self.capacidad = capacidad
+        slots = slots or 2 * workers
+        self._entradas = torch.zeros((slots, capacidad) + tuple(forma)).share_memory_()
+        self._salidas = torch.zeros((slots, capacidad)).share_memory_()
+        self._libres = queue.Queue()
+        for slot in range(slots):
+            self._libres.put(slot)
+        self._futuros = {}
+        # Cada uso de un slot tiene su generación, para descartar resultados de un uso anterior
+        self._generaciones = [0] * slots
+        self._pendientes = [set() for _ in range(workers)]
+        self._completadas = [0] * workers
+        self._muertos = set()
+        self._lock = threading.Lock()
+        self._cerrado = False
+
+        contexto = mp.get_context('spawn')
+        self._resultados = contexto.Queue()
+        self._tareas = [contexto.Queue() for _ in range(workers)]
+        self._procesos = [
+            contexto.Process(
+                target=_trabajador, args=(k, self._tareas[k], self._resultados, self._entradas, self._salidas, hilos),
+                name=f"inferencia-{k}", daemon=True
+            )
+            for k in range(workers)
+        ]
+        for proceso in self._procesos:
+            proceso.start()
+        threading.Thread(target=self._recolectar, name="inferencia-resultados", daemon=True).start()
+
+    def registrar(self, nombre, model, backend='eager'):
+        """Moves the weights of a model to shared memory and sends it to every worker."""
+        model.share_memory()
+        for tareas in self._tareas:
+            tareas.put(('modelo', nombre, model, backend))
+
+    def enviar(self, nombre, lote):
+        """
+        Sends an input batch to the workers. Batches larger than the slot capacity are split over several slots.
+
+        Input: Registered model name, float tensor (N, 3, height, width)
+
+        Output: Object whose result() returns the N outputs as a NumPy array
+        """
+        futuros = []
+        for desde in range(0, len(lote), self.capacidad):
+            parte = lote[desde:desde + self.capacidad]
+            slot = self._libres.get()
+            self._entradas[slot, :len(parte)].copy_(parte)
+            futuro = Future()
+            with self._lock:
+                if self._cerrado:
+                    self._libres.put(slot)
+                    raise RuntimeError("El pool de inferencia está cerrado")
+                vivos = [w for w in range(self.workers) if w not in self._muertos]
+                if not vivos:
+                    self._libres.put(slot)
+                    raise RuntimeError("No queda ningún worker de inferencia vivo")
+                k = min(vivos, key=lambda w: len(self._pendientes[w]))
+                self._pendientes[k].add(slot)
+                self._generaciones[slot] += 1
+                generacion = self._generaciones[slot]
+                self._futuros[slot] = (futuro, len(parte), generacion)
+            self._tareas[k].put(('lote', slot, generacion, len(parte), nombre))
+            futuros.append(futuro)
+        return _Resultado(futuros)
+
+    def _recolectar(self):
+        """
+        Resolves the batch of every finished slot and frees the slot; fails the batches of dead workers. A result whose
+        slot was already freed (its worker was given up as dead) or reused by a later batch is dropped.
+        """
+        while not self._cerrado:
+            self._revisar_workers()
+            try:
+                k, slot, generacion, error = self._resultados.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                entrada = self._futuros.get(slot)
+                if entrada is None or entrada[2] != generacion:
+                    continue
+                futuro, n, _ = self._futuros.pop(slot)
+                self._pendientes[k].discard(slot)
+                self._completadas[k] += 1
+            salida = self._salidas[slot, :n].numpy().copy()
+            self._libres.put(slot)
+            if error is None:
+                futuro.set_result(salida)
+            else:
+                futuro.set_exception(RuntimeError(error))
+
+    def _revisar_workers(self):
+        for k, proceso in enumerate(self._procesos):
+            if k in self._muertos or proceso.is_alive():
+                continue
+            with self._lock:
+                # Los lotes nuevos ya no se envían a este worker
+                self._muertos.add(k)
+                perdidos = [(slot, self._futuros.pop(slot)[0]) for slot in self._pendientes[k] if slot in self._futuros]
+                self._pendientes[k].clear()
+            for slot, futuro in perdidos:
+                self._libres.put(slot)
+                futuro.set_exception(RuntimeError(f"El worker de inferencia {k} terminó (código {proceso.exitcode})"))
+
+    def estadisticas(self):
+        """Returns the number of workers alive, and the pending and completed batches of each worker."""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'vivos': sum(proceso.is_alive() for proceso in self._procesos),
+                'pendientes': [len(p) for p in self._pendientes],
+                'completadas': list(self._completadas),
+                'slots_libres': self._libres.qsize()
+            }
+
+    def pids(self):
+        """Returns the process ids of the workers."""
+        return [proceso.pid for proceso in self._procesos]
+
+    def cerrar(self):
+        """Stops every worker process."""
+        with self._lock:
+            if self._cerrado:
+                return
+            self._cerrado = True
+        for tareas in self._tareas:
+            tareas.put(None)
+        for proceso in self._procesos:
+            proceso.join(timeout=5)
+
+class ModeloRemoto:
+    """Model of the registry that runs in the worker pool; callable like the local model."""
+
+    def __init__(self, pool, nombre):
+        self.pool = pool
+        self.nombre = nombre
+
+    def enviar(self, x):
+        return self.pool.enviar(self.nombre, x)
+
+    def __call__(self, x):
+        return torch.from_numpy(self.enviar(x).result()).reshape(-1, 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def obtener_pool(forma, capacidad):
+    """
+    Returns the process-wide worker pool (INFERENCE_WORKERS processes with INFERENCE_WORKER_THREADS threads each and
+    INFERENCE_RING_SLOTS slots, twice the workers by default), starting it on first use.
+
+    Input: Shape of one input image (3, height, width), images per slot
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PoolInferencia(INFERENCE_WORKERS, forma, INFERENCE_WORKER_THREADS, INFERENCE_RING_SLOTS, capacidad)
+            atexit.register(_pool.cerrar)
+        return _pool
+
+def estadisticas_pool():
+    """Returns the statistics of the worker pool, or None if it is not running."""
+    return _pool.estadisticas() if _pool is not None else None
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Use environment variables
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', 1))
+JOB_HISTORY = int(os.environ.get('JOB_HISTORY', 20))
+
+# Estados de un trabajo
+EN_COLA, EN_CURSO, COMPLETADO, FALLIDO, CANCELADO = 'queued', 'running', 'completed', 'failed', 'cancelled'
+TERMINADOS = {COMPLETADO, FALLIDO, CANCELADO}
+# Estado público de un trabajo en curso cuya cancelación se pidió pero que aún no se detiene
+CANCELANDO = 'cancelling'
+
+class TrabajoCancelado(Exception):
+    """Raised inside a job when it has been cancelled, to stop it at the next progress report."""
+
+class Trabajo:
+    """
+    A validation run executed in the background. The job function receives it to report its stage and progress;
+    both calls raise TrabajoCancelado once the job is cancelled.
+    """
+
+    def __init__(self, parametros):
+        self.id = uuid.uuid4().hex
+        self.parametros = parametros
+        self.estado = EN_COLA
+        self.etapa = None
+        self.procesados = 0
+        self.total = None
+        self.creado = time.time()
+        self.inicio = None
+        self.fin = None
+        self.error = None
+        self.resultados = None
+        self.reporte = None
+        self.futuro = None
+        self._cancelar = threading.Event()
+        self._inicio_avance = None
+
+    def verificar(self):
+        """Raises TrabajoCancelado if the job has been cancelled."""
+        if self._cancelar.is_set():
+            raise TrabajoCancelado()
+
+    def cambiar_etapa(self, etapa):
+        self.verificar()
+        self.etapa = etapa
+        self.procesados, self.total, self._inicio_avance = 0, None, None
+
+    def avance(self, procesados, total):
+        """Progress callback (see process_data and predecir_por_lotes): units processed so far out of `total`."""
+        if self._inicio_avance is None:
+            self._inicio_avance = time.time()
+        self.procesados, self.total = procesados, total
+        self.verificar()
+
+    def eta(self):
+        """Seconds left in the current stage, estimated from its throughput so far, or None."""
+        if self.estado != EN_CURSO or not self.total or not self.procesados or self._inicio_avance is None:
+            return None
+        transcurrido = time.time() - self._inicio_avance
+        return (self.total - self.procesados) * transcurrido / self.procesados
+
+    def resumen(self):
+        """Returns the public status of the job."""
+        fin = self.fin or time.time()
+        return {
+            'job_id': self.id,
+            'status': CANCELANDO if self.estado == EN_CURSO and self._cancelar.is_set() else self.estado,
+            'stage': self.etapa,
+            'processed': self.procesados,
+            'total': self.total,
+            'eta_seconds': self.eta(),
+            'elapsed_seconds': fin - self.inicio if self.inicio else 0.0,
+            'created': self.creado,
+            'parameters': self.parametros,
+            'error': self.error,
+            'report': self.reporte
+        }
+
+class JobManager:
+    """
+    Runs validation jobs in a background thread pool, at most `concurrencia` at a time; the rest wait in order.
+    Finished jobs are kept (up to `historial`) so their status and results can still be queried.
+    """
+
+    def __init__(self, concurrencia, historial):
+        self._executor = ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix='trabajo')
+        self.historial = historial
+        self._trabajos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def crear(self, funcion, **parametros):
+        """
+        Queues a job.
+
+        Input: Function called as funcion(trabajo, **parametros) that returns (resultados, reporte), its parameters
+
+        Output: Trabajo
+        """
+        trabajo = Trabajo(parametros)
+        with self._lock:
+            self._trabajos[trabajo.id] = trabajo
+            self._recortar()
+        trabajo.futuro = self._executor.submit(self._ejecutar, trabajo, funcion)
+        return trabajo
+
+    def _ejecutar(self, trabajo, funcion):
+        if trabajo._cancelar.is_set():
+            trabajo.estado, trabajo.fin = CANCELADO, time.time()
+            return
+        trabajo.estado, trabajo.inicio = EN_CURSO, time.time()
+        try:
+            trabajo.resultados, trabajo.reporte = funcion(trabajo, **trabajo.parametros)
+            trabajo.estado = COMPLETADO
+        except TrabajoCancelado:
+            trabajo.estado = CANCELADO
+            print(f"Trabajo {trabajo.id} cancelado en la etapa {trabajo.etapa}")
+        except Exception as e:
+            trabajo.estado, trabajo.error = FALLIDO, getattr(e, 'detail', None) or str(e)
+            print(f"Error en el trabajo {trabajo.id}: {trabajo.error}")
+            print(traceback.format_exc())
+        finally:
+            trabajo.fin = time.time()
+
+    def _recortar(self):
+        # Olvidar los trabajos terminados más antiguos
+        terminados = [t for t in self._trabajos.values() if t.estado in TERMINADOS]
+        for trabajo in terminados[:max(0, len(terminados) - self.historial)]:
+            del self._trabajos[trabajo.id]
+
+    def obtener(self, job_id):
+        """Returns the job with `job_id`, or None."""
+        with self._lock:
+            return self._trabajos.get(job_id)
+
+    def cancelar(self, job_id):
+        """
+        Cancels a job: a queued job never starts and a running one stops at its next progress report; until then its
+        status is "cancelling".
+
+        Output: The job, or None if it does not exist
+        """
+        trabajo = self.obtener(job_id)
+        if trabajo is None or trabajo.estado in TERMINADOS:
+            return trabajo
+        trabajo._cancelar.set()
+        if trabajo.futuro is not None and trabajo.futuro.cancel():
+            trabajo.estado, trabajo.fin = CANCELADO, time.time()
+        return trabajo
+
+    def listar(self):
+        """Returns the status of every known job, oldest first."""
+        with self._lock:
+            return [trabajo.resumen() for trabajo in self._trabajos.values()]
+
+JOBS = JobManager(JOB_CONCURRENCY, JOB_HISTORY)
@@ -0,0 +1,181 @@
+import os
+import queue
+import threading
+import time
+
+# Use environment variables
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 2))
+
+# Marca de fin de la entrada de una etapa
+_FIN = object()
+
+# Estadísticas de la ejecución en curso (o la última), por etapa
+ESTADO_PIPELINE = {}
+_estado_lock = threading.Lock()
+
+def _poner(cola, item, parar):
+    """Puts an item on a bounded queue, waiting while it is full (backpressure) unless the run is stopped."""
+    while not parar.is_set():
+        try:
+            cola.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _tomar(cola, parar):
+    """Takes the next item of a queue, or _FIN if the run is stopped."""
+    while not parar.is_set():
+        try:
+            return cola.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _FIN
+
+def ejecutar_pipeline(items, etapas, capacidad=None, tamano=None):
+    """
+    Runs every item through a chain of stages joined by bounded queues. Each stage has its own worker threads, so
+    different items are in different stages at the same time (e.g. tiles of one chunk are fetched while the previous
+    chunk is on the CNN) and throughput is bounded by the slowest stage instead of by the sum of all of them. A full
+    queue blocks the stage that feeds it, so at most `capacidad` items wait between two stages.
+
+    Input: Iterable of items, list of (name, function, workers) where each function takes an item and returns the
+           item for the next stage, queue capacity (PIPELINE_QUEUE_SIZE by default), optional function giving the
+           number of POIs of an item for the throughput figures
+
+    Output: Tuple (outputs of the last stage in the order of `items`, statistics per stage: workers, items, pois,
+            busy seconds, run seconds, utilization, POIs per busy second, maximum and mean queue depth)
+
+    An exception in any stage stops the run and is raised again here.
+    """
+    capacidad = capacidad or PIPELINE_QUEUE_SIZE
+    tamano = tamano or (lambda item: 1)
+    colas = [queue.Queue(maxsize=capacidad) for _ in etapas]
+    parar = threading.Event()
+    fallos = []
+    salidas = {}
+    inicio = time.perf_counter()
+
+    stats = {
+        nombre: {'workers': workers, 'items': 0, 'pois': 0, 'segundos_ocupado': 0.0, 'cola': 0, 'cola_max': 0,
+                 '_muestras': 0, '_suma_cola': 0}
+        for nombre, _, workers in etapas
+    }
+    with _estado_lock:
+        ESTADO_PIPELINE.clear()
+        ESTADO_PIPELINE.update(stats)
+    pendientes = [workers for _, _, workers in etapas]
+    lock = threading.Lock()
+
+    def trabajar(n):
+        nombre, funcion, _ = etapas[n]
+        entrada = colas[n]
+        siguiente = colas[n + 1] if n + 1 < len(etapas) else None
+        st = stats[nombre]
+        while True:
+            item = _tomar(entrada, parar)
+            if item is _FIN:
+                break
+            indice, valor = item
+            with lock:
+                profundidad = entrada.qsize()
+                st['cola'] = profundidad
+                st['cola_max'] = max(st['cola_max'], profundidad)
+                st['_muestras'] += 1
+                st['_suma_cola'] += profundidad
+            t = time.perf_counter()
+            try:
+                valor = funcion(valor)
+            except BaseException as e:
+                fallos.append(e)
+                parar.set()
+                break
+            with lock:
+                st['items'] += 1
+                st['pois'] += tamano(valor)
+                st['segundos_ocupado'] += time.perf_counter() - t
+            if siguiente is None:
+                salidas[indice] = valor
+            elif not _poner(siguiente, (indice, valor), parar):
+                break
+
+        # El último worker de la etapa avisa a todos los de la siguiente
+        with lock:
+            pendientes[n] -= 1
+            ultimo = pendientes[n] == 0
+        if ultimo and siguiente is not None:
+            for _ in range(etapas[n + 1][2]):
+                _poner(siguiente, _FIN, parar)
+
+    hilos = [
+        threading.Thread(target=trabajar, args=(n,), name=f"pipeline-{nombre}-{k}", daemon=True)
+        for n, (nombre, _, workers) in enumerate(etapas)
+        for k in range(workers)
+    ]
+    for hilo in hilos:
+        hilo.start()
+
+    total = 0
+    for indice, item in enumerate(items):
+        if not _poner(colas[0], (indice, item), parar):
+            break
+        total += 1
+    for _ in range(etapas[0][2]):
+        _poner(colas[0], _FIN, parar)
+    for hilo in hilos:
+        hilo.join()
+
+    if fallos:
+        raise fallos[0]
+
+    segundos = time.perf_counter() - inicio
+    resumen = {
+        nombre: _resumir(st['workers'], st['items'], st['pois'], st['segundos_ocupado'], segundos, st['cola_max'],
+                         st['_suma_cola'] / st['_muestras'] if st['_muestras'] else 0.0)
+        for nombre, st in stats.items()
+    }
+    return [salidas[i] for i in range(total)], resumen
+
+def _resumir(workers, items, pois, ocupado, segundos, cola_max, cola_media):
+    return {
+        'workers': workers,
+        'items': items,
+        'pois': pois,
+        'segundos_ocupado': ocupado,
+        'segundos': segundos,
+        # Fracción del tiempo total en que los workers de la etapa estuvieron ocupados (~1 en el cuello de botella)
+        'ocupacion': ocupado / (segundos * workers) if segundos > 0 else 0.0,
+        # Capacidad de la etapa si nunca esperara a las demás
+        'pois_por_segundo': pois * workers / ocupado if ocupado > 0 else 0.0,
+        'cola_max': cola_max,
+        'cola_media': cola_media
+    }
+
+def combinar_estadisticas(acumulado, resumen):
+    """
+    Adds the statistics of one run of ejecutar_pipeline to those of previous runs of the same stages.
+
+    Input: Accumulated statistics (None for the first run), statistics of the run
+
+    Output: Statistics per stage over all the runs, in the format of ejecutar_pipeline
+    """
+    if acumulado is None:
+        return resumen
+    combinado = {}
+    for nombre, st in resumen.items():
+        previo = acumulado[nombre]
+        items = previo['items'] + st['items']
+        combinado[nombre] = _resumir(
+            st['workers'], items, previo['pois'] + st['pois'], previo['segundos_ocupado'] + st['segundos_ocupado'],
+            previo['segundos'] + st['segundos'], max(previo['cola_max'], st['cola_max']),
+            (previo['cola_media'] * previo['items'] + st['cola_media'] * st['items']) / items if items else 0.0
+        )
+    return combinado
+
+def estado_pipeline():
+    """Returns the items processed and the current queue depth of every stage of the running (or last) pipeline."""
+    with _estado_lock:
+        return {
+            nombre: {'workers': st['workers'], 'items': st['items'], 'pois': st['pois'], 'cola': st['cola']}
+            for nombre, st in ESTADO_PIPELINE.items()
+        }
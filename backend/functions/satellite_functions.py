@@ -1,15 +1,39 @@
-import pandas as pd
-import ast
 from PIL import Image
-from torchvision import transforms
 import numpy as np
 import requests
 import math
 import os
 import io
+import torch
+from torchvision.io import decode_image, ImageReadMode
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from functions.cache_functions import TILE_CACHE_DIR, TILE_CACHE_MEMORY_BYTES, TILE_CACHE_DISK_BYTES, TileCache
 
 # Obtener API KEY desde variables de entorno
 API_KEY = os.environ.get('API_KEY', os.environ.get('REACT_APP_HERE_API_KEY'))
+TILE_STYLE = 'satellite.day'
+
+# Configuración de las descargas de tiles
+TILE_FETCH_WORKERS = int(os.environ.get('TILE_FETCH_WORKERS', 16))
+TILE_FETCH_TIMEOUT = float(os.environ.get('TILE_FETCH_TIMEOUT', 10))
+TILE_FETCH_RETRIES = int(os.environ.get('TILE_FETCH_RETRIES', 3))
+TILE_FETCH_BACKOFF = float(os.environ.get('TILE_FETCH_BACKOFF', 0.5))
+STATUS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+# Origen de los tiles: 'here' (API), 'mbtiles' (archivo SQLite) o 'directory' (árbol z/x/y)
+TILE_SOURCE = os.environ.get('TILE_SOURCE', 'here').lower()
+TILE_SOURCE_PATH = os.environ.get('TILE_SOURCE_PATH', '')
+
+# Mosaico de tiles: recortes centrados en cada punto, armados en bloques de TILE_MOSAIC_BLOCK x TILE_MOSAIC_BLOCK tiles
+TILE_MOSAIC = os.environ.get('TILE_MOSAIC', 'False').lower() == 'true'
+TILE_MOSAIC_BLOCK = int(os.environ.get('TILE_MOSAIC_BLOCK', 2))
+
 
 # Función para calcular puntos perpendiculares
 def punto_y_perpendicular(coords, percent, side='R'):
@@ -83,6 +107,98 @@ def punto_y_perpendicular(coords, percent, side='R'):
         'nodo_inicial': nodo_inicial
     }
 
+# Versión por lotes sobre geometrías aplanadas
+def aplanar_geometrias(geometrias):
+    """
+    Converts a list of LineStrings (lists of nodes) into the flat layout used by punto_y_perpendicular_lote.
+
+    Input: List of geometries, each a sequence of (x, y) nodes
+
+    Output: Tuple (coords (m, 2) float64, offsets (n + 1,) int64)
+    """
+    largos = [len(g) for g in geometrias]
+    offsets = np.concatenate([[0], np.cumsum(largos)]).astype(np.int64)
+    coords = np.concatenate([np.asarray(g, dtype=np.float64).reshape(-1, 2) for g in geometrias]) if offsets[-1] else np.empty((0, 2))
+    return coords, offsets
+
+def subconjunto_geometrias(coords, offsets, geom_idx):
+    """
+    Extracts the links referenced by `geom_idx` from a flat geometry buffer, so batch operations only touch the
+    links they need.
+
+    Input: Coordinates (m, 2), offsets (n_links + 1,), link indices (with repetitions)
+
+    Output: Tuple (coords of the distinct links, their offsets, index of each element of `geom_idx` in the subset)
+    """
+    links, geom_sub = np.unique(np.asarray(geom_idx, dtype=np.int64), return_inverse=True)
+    inicio = offsets[links]
+    largos = offsets[links + 1] - inicio
+    offsets_sub = np.concatenate([[0], np.cumsum(largos)]).astype(np.int64)
+    indices = np.repeat(inicio - offsets_sub[:-1], largos) + np.arange(offsets_sub[-1])
+    return coords[indices], offsets_sub, geom_sub.reshape(-1)
+
+def punto_y_perpendicular_lote(coords, offsets, geom_idx, percent, side):
+    """
+    Batch version of punto_y_perpendicular: computes the point and perpendicular normal of every POI at once. The
+    links are given as one flat coordinate buffer plus offsets (as in GeometryStore); the segment of each POI is found
+    with `searchsorted` over the cumulative segment lengths instead of walking the segments in Python.
+
+    Input: Coordinates (m, 2), offsets (n_links + 1,), link index of each POI, percentage of each POI on its link
+           (values above 1 are read as 0-100), side of each POI ('R' or 'L')
+
+    Output: Dictionary of arrays with 'punto' (k, 2), 'perpendicular' (k, 2), 'nodo_inicial' (k, 2) and 'error'
+            (None for valid POIs, otherwise the message punto_y_perpendicular would raise; their rows are NaN)
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    geom_idx = np.asarray(geom_idx, dtype=np.int64)
+    percent = np.asarray(percent, dtype=np.float64)
+    side = np.asarray(side, dtype=object)
+    n = len(geom_idx)
+
+    percent = np.where(percent > 1, percent / 100, percent)
+    inicio = offsets[geom_idx]
+    fin = offsets[geom_idx + 1]
+
+    # Validación de entradas, en el mismo orden que punto_y_perpendicular
+    error = np.full(n, None, dtype=object)
+    lado_r = side == 'R'
+    lado_l = side == 'L'
+    error[~(lado_r | lado_l)] = "El parámetro 'side' debe ser 'R' o 'L'."
+    error[~((percent >= 0) & (percent <= 1))] = "El porcentaje debe estar entre 0 y 1."
+    error[fin - inicio < 2] = "Se necesitan al menos dos coordenadas para definir una ruta."
+    valido = np.array([e is None for e in error], dtype=bool)
+
+    # Longitud acumulada de cada nodo; los segmentos entre links distintos tienen longitud 0
+    segmentos = np.diff(coords, axis=0)
+    largos = np.sqrt(segmentos[:, 0] ** 2 + segmentos[:, 1] ** 2)
+    largos[offsets[1:-1][(offsets[1:-1] > 0) & (offsets[1:-1] < len(coords))] - 1] = 0.0
+    acumulado = np.concatenate([[0.0], np.cumsum(largos)])
+
+    punto = np.full((n, 2), np.nan)
+    perpendicular = np.full((n, 2), np.nan)
+    nodo_inicial = np.full((n, 2), np.nan)
+    v_idx = np.flatnonzero(valido)
+    if len(v_idx):
+        ini, fn, pct = inicio[v_idx], fin[v_idx], percent[v_idx]
+        base = acumulado[ini]
+        d_objetivo = pct * (acumulado[fn - 1] - base)
+
+        # Primer nodo cuya distancia acumulada alcanza el objetivo (segmento j - 1 -> j)
+        j = np.clip(np.searchsorted(acumulado, base + d_objetivo, side='left'), ini + 1, fn - 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.clip((d_objetivo - (acumulado[j - 1] - base)) / largos[j - 1], 0.0, 1.0)
+            v = coords[j] - coords[j - 1]
+            v_unit = v / largos[j - 1][:, None]
+        punto[v_idx] = coords[j - 1] + t[:, None] * v
+
+        # Vector perpendicular hacia el lado especificado
+        signo = np.where(lado_r[v_idx], 1.0, -1.0)
+        perpendicular[v_idx] = np.stack([signo * v_unit[:, 1], -signo * v_unit[:, 0]], axis=1)
+        nodo_inicial[v_idx] = coords[ini]
+
+    return {'punto': punto, 'perpendicular': perpendicular, 'nodo_inicial': nodo_inicial, 'error': error}
+
 # Funciones para manejo de tiles y coordenadas
 def lat_lon_to_tile(lat, lon, zoom):
     """
@@ -166,42 +282,435 @@ def create_wkt_polygon(bounds):
     wkt = f"POLYGON(({lon1} {lat1}, {lon2} {lat2}, {lon3} {lat3}, {lon4} {lat4}, {lon1} {lat1}))"
     return wkt
 
-def get_satellite_tile(lat, lon, zoom, tile_format, tile_size, api_key, output_path=None):
-"""
-Obtains a satellite image tile for the given coordinates.
+# Versiones vectorizadas sobre arreglos de NumPy
+def lat_lon_to_tile_array(lat, lon, zoom):
+    """
+    Array version of lat_lon_to_tile: converts many latitudes and longitudes to tile indices in one call, with the
+    same results as the scalar function (NumPy's log/tan may differ from `math` in the last bit, so the few points
+    that lie on a tile edge are recomputed with lat_lon_to_tile).
+
+    Parameters:
+        lat (array-like): Latitudes in decimal degrees.
+        lon (array-like): Longitudes in decimal degrees.
+        zoom (int): Zoom level of the tile grid.
+
+    Returns:
+        tuple: (x, y) int64 arrays of tile indices.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    lat_rad = np.radians(lat)
+    lon_rad = np.radians(lon)
+    n = 2.0 ** zoom
+    fx = (lon_rad - (-math.pi)) / (2 * math.pi) * n
+    fy = (1 - np.log(np.tan(lat_rad) + 1 / np.cos(lat_rad)) / math.pi) / 2 * n
+    x = np.trunc(fx).astype(np.int64)
+    y = np.trunc(fy).astype(np.int64)
+
+    # Puntos sobre el borde de un tile: usar la función escalar para obtener exactamente el mismo índice
+    with np.errstate(invalid='ignore'):
+        borde = (np.abs(fx - np.round(fx)) < 1e-6) | (np.abs(fy - np.round(fy)) < 1e-6)
+    for i in np.flatnonzero(borde):
+        x.flat[i], y.flat[i] = lat_lon_to_tile(float(lat.flat[i]), float(lon.flat[i]), zoom)
+    return x, y
+
+def tile_coords_to_lat_lon_array(x, y, zoom):
+    """
+    Array version of tile_coords_to_lat_lon: returns the top-left corner of many tiles in one call.
+
+    Parameters:
+        x (array-like): X indices of the tiles.
+        y (array-like): Y indices of the tiles.
+        zoom (int): Zoom level of the tile grid.
+
+    Returns:
+        tuple: (latitude, longitude) float64 arrays of the tile corners.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = 2.0 ** zoom
+    lon_deg = x / n * 360.0 - 180.0
+    lat_rad = np.arctan(np.sinh(math.pi * (1 - 2 * y / n)))
+    lat_deg = np.degrees(lat_rad)
+    return lat_deg, lon_deg
 
-Args:
-    lat (float): Latitude of the point
-    lon (float): Longitude of the point
-    zoom (int): Zoom level
-    tile_format (str): Tile format (png, jpg)
-    tile_size (int): Tile size in pixels
-    api_key (str): API Key for HERE Maps
-    output_path (str, optional): If provided, saves the image to this path
+def lat_lon_to_pixel_array(lat, lon, zoom, tile_size):
+    """
+    Converts latitudes and longitudes to global pixel coordinates at a given zoom level, i.e. tile index plus the
+    position inside the tile (pixel (px, py) lies in tile (px // tile_size, py // tile_size)).
+
+    Parameters:
+        lat (array-like): Latitudes in decimal degrees.
+        lon (array-like): Longitudes in decimal degrees.
+        zoom (int): Zoom level of the tile grid.
+        tile_size (int): Tile size in pixels.
+
+    Returns:
+        tuple: (px, py) float64 arrays of pixel coordinates.
+    """
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(lon, dtype=np.float64))
+    n = 2.0 ** zoom * tile_size
+    px = (lon_rad - (-math.pi)) / (2 * math.pi) * n
+    py = (1 - np.log(np.tan(lat_rad) + 1 / np.cos(lat_rad)) / math.pi) / 2 * n
+    return px, py
+
+def get_tile_bounds_array(x, y, zoom):
+    """
+    Array version of get_tile_bounds.
 
-Returns:
-    PIL.Image if output_path is None, or True/False if output_path is provided
-"""
+    Parameters:
+        x (array-like): X indices of the tiles.
+        y (array-like): Y indices of the tiles.
+        zoom (int): Zoom level.
 
+    Returns:
+        numpy.ndarray: Array of shape (n, 4, 2) with the (lat, lon) corners of each tile, in the order
+                       top-left, top-right, bottom-right, bottom-left.
+    """
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    esquinas = [(x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1)]
+    return np.stack([np.stack(tile_coords_to_lat_lon_array(ex, ey, zoom), axis=-1) for ex, ey in esquinas], axis=-2)
+
+def create_wkt_polygons(bounds):
+    """
+    Batch version of create_wkt_polygon.
+
+    Parameters:
+        bounds (numpy.ndarray): Array of shape (n, 4, 2) with (lat, lon) corners, as returned by get_tile_bounds_array.
+
+    Returns:
+        list: WKT polygon strings, one per tile.
+    """
+    return [create_wkt_polygon(esquinas) for esquinas in np.asarray(bounds, dtype=np.float64).tolist()]
+
+# Descarga de tiles
+_sesion = None
+_sesion_lock = threading.Lock()
+
+def obtener_sesion():
+    """Returns the HTTP session shared by every tile request, with a keep-alive pool sized for TILE_FETCH_WORKERS."""
+    global _sesion
+    with _sesion_lock:
+        if _sesion is None:
+            _sesion = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(TILE_FETCH_WORKERS, 1))
+            _sesion.mount('https://', adapter)
+            _sesion.mount('http://', adapter)
+        return _sesion
+
+def descargar_tile(url):
+    """
+    Requests a tile through the shared session with a timeout, retrying connection errors, 429 and 5xx responses up to
+    TILE_FETCH_RETRIES times with exponential backoff and jitter (honouring Retry-After when the server sends it).
+
+    Input: Tile URL
+
+    Output: Last response, or None if every attempt failed with a connection error
+    """
+    response = None
+    for intento in range(TILE_FETCH_RETRIES + 1):
+        espera = TILE_FETCH_BACKOFF * 2 ** intento
+        minimo = 0.0
+        try:
+            response = obtener_sesion().get(url, timeout=TILE_FETCH_TIMEOUT)
+            if response.status_code not in STATUS_REINTENTABLES:
+                return response
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                minimo = float(retry_after)
+        except requests.RequestException as e:
+            print(f"Error de conexión al obtener tile (intento {intento + 1}): {e}")
+        if intento < TILE_FETCH_RETRIES:
+            # El jitter nunca acorta la espera pedida por el servidor
+            time.sleep(max(minimo, random.uniform(0, espera)))
+    return response
+
+# Orígenes de tiles
+class FuenteHERE:
+    """Tiles requested to the HERE Map Tile API (see descargar_tile), or to a server with the same URL layout."""
+    local = False
+    estilo = TILE_STYLE
+
+    def __init__(self, url_base='https://maps.hereapi.com/v3/base/mc'):
+        self.url_base = url_base.rstrip('/')
+
+    def leer(self, zoom, x, y, tile_format, tile_size, api_key):
+        """Returns the encoded tile, or None if it could not be obtained."""
+        url = f'{self.url_base}/{zoom}/{x}/{y}/{tile_format}?style={self.estilo}&size={tile_size}&apiKey={api_key}'
+        response = descargar_tile(url)
+        if response is not None and response.status_code == 200:
+            return response.content
+        print(f"Error al obtener tile: {response.status_code if response is not None else 'sin respuesta'}, URL: {url}")
+        return None
+
+class FuenteMBTiles:
+    """
+    Tiles read from a local MBTiles file (SQLite, `tiles` table with TMS rows, so y is flipped). The file is opened
+    read-only, with one connection per thread.
+    """
+    local = True
+
+    def __init__(self, path):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No se encontró el archivo MBTiles: {path}")
+        self.path = os.path.abspath(path)
+        self.estilo = f"mbtiles:{self.path}"
+        self._local = threading.local()
+
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conexion = conexion
+        return conexion
+
+    def leer(self, zoom, x, y, tile_format, tile_size, api_key):
+        """Returns the encoded tile, or None if the file does not contain it."""
+        fila = self._conexion().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (zoom, x, (2 ** zoom - 1) - y)
+        ).fetchone()
+        if fila is None:
+            print(f"Tile no encontrado en {self.path}: {zoom}/{x}/{y}")
+            return None
+        return bytes(fila[0])
+
+class FuenteDirectorio:
+    """Tiles read from a local `{zoom}/{x}/{y}.{format}` directory tree."""
+    local = True
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"No se encontró el directorio de tiles: {path}")
+        self.path = os.path.abspath(path)
+        self.estilo = f"directory:{self.path}"
+
+    def leer(self, zoom, x, y, tile_format, tile_size, api_key):
+        """Returns the encoded tile, or None if the file does not exist."""
+        tile_path = os.path.join(self.path, str(zoom), str(x), f"{y}.{tile_format}")
+        try:
+            with open(tile_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            print(f"Tile no encontrado: {tile_path}")
+            return None
+
+def crear_fuente_tiles(tipo, path=''):
+    """
+    Creates the tile source selected by TILE_SOURCE.
+
+    Input: Source type ('here', 'mbtiles' or 'directory'), path of the MBTiles file or tile directory
+
+    Output: Tile source object
+    """
+    if tipo == 'here':
+        return FuenteHERE()
+    if tipo == 'mbtiles':
+        return FuenteMBTiles(path)
+    if tipo == 'directory':
+        return FuenteDirectorio(path)
+    raise ValueError(f"TILE_SOURCE debe ser 'here', 'mbtiles' o 'directory', no '{tipo}'")
+
+# Origen y caché de tiles compartidos por todo el proceso
+FUENTE_TILES = crear_fuente_tiles(TILE_SOURCE, TILE_SOURCE_PATH)
+TILE_CACHE = TileCache(TILE_CACHE_DIR, TILE_CACHE_MEMORY_BYTES, TILE_CACHE_DISK_BYTES)
+
+def decodificar_tile(contenido):
+    """
+    Decodes the bytes of a tile straight into an RGB uint8 array (height, width, 3) with torchvision.io, without going
+    through PIL (used only as a fallback for formats torchvision cannot decode).
+    """
+    try:
+        return decode_image(torch.frombuffer(bytearray(contenido), dtype=torch.uint8), mode=ImageReadMode.RGB).permute(1, 2, 0).numpy()
+    except RuntimeError:
+        return np.asarray(Image.open(io.BytesIO(contenido)).convert("RGB"))
+
+def get_satellite_tile(lat, lon, zoom, tile_format, tile_size, api_key, output_path=None, fuente=None):
+    """
+    Obtains a satellite image tile for the given coordinates from `fuente` (FUENTE_TILES by default). Tiles are served
+    from TILE_CACHE when possible and only read from the source on a miss; failed reads are not cached, and tiles of
+    local sources are only kept in memory.
+
+    Args:
+        lat (float): Latitude of the point
+        lon (float): Longitude of the point
+        zoom (int): Zoom level
+        tile_format (str): Tile format (png, jpg)
+        tile_size (int): Tile size in pixels
+        api_key (str): API Key for HERE Maps
+        output_path (str, optional): If provided, saves the image to this path
+        fuente (optional): Tile source (see crear_fuente_tiles)
+
+    Returns:
+        RGB uint8 array (height, width, 3) if output_path is None, or True/False if output_path is provided
+    """
+    fuente = fuente or FUENTE_TILES
     x, y = lat_lon_to_tile(lat, lon, zoom)
-    
-    # Construir la URL para la API de tiles de mapas
-    url = f'https://maps.hereapi.com/v3/base/mc/{zoom}/{x}/{y}/{tile_format}?style=satellite.day&size={tile_size}&apiKey={api_key}'
-    
-    # Hacer la petición
-    response = requests.get(url)
-    
-    # Verificar si la petición fue exitosa
-    if response.status_code == 200:
-        if output_path:
-            # Guardar el tile en un archivo
+    clave = (zoom, x, y, tile_format, tile_size, fuente.estilo)
+    disco = not fuente.local
+
+    # Buscar primero en la caché
+    if output_path:
+        contenido = TILE_CACHE.obtener_bytes(clave) if disco else None
+        if contenido is not None:
             with open(output_path, 'wb') as file:
-                file.write(response.content)
+                file.write(contenido)
             return True
-        else:
-            # Devolver la imagen como objeto PIL.Image
-            image = Image.open(io.BytesIO(response.content)).convert("RGB")
-            return image
     else:
-        print(f"Error al obtener tile: {response.status_code}, URL: {url}")
+        image = TILE_CACHE.obtener_imagen(clave, decodificar_tile, disco=disco)
+        if image is not None:
+            return image
+    
+    # Leer el tile del origen
+    contenido = fuente.leer(zoom, x, y, tile_format, tile_size, api_key)
+    if contenido is None:
         return False
+    
+    if output_path:
+        # Guardar el tile en un archivo
+        TILE_CACHE.guardar(clave, contenido, disco=disco)
+        with open(output_path, 'wb') as file:
+            file.write(contenido)
+        return True
+    else:
+        # Devolver la imagen decodificada como arreglo
+        image = decodificar_tile(contenido)
+        TILE_CACHE.guardar(clave, contenido, image, disco=disco)
+        return image
+
+def planificar_tiles(puntos, zoom):
+    """
+    Maps every point to its tile and deduplicates the result, so points that share a tile share one request.
+
+    Input: List of (lat, lon) points, zoom
+
+    Output: Tuple (tile (x, y) of each point in the order of `puntos`; dictionary {tile: first point in that tile})
+    """
+    if not puntos:
+        return [], {}
+    lat, lon = np.asarray(puntos, dtype=np.float64).T
+    tiles = list(zip(*(indices.tolist() for indices in lat_lon_to_tile_array(lat, lon, zoom))))
+    unicos = {}
+    for tile, punto in zip(tiles, puntos):
+        unicos.setdefault(tile, punto)
+    return tiles, unicos
+
+def obtener_tiles(puntos, zoom, tile_format, tile_size, api_key, workers=None, reporte=None, fuente=None):
+    """
+    Obtains the satellite tiles of many points concurrently, keeping up to `workers` (TILE_FETCH_WORKERS by default)
+    requests in flight. Points that fall on the same tile are requested only once (see planificar_tiles).
+
+    Input: List of (lat, lon) points, zoom, tile format, tile size, API key, number of concurrent requests, optional
+           dictionary where the number of tile references and unique tiles are accumulated (and the tiles themselves,
+           if it has a 'tiles_vistos' set, to count unique tiles over several calls), tile source
+
+    Output: List with the decoded tile of each point (see decodificar_tile; False if its tile could not be obtained), in
+            the order of `puntos`. Tiles are fetched and decoded in the worker threads.
+    """
+    workers = workers or TILE_FETCH_WORKERS
+    tiles, unicos = planificar_tiles(puntos, zoom)
+    if reporte is not None:
+        reporte['tiles_referencias'] = reporte.get('tiles_referencias', 0) + len(tiles)
+        reporte['tiles_unicos'] = reporte.get('tiles_unicos', 0) + len(unicos)
+        if 'tiles_vistos' in reporte:
+            reporte['tiles_vistos'].update(unicos)
+
+    def obtener(punto):
+        try:
+            return get_satellite_tile(punto[0], punto[1], zoom, tile_format, tile_size, api_key, fuente=fuente)
+        except Exception as e:
+            print(f"Error al obtener tile: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        imagenes = dict(zip(unicos, executor.map(obtener, unicos.values())))
+    return [imagenes[tile] for tile in tiles]
+
+def recortes_centrados(puntos, zoom, tile_format, tile_size, api_key, bloque=None, reporte=None, fuente=None):
+    """
+    Obtains a `tile_size` x `tile_size` image centred on each point. The tiles the crops need are fetched once
+    (see obtener_tiles), and each one is decoded and copied once into a shared mosaic per block of
+    `bloque` x `bloque` tiles (TILE_MOSAIC_BLOCK by default). Each block keeps one extra row and column of tiles,
+    so every crop in the block fits. Only the tiles the crops use are filled.
+    The crops are array views of the mosaics, so memory depends on the area covered and not on the number of points.
+
+    Input: List of (lat, lon) points, zoom, tile format, tile size, API key, block size in tiles, optional dictionary
+           where tile references, unique tiles and mosaic blocks are accumulated (as in obtener_tiles), tile source
+
+    Output: List with a (tile_size, tile_size, 3) uint8 array view per point, in the order of `puntos`. If a
+            neighbouring tile is missing, the point's own tile is used as is. False if the point's own tile could
+            not be obtained.
+    """
+    bloque = bloque or TILE_MOSAIC_BLOCK
+    if not puntos:
+        return []
+    lat, lon = np.asarray(puntos, dtype=np.float64).T
+    px, py = lat_lon_to_pixel_array(lat, lon, zoom, tile_size)
+
+    # Esquina superior izquierda de cada recorte, tile que la contiene y bloque del mosaico
+    ox = np.floor(px).astype(np.int64) - tile_size // 2
+    oy = np.floor(py).astype(np.int64) - tile_size // 2
+    tx, ty = ox // tile_size, oy // tile_size
+    bx, by = tx // bloque, ty // bloque
+    propio_x = np.floor(px / tile_size).astype(np.int64)
+    propio_y = np.floor(py / tile_size).astype(np.int64)
+
+    # Tiles que necesita cada recorte (1, 2 o 4 según su alineación con la rejilla; ninguno si el punto no es válido)
+    finitos = np.isfinite(px) & np.isfinite(py)
+    necesarios = []
+    for i in range(len(puntos)):
+        if not finitos[i]:
+            necesarios.append([])
+            continue
+        cols = [tx[i]] if ox[i] % tile_size == 0 else [tx[i], tx[i] + 1]
+        filas = [ty[i]] if oy[i] % tile_size == 0 else [ty[i], ty[i] + 1]
+        necesarios.append([(int(x), int(y)) for y in filas for x in cols])
+    unicos = list(dict.fromkeys(t for tiles in necesarios for t in tiles))
+
+    # Descargar y decodificar cada tile una sola vez (por su centro, para evitar bordes)
+    centros = [tile_coords_to_lat_lon(x + 0.5, y + 0.5, zoom) for x, y in unicos]
+    imagenes = {}
+    for tile, imagen in zip(unicos, obtener_tiles(centros, zoom, tile_format, tile_size, api_key, fuente=fuente)):
+        if imagen is not False:
+            imagenes[tile] = imagen if imagen.shape == (tile_size, tile_size, 3) else False
+        else:
+            imagenes[tile] = False
+
+    # Armar los mosaicos de los bloques con los tiles disponibles
+    lado = (bloque + 1) * tile_size
+    mosaicos = {}
+    for i, tiles in enumerate(necesarios):
+        if not tiles:
+            continue
+        clave = (int(bx[i]), int(by[i]))
+        if clave not in mosaicos:
+            mosaicos[clave] = (np.zeros((lado, lado, 3), dtype=np.uint8), set())
+        mosaico, llenos = mosaicos[clave]
+        for tile in tiles:
+            if tile not in llenos and imagenes[tile] is not False:
+                x0 = (tile[0] - clave[0] * bloque) * tile_size
+                y0 = (tile[1] - clave[1] * bloque) * tile_size
+                mosaico[y0:y0 + tile_size, x0:x0 + tile_size] = imagenes[tile]
+                llenos.add(tile)
+    if reporte is not None:
+        reporte['tiles_referencias'] = reporte.get('tiles_referencias', 0) + sum(len(tiles) for tiles in necesarios)
+        reporte['tiles_unicos'] = reporte.get('tiles_unicos', 0) + len(unicos)
+        if 'tiles_vistos' in reporte:
+            reporte['tiles_vistos'].update(unicos)
+        reporte['bloques_mosaico'] = reporte.get('bloques_mosaico', 0) + len(mosaicos)
+
+    recortes = []
+    for i, tiles in enumerate(necesarios):
+        propio = imagenes.get((int(propio_x[i]), int(propio_y[i])), False) if tiles else False
+        if propio is False:
+            recortes.append(False)
+        elif any(imagenes[t] is False for t in tiles):
+            recortes.append(propio)
+        else:
+            mosaico, _ = mosaicos[(int(bx[i]), int(by[i]))]
+            x0 = ox[i] - bx[i] * bloque * tile_size
+            y0 = oy[i] - by[i] * bloque * tile_size
+            recortes.append(mosaico[y0:y0 + tile_size, x0:x0 + tile_size])
+    return recortes
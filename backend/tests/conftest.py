@@ -0,0 +1,93 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# Los módulos de functions/ se importan como en app.py (desde backend/), con cachés en un directorio temporal
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='cache_tests_'))
+
+def tile_png(size=8, color=(40, 120, 60)):
+    """Encoded PNG tile of one colour."""
+    contenido = io.BytesIO()
+    Image.fromarray(np.full((size, size, 3), color, dtype=np.uint8)).save(contenido, 'PNG')
+    return contenido.getvalue()
+
+class ServidorTiles:
+    """
+    Local stand-in of the tile API. Every path answers 200 with a PNG tile unless `respuestas[path]` has scripted
+    (status, headers) responses left, which are consumed in order. It records the requests of each path and the
+    maximum number of requests in flight at the same time.
+    """
+
+    def __init__(self, demora=0.0):
+        self.demora = demora
+        self.respuestas = defaultdict(list)
+        self.peticiones = defaultdict(list)
+        self.en_curso = 0
+        self.max_en_curso = 0
+        self._lock = threading.Lock()
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                with servidor._lock:
+                    servidor.peticiones[path].append(time.monotonic())
+                    servidor.en_curso += 1
+                    servidor.max_en_curso = max(servidor.max_en_curso, servidor.en_curso)
+                    status, headers = servidor.respuestas[path].pop(0) if servidor.respuestas[path] else (200, {})
+                try:
+                    time.sleep(servidor.demora)
+                    cuerpo = tile_png() if status == 200 else b'error'
+                    self.send_response(status)
+                    for nombre, valor in headers.items():
+                        self.send_header(nombre, valor)
+                    self.send_header('Content-Length', str(len(cuerpo)))
+                    self.end_headers()
+                    self.wfile.write(cuerpo)
+                finally:
+                    with servidor._lock:
+                        servidor.en_curso -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._servidor.daemon_threads = True
+        self.host = f"http://127.0.0.1:{self._servidor.server_address[1]}"
+        self.url = f"{self.host}/v3/base/mc"
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+
+    def path(self, zoom, x, y, tile_format='png'):
+        return f"/v3/base/mc/{zoom}/{x}/{y}/{tile_format}"
+
+    def cerrar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+@pytest.fixture
+def servidor_tiles():
+    servidor = ServidorTiles()
+    yield servidor
+    servidor.cerrar()
+
+@pytest.fixture
+def satelite(monkeypatch, tmp_path):
+    """satellite_functions with a fresh memory-only tile cache and short backoffs."""
+    from functions import satellite_functions
+    from functions.cache_functions import TileCache
+
+    monkeypatch.setattr(satellite_functions, 'TILE_CACHE', TileCache(str(tmp_path), 64 * 1024 ** 2, 0))
+    monkeypatch.setattr(satellite_functions, 'TILE_FETCH_BACKOFF', 0.01)
+    monkeypatch.setattr(satellite_functions, 'TILE_FETCH_TIMEOUT', 5)
+    return satellite_functions
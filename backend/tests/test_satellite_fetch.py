@@ -0,0 +1,87 @@
+import socket
+import time
+
+ZOOM = 18
+
+def centro_tile(satelite, x, y):
+    """(lat, lon) of the centre of tile (x, y)."""
+    return satelite.tile_coords_to_lat_lon(x + 0.5, y + 0.5, ZOOM)
+
+def test_reintenta_429_y_5xx(satelite, servidor_tiles):
+    path = servidor_tiles.path(ZOOM, 10, 20)
+    servidor_tiles.respuestas[path] = [(503, {}), (429, {}), (500, {})]
+
+    response = satelite.descargar_tile(servidor_tiles.host + path)
+
+    assert response.status_code == 200
+    assert len(servidor_tiles.peticiones[path]) == 4
+
+def test_agota_los_reintentos(satelite, servidor_tiles, monkeypatch):
+    monkeypatch.setattr(satelite, 'TILE_FETCH_RETRIES', 2)
+    path = servidor_tiles.path(ZOOM, 10, 21)
+    servidor_tiles.respuestas[path] = [(502, {})] * 5
+
+    contenido = satelite.FuenteHERE(servidor_tiles.url).leer(ZOOM, 10, 21, 'png', 8, 'k')
+
+    assert contenido is None
+    assert len(servidor_tiles.peticiones[path]) == 3
+
+def test_respeta_retry_after(satelite, servidor_tiles):
+    path = servidor_tiles.path(ZOOM, 10, 22)
+    servidor_tiles.respuestas[path] = [(429, {'Retry-After': '1'})]
+
+    contenido = satelite.FuenteHERE(servidor_tiles.url).leer(ZOOM, 10, 22, 'png', 8, 'k')
+
+    assert contenido is not None
+    primera, segunda = servidor_tiles.peticiones[path]
+    assert segunda - primera >= 1.0
+
+def test_404_no_se_reintenta_ni_se_guarda(satelite, servidor_tiles):
+    fuente = satelite.FuenteHERE(servidor_tiles.url)
+    path = servidor_tiles.path(ZOOM, 11, 30)
+    servidor_tiles.respuestas[path] = [(404, {}), (404, {})]
+    punto = centro_tile(satelite, 11, 30)
+
+    # Un tile inexistente se reporta como no disponible (POI "3. Invalid location")
+    assert satelite.obtener_tiles([punto], ZOOM, 'png', 8, 'k', fuente=fuente) == [False]
+    assert len(servidor_tiles.peticiones[path]) == 1
+
+    # El fallo no queda en caché: la siguiente petición vuelve al servidor
+    assert satelite.get_satellite_tile(*punto, ZOOM, 'png', 8, 'k', fuente=fuente) is False
+    assert len(servidor_tiles.peticiones[path]) == 2
+    assert satelite.get_satellite_tile(*punto, ZOOM, 'png', 8, 'k', fuente=fuente).shape == (8, 8, 3)
+
+def test_sin_conexion_devuelve_none(satelite, monkeypatch):
+    monkeypatch.setattr(satelite, 'TILE_FETCH_RETRIES', 1)
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        puerto = s.getsockname()[1]
+
+    assert satelite.descargar_tile(f"http://127.0.0.1:{puerto}/v3/base/mc/{ZOOM}/0/0/png") is None
+    assert satelite.FuenteHERE(f"http://127.0.0.1:{puerto}/v3/base/mc").leer(ZOOM, 0, 0, 'png', 8, 'k') is None
+
+def test_limite_de_concurrencia(satelite, servidor_tiles):
+    servidor_tiles.demora = 0.1
+    fuente = satelite.FuenteHERE(servidor_tiles.url)
+    puntos = [centro_tile(satelite, 100 + k, 200) for k in range(12)]
+
+    inicio = time.monotonic()
+    imagenes = satelite.obtener_tiles(puntos, ZOOM, 'png', 8, 'k', workers=3, fuente=fuente)
+
+    assert all(imagen.shape == (8, 8, 3) for imagen in imagenes)
+    assert servidor_tiles.max_en_curso == 3
+    assert time.monotonic() - inicio >= 4 * servidor_tiles.demora
+
+def test_puntos_en_el_mismo_tile_se_piden_una_vez(satelite, servidor_tiles):
+    fuente = satelite.FuenteHERE(servidor_tiles.url)
+    lat, lon = satelite.tile_coords_to_lat_lon(300, 400, ZOOM)
+    paso = 1e-6
+    puntos = [(lat - paso * k, lon + paso * k) for k in range(1, 6)] + [centro_tile(satelite, 301, 400)]
+    reporte = {}
+
+    imagenes = satelite.obtener_tiles(puntos, ZOOM, 'png', 8, 'k', reporte=reporte, fuente=fuente)
+
+    assert len(imagenes) == 6 and imagenes[0] is imagenes[4]
+    assert reporte == {'tiles_referencias': 6, 'tiles_unicos': 2}
+    assert len(servidor_tiles.peticiones[servidor_tiles.path(ZOOM, 300, 400)]) == 1
+    assert len(servidor_tiles.peticiones[servidor_tiles.path(ZOOM, 301, 400)]) == 1
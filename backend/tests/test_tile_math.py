@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from functions.satellite_functions import (
+    lat_lon_to_tile, lat_lon_to_tile_array, tile_coords_to_lat_lon, tile_coords_to_lat_lon_array, get_tile_bounds,
+    get_tile_bounds_array, create_wkt_polygon, create_wkt_polygons, lat_lon_to_pixel_array, punto_y_perpendicular,
+    punto_y_perpendicular_lote, aplanar_geometrias, subconjunto_geometrias
+)
+
+# Latitud máxima de la proyección Web Mercator
+LAT_MAX = 85.0511287798066
+
+def puntos_de_prueba(zoom, n=500, seed=0):
+    """Random points plus tile corners (and points 1e-12° around them), the antimeridian and near-pole latitudes."""
+    rng = np.random.default_rng(seed)
+    lat = list(rng.uniform(-LAT_MAX, LAT_MAX, n))
+    lon = list(rng.uniform(-180, 180, n))
+
+    # Esquinas de tiles y puntos justo a cada lado de sus bordes
+    tiles = 2 ** zoom
+    for x, y in zip(rng.integers(0, tiles + 1, 50), rng.integers(0, tiles + 1, 50)):
+        esquina_lat, esquina_lon = tile_coords_to_lat_lon(int(x), int(y), zoom)
+        for d in (-1e-12, 0.0, 1e-12):
+            lat.append(esquina_lat + d)
+            lon.append(esquina_lon + d)
+
+    # Antimeridiano y latitudes cercanas a los polos
+    for la in (-LAT_MAX, -85.0, -60.0, 0.0, 60.0, 85.0, LAT_MAX):
+        for lo in (-180.0, -179.9999999, 179.9999999):
+            lat.append(la)
+            lon.append(lo)
+    return np.array(lat), np.array(lon)
+
+@pytest.mark.parametrize('zoom', [0, 1, 10, 18, 22])
+def test_lat_lon_to_tile_array(zoom):
+    lat, lon = puntos_de_prueba(zoom, seed=zoom)
+    x, y = lat_lon_to_tile_array(lat, lon, zoom)
+    esperado = [lat_lon_to_tile(la, lo, zoom) for la, lo in zip(lat.tolist(), lon.tolist())]
+    assert list(zip(x.tolist(), y.tolist())) == esperado
+
+def test_lat_lon_to_tile_array_conserva_la_forma():
+    lat, lon = puntos_de_prueba(12)
+    x, y = lat_lon_to_tile_array(lat[:600].reshape(20, 30), lon[:600].reshape(20, 30), 12)
+    plano_x, plano_y = lat_lon_to_tile_array(lat[:600], lon[:600], 12)
+    assert x.shape == y.shape == (20, 30)
+    assert (x.ravel() == plano_x).all() and (y.ravel() == plano_y).all()
+
+@pytest.mark.parametrize('zoom', [0, 10, 18])
+def test_tile_coords_y_bordes(zoom):
+    rng = np.random.default_rng(zoom)
+    tiles = 2 ** zoom
+    # Incluye las filas y columnas extremas (polos y antimeridiano)
+    x = np.concatenate([rng.integers(0, tiles, 200), [0, tiles - 1, 0, tiles - 1]])
+    y = np.concatenate([rng.integers(0, tiles, 200), [0, 0, tiles - 1, tiles - 1]])
+
+    lat, lon = tile_coords_to_lat_lon_array(x, y, zoom)
+    esperado = np.array([tile_coords_to_lat_lon(a, b, zoom) for a, b in zip(x.tolist(), y.tolist())])
+    np.testing.assert_allclose(lat, esperado[:, 0], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(lon, esperado[:, 1], rtol=0, atol=1e-9)
+
+    bounds = get_tile_bounds_array(x, y, zoom)
+    esperado = np.array([get_tile_bounds(a, b, zoom) for a, b in zip(x.tolist(), y.tolist())])
+    np.testing.assert_allclose(bounds, esperado, rtol=0, atol=1e-9)
+
+    # Mismos vértices que el WKT de la función escalar
+    for wkt, (a, b) in zip(create_wkt_polygons(bounds), zip(x.tolist(), y.tolist())):
+        vertices = lambda texto: [float(v) for v in texto[len('POLYGON(('):-2].replace(',', ' ').split()]
+        np.testing.assert_allclose(vertices(wkt), vertices(create_wkt_polygon(get_tile_bounds(a, b, zoom))), rtol=0, atol=1e-9)
+
+@pytest.mark.parametrize('zoom', [0, 10, 18])
+def test_pixel_array_en_el_tile_de_la_funcion_escalar(zoom):
+    tile_size = 256
+    lat, lon = puntos_de_prueba(zoom, seed=zoom + 1)
+    px, py = lat_lon_to_pixel_array(lat, lon, zoom, tile_size)
+    x, y = lat_lon_to_tile_array(lat, lon, zoom)
+    # Lejos de los bordes el píxel cae en el mismo tile; en un borde puede caer en el vecino
+    np.testing.assert_array_less(np.abs(px / tile_size - x - 0.5), 0.5 + 1e-6)
+    np.testing.assert_array_less(np.abs(py / tile_size - y - 0.5), 0.5 + 1e-6)
+
+def geometrias_aleatorias(n, seed=0):
+    """Random LineStrings of 1 to 6 nodes around Guadalajara, some with repeated nodes (zero-length segments)."""
+    rng = np.random.default_rng(seed)
+    geometrias = []
+    for k in range(n):
+        nodos = rng.integers(1, 7)
+        inicio = np.array([-103.35, 20.67]) + rng.normal(0, 0.01, 2)
+        geometria = inicio + np.cumsum(rng.normal(0, 1e-4, (nodos, 2)), axis=0)
+        if k % 7 == 0 and nodos > 2:
+            geometria[1] = geometria[0]
+        geometrias.append(geometria.tolist())
+    return geometrias
+
+def resultado_escalar(geometria, percent, side):
+    try:
+        r = punto_y_perpendicular(geometria, percent, side)
+    except ValueError as e:
+        return None, str(e)
+    return (r['punto'], r['perpendicular'], tuple(r['nodo_inicial'])), None
+
+# Los segmentos de longitud 0 dan NaN (con RuntimeWarning) en ambas versiones
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_punto_y_perpendicular_lote():
+    rng = np.random.default_rng(1)
+    geometrias = geometrias_aleatorias(60)
+    n = 1500
+    geom_idx = rng.integers(0, len(geometrias), n)
+    # Porcentajes en [0, 1] y en [0, 100], extremos exactos y algunos fuera de rango
+    percent = np.concatenate([rng.uniform(0, 1, n // 3), rng.uniform(0, 100, n // 3), rng.choice([0.0, 1.0, 50.0, 100.0, -5.0, 150.0], n - 2 * (n // 3))])
+    side = rng.choice(np.array(['R', 'L', 'X'], dtype=object), n, p=[0.45, 0.45, 0.1])
+
+    coords, offsets = aplanar_geometrias(geometrias)
+    lote = punto_y_perpendicular_lote(coords, offsets, geom_idx, percent, side)
+
+    for i in range(n):
+        esperado, error = resultado_escalar(geometrias[geom_idx[i]], float(percent[i]), side[i])
+        assert lote['error'][i] == error, i
+        if error is not None:
+            assert np.isnan(lote['punto'][i]).all()
+            continue
+        punto, perpendicular, nodo_inicial = esperado
+        np.testing.assert_allclose(lote['punto'][i], punto, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(lote['perpendicular'][i], perpendicular, rtol=0, atol=1e-9)
+        np.testing.assert_array_equal(lote['nodo_inicial'][i], nodo_inicial)
+
+def test_punto_y_perpendicular_lote_sobre_subconjunto():
+    geometrias = geometrias_aleatorias(40, seed=2)
+    coords, offsets = aplanar_geometrias(geometrias)
+    validas = [i for i, g in enumerate(geometrias) if len(g) >= 2]
+    geom_idx = np.array(validas[::3] * 2)
+    percent = np.linspace(0, 1, len(geom_idx))
+    side = np.array(['R', 'L'] * (len(geom_idx) // 2), dtype=object)
+
+    completo = punto_y_perpendicular_lote(coords, offsets, geom_idx, percent, side)
+    coords_sub, offsets_sub, idx_sub = subconjunto_geometrias(coords, offsets, geom_idx)
+    subconjunto = punto_y_perpendicular_lote(coords_sub, offsets_sub, idx_sub, percent, side)
+
+    for clave in ('punto', 'perpendicular', 'nodo_inicial'):
+        np.testing.assert_array_equal(completo[clave], subconjunto[clave])